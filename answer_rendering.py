@@ -0,0 +1,176 @@
+"""
+Server-side rendering of answers into the `vedcool-answer` HTML structure that
+the prompt asks Gemini to produce, for responses built without the LLM (the
+extractive answer mode and the degraded fallback when a request runs out of
+time) and for the compact JSON the model returns in structured output mode.
+"""
+import html
+import json
+import re
+
+_BULLET_PATTERN = re.compile(r"^\s*(?:[•\-\*]|\d+[.)])\s*")
+_SUB_BULLET_PATTERN = re.compile(r"^\s*o\s+")
+_WORD_PATTERN = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset(
+    "a an and are at be by can do does for from how i in is it me my of on or the to what when where "
+    "which who why will with you your".split()
+)
+_NAVIGATION_PREFIXES = ("navigate to", "go to")
+
+
+def split_section_content(content: str):
+    """
+    Splits manual section text into (intro lines, step lines) using its bullet markers.
+    "o" sub-bullets are folded into the step above, page numbers are dropped, and
+    non-bullet lines after the first step (notes, sub-headings) become steps of their own.
+    """
+    intro, steps = [], []
+    for line in content.splitlines():
+        line = line.strip()
+        if not line or line.isdigit():
+            continue
+        if _SUB_BULLET_PATTERN.match(line) and steps:
+            item = _SUB_BULLET_PATTERN.sub("", line, count=1)
+            steps[-1] = f"{steps[-1]}, {item}" if not steps[-1].endswith(":") else f"{steps[-1]} {item}"
+        elif _BULLET_PATTERN.match(line):
+            steps.append(_BULLET_PATTERN.sub("", line, count=1))
+        elif steps and line[0].islower():
+            # Continuation of a wrapped bullet line
+            steps[-1] = f"{steps[-1]} {line}"
+        elif steps:
+            steps.append(line if line[-1] in ".:!?" else f"{line}:")
+        else:
+            intro.append(line)
+    return intro, steps
+
+
+def content_words(text: str) -> set:
+    return {word for word in _WORD_PATTERN.findall(text.lower()) if word not in _STOPWORDS}
+
+
+def select_steps(question: str, steps: list, max_steps: int) -> list:
+    """
+    Keeps the whole procedure when it is short enough; otherwise keeps the window of
+    consecutive steps sharing the most words with the question, preceded by the
+    section's navigation step ("Navigate to X > Y") when that falls outside the window.
+    """
+    if len(steps) <= max_steps:
+        return list(steps)
+    question_words = content_words(question)
+    step_words = [content_words(step) for step in steps]
+    # Words that appear in every step (usually the section's own topic) say little about which steps to keep
+    document_frequency = {word: sum(word in words for words in step_words) for word in question_words}
+    overlaps = [
+        sum(1.0 / document_frequency[word] for word in question_words & words)
+        for words in step_words
+    ]
+
+    def best_window(size: int) -> list:
+        start = max(
+            range(len(steps) - size + 1),
+            key=lambda i: (sum(overlaps[i:i + size]), -i),
+        )
+        return steps[start:start + size]
+
+    window = best_window(max_steps)
+    navigation = next((step for step in steps if step.lower().startswith(_NAVIGATION_PREFIXES)), None)
+    if navigation is not None and navigation not in window and max_steps > 1:
+        window = [navigation] + best_window(max_steps - 1)
+    return window
+
+
+def render_answer_html(sections: list, icon: str = "📘") -> str:
+    """
+    Renders [{"title": str, "intro": str, "steps": [str, ...]}, ...] as
+    <div class='vedcool-answer'> with one <div class='section'> per entry.
+    """
+    parts = ["<div class='vedcool-answer'>"]
+    for section in sections:
+        parts.append("  <div class='section'>")
+        parts.append(f"    <p>{icon} <strong>{html.escape(section['title'])}</strong></p>")
+        if section.get("intro"):
+            parts.append(f"    <p>{html.escape(section['intro'])}</p>")
+        if section.get("steps"):
+            parts.append("    <ol>")
+            parts.extend(f"      <li>{html.escape(step)}</li>" for step in section["steps"])
+            parts.append("    </ol>")
+        parts.append("  </div>")
+    parts.append("</div>")
+    return "\n".join(parts)
+
+
+NOT_FOUND_HTML = (
+    "<div class='vedcool-answer'>\n"
+    "  <p>⚠️ <strong>Information not found</strong> in the provided manual excerpts.</p>\n"
+    "</div>"
+)
+
+MAX_STRUCTURED_SECTIONS = 10
+MAX_STRUCTURED_STEPS = 30
+MAX_STRUCTURED_TEXT_CHARS = 2000
+
+
+def parse_structured_answer(text: str) -> dict:
+    """
+    Parses and validates the model's compact JSON answer:
+    {"not_found": bool, "sections": [{"title": str, "intro": str, "steps": [str, ...]}, ...]}.
+    Raises ValueError when the output is not usable.
+    """
+    cleaned = text.strip()
+    if cleaned.startswith("```"):
+        cleaned = re.sub(r"^```(?:json)?\s*|\s*```$", "", cleaned)
+    try:
+        data = json.loads(cleaned)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Structured answer is not valid JSON: {e}") from e
+    if not isinstance(data, dict):
+        raise ValueError("Structured answer must be a JSON object.")
+
+    sections = data.get("sections") or []
+    if not isinstance(sections, list) or len(sections) > MAX_STRUCTURED_SECTIONS:
+        raise ValueError(f"'sections' must be a list of at most {MAX_STRUCTURED_SECTIONS} items.")
+    validated = []
+    for section in sections:
+        if not isinstance(section, dict) or not isinstance(section.get("title"), str) or not section["title"].strip():
+            raise ValueError("Every section needs a non-empty string 'title'.")
+        intro = section.get("intro") or ""
+        steps = section.get("steps") or []
+        if not isinstance(intro, str) or not isinstance(steps, list) or len(steps) > MAX_STRUCTURED_STEPS:
+            raise ValueError("Section 'intro' must be a string and 'steps' a list.")
+        if not all(isinstance(step, str) for step in steps):
+            raise ValueError("Section 'steps' must be strings.")
+        texts = [section["title"], intro] + steps
+        if any(len(t) > MAX_STRUCTURED_TEXT_CHARS for t in texts):
+            raise ValueError("Structured answer text is unreasonably long.")
+        validated.append({
+            "title": section["title"].strip(),
+            "intro": intro.strip(),
+            "steps": [step.strip() for step in steps if step.strip()],
+        })
+
+    not_found = bool(data.get("not_found")) or not validated
+    return {"not_found": not_found, "sections": validated}
+
+
+def render_structured_answer(text: str) -> str:
+    """Renders the model's JSON answer into the exact HTML the HTML-mode prompt asks for."""
+    answer = parse_structured_answer(text)
+    if answer["not_found"]:
+        return NOT_FOUND_HTML
+    return render_answer_html(answer["sections"])
+
+
+def render_sections_as_answer(sections_info: list, question: str = "", max_intro_chars: int = 300,
+                              max_steps: int = 8) -> str:
+    """
+    Renders retrieved manual sections ({"heading", "content", ...} dicts) verbatim,
+    keeping the steps that best match `question` when a section is long.
+    """
+    sections = []
+    for info in sections_info:
+        intro_lines, steps = split_section_content(info["content"])
+        intro = " ".join(intro_lines)
+        if len(intro) > max_intro_chars:
+            intro = intro[:max_intro_chars].rsplit(" ", 1)[0] + " …"
+        sections.append({"title": info["heading"], "intro": intro, "steps": select_steps(question, steps, max_steps)})
+    return render_answer_html(sections)
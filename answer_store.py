@@ -0,0 +1,106 @@
+"""
+Disk-backed (SQLite) store of generated answers.
+
+Each answer records the sections it was generated from together with their
+content hashes, so a restarted worker can keep serving answers whose sources
+are unchanged, and a manual update only invalidates the answers that actually
+depended on an edited or removed section.
+"""
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS answers (
+    question_key   TEXT PRIMARY KEY,
+    question       TEXT NOT NULL,
+    answer_html    TEXT NOT NULL,
+    sections       TEXT NOT NULL,
+    manual_version TEXT,
+    created_at     REAL NOT NULL,
+    hits           INTEGER NOT NULL DEFAULT 0
+)
+"""
+
+
+def normalize_question(question: str) -> str:
+    """Case-, whitespace- and trailing-punctuation-insensitive key for a question."""
+    return re.sub(r"\s+", " ", question).strip().lower().rstrip("?!. ")
+
+
+class AnswerStore:
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")  # Several workers may share the file
+        self._conn.execute(_SCHEMA)
+        self._conn.commit()
+
+    def get(self, question: str, current_hashes: dict):
+        """
+        Returns the stored answer HTML if every section it was built from still has
+        the same content hash, else None (a stale row is deleted on the way).
+        """
+        key = normalize_question(question)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT answer_html, sections FROM answers WHERE question_key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            answer_html, sections = row
+            if not self._still_valid(json.loads(sections), current_hashes):
+                self._conn.execute("DELETE FROM answers WHERE question_key = ?", (key,))
+                self._conn.commit()
+                logging.info(f"Discarded stale stored answer for '{question}'")
+                return None
+            self._conn.execute("UPDATE answers SET hits = hits + 1 WHERE question_key = ?", (key,))
+            self._conn.commit()
+        return answer_html
+
+    def has_valid(self, question: str, current_hashes: dict) -> bool:
+        """Like `get`, but neither counts a hit nor deletes stale rows."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT sections FROM answers WHERE question_key = ?", (normalize_question(question),)
+            ).fetchone()
+        return row is not None and self._still_valid(json.loads(row[0]), current_hashes)
+
+    def put(self, question: str, answer_html: str, sections: list, manual_version: str = None):
+        """`sections` is a list of (section_id, content_hash) pairs the answer was generated from."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO answers "
+                "(question_key, question, answer_html, sections, manual_version, created_at, hits) "
+                "VALUES (?, ?, ?, ?, ?, ?, 0)",
+                (normalize_question(question), question, answer_html,
+                 json.dumps([list(pair) for pair in sections]), manual_version, time.time()),
+            )
+            self._conn.commit()
+
+    def invalidate_changed(self, current_hashes: dict) -> int:
+        """Deletes answers depending on any section that changed or disappeared. Returns the count."""
+        with self._lock:
+            rows = self._conn.execute("SELECT question_key, sections FROM answers").fetchall()
+            stale = [(key,) for key, sections in rows if not self._still_valid(json.loads(sections), current_hashes)]
+            if stale:
+                self._conn.executemany("DELETE FROM answers WHERE question_key = ?", stale)
+                self._conn.commit()
+        logging.info(f"Answer store: {len(rows) - len(stale)} answers still valid, {len(stale)} invalidated")
+        return len(stale)
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    @staticmethod
+    def _still_valid(sections: list, current_hashes: dict) -> bool:
+        return all(current_hashes.get(section_id) == section_hash for section_id, section_hash in sections)
@@ -0,0 +1,256 @@
+"""
+Bulk, offline answering of a question file, e.g. the curated FAQ questions
+regenerated for the knowledge-base export.
+
+Questions are streamed from JSONL ({"id": ..., "question": ..., "scope": ...};
+"id" defaults to the line number) in batches. For each batch, heading-like
+questions are matched locally and the rest are embedded with batched
+embed_content calls and searched with one matrix product. Answers are then
+generated on a thread pool; every call is still admitted by the shared rate
+scheduler, so the job can run next to live traffic without exceeding quota.
+Retrieval of the next batch overlaps with generation of the previous one.
+
+Each result is appended to the output JSONL (and flushed) as soon as it is
+ready, so an interrupted job is simply re-run: ids that already have an answer
+in the output are skipped, failed ones are retried. On resume the output is
+first compacted to one record per answered id (error records are dropped, as
+their ids are about to be retried), so every id ends with exactly one record.
+A throughput report is printed at the end.
+
+    python batch_answer.py faq.jsonl answers.jsonl --batch-size 64 --concurrency 8
+    python batch_answer.py faq.jsonl answers.jsonl --fake     # offline, with the fake provider
+"""
+import argparse
+import json
+import logging
+import os
+import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import numpy as np
+
+
+def read_questions(path: str):
+    """Yields {"id", "question", "scope"} records; malformed lines are logged and skipped."""
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                logging.warning(f"Skipping line {line_number} of '{path}': not valid JSON")
+                continue
+            question = str(record.get("question", "")).strip()
+            if not question:
+                logging.warning(f"Skipping line {line_number} of '{path}': no question")
+                continue
+            yield {"id": str(record.get("id", line_number)), "question": question, "scope": record.get("scope")}
+
+
+def compact_output(output_path: str) -> set:
+    """
+    Rewrites `output_path` to hold one answer record per id, dropping error records, duplicates
+    and a partly written last line (from a crash). Returns the answered ids.
+    """
+    if not os.path.exists(output_path):
+        return set()
+    answers, lines, partial = {}, 0, False
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.endswith("\n"):
+                partial = True
+                break
+            lines += 1
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if "answer" in record:
+                answers.setdefault(str(record["id"]), line)
+    if partial or lines != len(answers):
+        tmp_path = f"{output_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.writelines(answers.values())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, output_path)
+        logging.info(f"Compacted '{output_path}': {lines} record(s) -> {len(answers)} answered id(s)")
+    return set(answers)
+
+
+def batches(items, size: int):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def retrieve_batch(index, batch: list, top_n: int) -> tuple:
+    """
+    Candidates per question id for one batch, plus {id: error} for questions that
+    could not be retrieved (unknown scope, failed embedding call).
+    """
+    import chatbot
+
+    candidates, errors, to_search = {}, {}, []
+    for item in batch:
+        try:
+            item["scope_node"] = chatbot.resolve_scope(index, item["scope"])
+        except ValueError as e:
+            errors[item["id"]] = str(e)
+            continue
+        matched = chatbot.heading_candidates(index, item["question"], top_n, item["scope_node"]) \
+            if chatbot.HEADING_FAST_PATH else []
+        if matched:
+            candidates[item["id"]] = matched
+        else:
+            to_search.append(item)
+    if not to_search:
+        return candidates, errors
+
+    try:
+        embeddings = chatbot.get_question_embeddings([item["question"] for item in to_search])
+    except Exception as e:
+        logging.error(f"Batch embedding of {len(to_search)} questions failed: {e}")
+        errors.update({item["id"]: f"embedding failed: {e}" for item in to_search})
+        return candidates, errors
+
+    unscoped = [(item, embedding) for item, embedding in zip(to_search, embeddings) if not item["scope_node"]]
+    searched = chatbot.batch_section_candidates(index, [embedding for _, embedding in unscoped], top_n)
+    for (item, _), found in zip(unscoped, searched):
+        candidates[item["id"]] = found
+    for item, embedding in zip(to_search, embeddings):
+        if item["scope_node"]:
+            candidates[item["id"]] = chatbot.section_candidates(index, embedding, top_n, item["scope_node"])
+    return candidates, errors
+
+
+def answer_one(index, item: dict, candidates: list, mode: str, threshold: float, top_n: int, answer_store) -> dict:
+    import chatbot
+
+    started = time.monotonic()
+    answer = chatbot.answer_question(
+        item["question"], index, threshold=threshold, top_n=top_n, answer_store=answer_store,
+        mode=mode, scope=item["scope"], candidates=candidates,
+    )
+    return {"answer": answer, "sections": [candidate["section_id"] for candidate in candidates],
+            "seconds": round(time.monotonic() - started, 3)}
+
+
+def run_batch_job(input_path: str, output_path: str, index, batch_size: int = 64, concurrency: int = 8,
+                  mode: str = "llm", threshold: float = 0.40, top_n: int = 3, answer_store=None) -> dict:
+    import chatbot
+
+    done = compact_output(output_path)
+    stats = {"read": 0, "skipped_done": 0, "answered": 0, "failed": 0, "batches": 0}
+    generation_seconds = []
+    tokens_before = chatbot.token_counter.stats()["totals"]
+    started = time.monotonic()
+
+    with open(output_path, "a", encoding="utf-8") as out, ThreadPoolExecutor(concurrency, thread_name_prefix="batch") as pool:
+        in_flight = {}
+
+        def write(record: dict):
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+
+        def drain(max_in_flight: int):
+            while len(in_flight) > max_in_flight:
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    item = in_flight.pop(future)
+                    record = {"id": item["id"], "question": item["question"], "scope": item["scope"]}
+                    try:
+                        record.update(future.result())
+                        stats["answered"] += 1
+                        generation_seconds.append(record["seconds"])
+                    except Exception as e:
+                        logging.error(f"Answering '{item['question']}' failed: {e}")
+                        record["error"] = str(e)
+                        stats["failed"] += 1
+                    write(record)
+
+        for batch in batches(read_questions(input_path), batch_size):
+            stats["read"] += len(batch)
+            pending = [item for item in batch if item["id"] not in done]
+            stats["skipped_done"] += len(batch) - len(pending)
+            if not pending:
+                continue
+            stats["batches"] += 1
+            candidates, errors = retrieve_batch(index, pending, top_n)
+            for item in pending:
+                if item["id"] in errors:
+                    write({"id": item["id"], "question": item["question"], "scope": item["scope"],
+                           "error": errors[item["id"]]})
+                    stats["failed"] += 1
+                    continue
+                future = pool.submit(answer_one, index, item, candidates[item["id"]], mode, threshold, top_n, answer_store)
+                in_flight[future] = item
+            # Keep the pool busy while the next batch is retrieved, without reading the whole file ahead
+            drain(max(concurrency, batch_size))
+            os.fsync(out.fileno())
+            elapsed = time.monotonic() - started
+            logging.info(f"Batch {stats['batches']}: {stats['answered']} answered, {stats['failed']} failed, "
+                         f"{stats['answered'] / elapsed:.2f} questions/s")
+        drain(0)
+        os.fsync(out.fileno())
+
+    elapsed = time.monotonic() - started
+    tokens_after = chatbot.token_counter.stats()["totals"]
+    stats["elapsed_s"] = round(elapsed, 2)
+    stats["questions_per_s"] = round(stats["answered"] / elapsed, 2) if elapsed > 0 else 0.0
+    if generation_seconds:
+        p50, p95 = np.percentile(generation_seconds, [50, 95])
+        stats["answer_seconds"] = {"p50": round(float(p50), 3), "p95": round(float(p95), 3)}
+    stats["tokens"] = {
+        kind: tokens_after[kind]["tokens"] - tokens_before.get(kind, {}).get("tokens", 0)
+        for kind in tokens_after
+    }
+    stats["questions_embedded_remotely"] = (
+        tokens_after.get("embedding_input", {}).get("count", 0)
+        - tokens_before.get("embedding_input", {}).get("count", 0)
+    )
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Answer a JSONL file of questions in bulk")
+    parser.add_argument("input", help="JSONL with 'question' (and optional 'id', 'scope') per line")
+    parser.add_argument("output", help="JSONL results; appended to, so a re-run resumes")
+    parser.add_argument("--batch-size", type=int, default=64, help="Questions retrieved together")
+    parser.add_argument("--concurrency", type=int, default=8, help="Answers generated in parallel")
+    parser.add_argument("--mode", choices=["llm", "extractive", "auto"], default="llm")
+    parser.add_argument("--threshold", type=float, default=0.40)
+    parser.add_argument("--top-n", type=int, default=3)
+    parser.add_argument("--use-store", action="store_true", help="Reuse and persist answers in the answer store")
+    parser.add_argument("--fake", action="store_true", help="Use the local fake provider instead of Gemini")
+    args = parser.parse_args()
+
+    cache_file = None
+    if args.fake:
+        os.environ.setdefault("GEMINI_API_KEY", "fake-key-for-batch")
+        import fake_genai
+        fake_genai.install()
+        cache_file = os.path.join(tempfile.mkdtemp(prefix="vedcool-batch-"), "embeddings.pkl")
+
+    import chatbot
+    from answer_store import AnswerStore
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    section_index = chatbot.load_section_index(cache_file or chatbot.EMBEDDINGS_CACHE_FILE)
+    store = None
+    if args.use_store and chatbot.ANSWER_STORE_FILE:
+        store = AnswerStore(chatbot.ANSWER_STORE_FILE)
+        store.invalidate_changed(section_index.section_hashes())
+    report = run_batch_job(
+        args.input, args.output, section_index, batch_size=args.batch_size, concurrency=args.concurrency,
+        mode=args.mode, threshold=args.threshold, top_n=args.top_n, answer_store=store,
+    )
+    print(json.dumps(report, indent=2))
@@ -0,0 +1,79 @@
+"""
+Benchmark for SectionIndex storage dtypes: memory, search latency and recall@k.
+
+Uses the real section embeddings from the Gemini cache, tiled with small random
+perturbations up to --rows vectors to simulate many manuals / chunked passages.
+Queries are perturbed copies of random rows; ground truth is an exact float64
+search. Each quantised dtype is measured with and without float32 re-scoring.
+
+    python bench_index.py --rows 50000 --queries 200 --k 3
+"""
+import argparse
+import pickle
+import time
+
+import numpy as np
+
+from vector_index import SectionIndex
+
+
+def load_base_vectors(cache_file: str) -> np.ndarray:
+    with open(cache_file, "rb") as f:
+        cached = pickle.load(f)
+    return np.vstack([embedding for _, _, embedding in cached]).astype(np.float64)
+
+
+def synthesize(base: np.ndarray, rows: int, noise: float, rng: np.random.Generator) -> np.ndarray:
+    picks = rng.integers(0, len(base), size=rows)
+    vectors = base[picks] + rng.normal(0.0, noise, size=(rows, base.shape[1]))
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def exact_top_k(vectors: np.ndarray, queries: np.ndarray, k: int) -> list:
+    scores = queries @ vectors.T
+    return [set(np.argsort(-row)[:k]) for row in scores]
+
+
+def bench(index: SectionIndex, queries: np.ndarray, truth: list, k: int) -> dict:
+    row_of = {heading: i for i, heading in enumerate(index.headings)}
+    hits = 0
+    started = time.perf_counter()
+    for query, expected in zip(queries, truth):
+        found = {row_of[heading] for _, heading, _ in index.search(query, top_n=k)}
+        hits += len(found & expected)
+    elapsed = time.perf_counter() - started
+    return {
+        "bytes": index.nbytes()["scan_vectors"],
+        "rescore_bytes": index.nbytes()["rescore_vectors_in_memory"],
+        "ms_per_query": elapsed * 1000.0 / len(queries),
+        "recall": hits / (k * len(queries)),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark quantised SectionIndex storage")
+    parser.add_argument("--cache", default="gemini_embeddings_cache.pkl")
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--noise", type=float, default=0.01, help="Per-dimension noise for synthetic rows")
+    parser.add_argument("--rescore", type=int, default=20, help="Candidates re-scored in float32")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    vectors = synthesize(load_base_vectors(args.cache), args.rows, args.noise, rng)
+    queries = vectors[rng.integers(0, args.rows, size=args.queries)]
+    queries = queries + rng.normal(0.0, args.noise, size=queries.shape)
+    truth = exact_top_k(vectors, queries, args.k)
+
+    headings = [f"row-{i}" for i in range(args.rows)]
+    contents = [""] * args.rows
+    print(f"{args.rows} vectors x {vectors.shape[1]} dims; float64 baseline = {vectors.nbytes / 1e6:.1f} MB")
+    print("(re-score vectors are held in memory here; the app memory-maps them from disk)")
+    print(f"{'dtype':>8} {'rescore':>8} {'scan MB':>8} {'ms/query':>9} {'recall@' + str(args.k):>9}")
+    for dtype in ("float32", "float16", "int8"):
+        for rescore in ((0,) if dtype == "float32" else (0, args.rescore)):
+            index = SectionIndex(headings, contents, vectors, dtype=dtype, rescore_candidates=rescore)
+            result = bench(index, queries, truth, args.k)
+            print(f"{dtype:>8} {rescore:>8} {result['bytes'] / 1e6:8.1f} {result['ms_per_query']:9.3f} {result['recall']:9.3f}")
@@ -0,0 +1,427 @@
+"""
+Pluggable cache for question embeddings, retrieval results and answers.
+
+A cache in one worker only helps that worker, so with N replicas the hit rate
+drops roughly N-fold. `TieredCache` checks a list of backends in order and
+back-fills the faster ones on a hit:
+
+- InProcessCache: LRU dict in this process (fastest, not shared).
+- DiskCache: SQLite file shared by the workers on one host.
+- RedisCache: any server speaking the Redis protocol, shared by every replica.
+  Uses redis-py when installed, else the minimal `RespClient` below.
+  `FakeRedisServer` is a local, in-memory server for testing it.
+
+Keys are namespaced by kind of value and by the version it depends on (the manual
+version, or the embedding model for question embeddings), so entries of an old
+manual are never served and simply age out. Values shared through disk or Redis
+are encoded as JSON, or as raw float32 bytes for embeddings, never pickled. Every
+tier counts hits, misses, errors and time spent, and a failing tier is treated
+as a miss rather than failing the request.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import socket
+import socketserver
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+import numpy as np
+
+try:
+    import redis
+except ImportError:  # Optional; the built-in RespClient is used without it
+    redis = None
+
+CACHE_TIERS = ("memory", "disk", "redis", "fake-redis")
+
+
+# --- Value encoding (disk and Redis tiers) ---
+def encode_value(value) -> bytes:
+    if isinstance(value, np.ndarray):
+        return b"N" + np.asarray(value, dtype=np.float32).tobytes()
+    return b"J" + json.dumps(value, ensure_ascii=False).encode("utf-8")
+
+
+def decode_value(raw: bytes):
+    if raw[:1] == b"N":
+        return np.frombuffer(raw[1:], dtype=np.float32).copy()
+    return json.loads(raw[1:].decode("utf-8"))
+
+
+# --- Backends ---
+class InProcessCache:
+    name = "memory"
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._data = OrderedDict()  # key -> (value, expires_at)
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            if entry[1] is not None and time.time() >= entry[1]:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return entry[0]
+
+    def set(self, key: str, value, ttl: float = None):
+        with self._lock:
+            self._data[key] = (value, time.time() + ttl if ttl else None)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def describe(self) -> dict:
+        with self._lock:
+            values = [value for value, _ in self._data.values()]
+        return {
+            "entries": len(values),
+            "max_entries": self.max_entries,
+            "embedding_bytes": sum(value.nbytes for value in values if isinstance(value, np.ndarray)),
+        }
+
+
+class DiskCache:
+    name = "disk"
+    _SCHEMA = "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL)"
+
+    def __init__(self, path: str, max_entries: int = 100000, trim_every: int = 1000):
+        self.path = path
+        self.max_entries = max_entries
+        self.trim_every = trim_every
+        self._sets = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")  # Several workers may share the file
+        self._conn.execute(self._SCHEMA)
+        self._conn.commit()
+
+    def get(self, key: str):
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None or (row[1] is not None and time.time() >= row[1]):
+            return None
+        return decode_value(row[0])
+
+    def set(self, key: str, value, ttl: float = None):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, encode_value(value), time.time() + ttl if ttl else None),
+            )
+            self._sets += 1
+            if self._sets % self.trim_every == 0:
+                self._trim()
+            self._conn.commit()
+
+    def _trim(self):
+        self._conn.execute("DELETE FROM cache WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),))
+        self._conn.execute(
+            "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY rowid LIMIT "
+            "max(0, (SELECT count(*) FROM cache) - ?))",
+            (self.max_entries,),
+        )
+
+    def describe(self) -> dict:
+        with self._lock:
+            entries = self._conn.execute("SELECT count(*) FROM cache").fetchone()[0]
+        return {"entries": entries, "max_entries": self.max_entries, "path": self.path}
+
+
+class RedisCache:
+    name = "redis"
+
+    def __init__(self, client):
+        self.client = client
+
+    def get(self, key: str):
+        raw = self.client.get(key)
+        return decode_value(raw) if raw is not None else None
+
+    def set(self, key: str, value, ttl: float = None):
+        self.client.set(key, encode_value(value), px=int(ttl * 1000) if ttl else None)
+
+    def describe(self) -> dict:
+        return {"client": type(self.client).__name__}
+
+
+# --- Minimal Redis protocol client and fake server ---
+class RespClient:
+    """The GET/SET/DEL/PING subset of a Redis client, one connection per thread."""
+
+    def __init__(self, host: str = "localhost", port: int = 6379, db: int = 0, timeout: float = 1.0):
+        self.host, self.port, self.db, self.timeout = host, port, db, timeout
+        self._local = threading.local()
+
+    @classmethod
+    def from_url(cls, url: str, timeout: float = 1.0) -> "RespClient":
+        parsed = urlparse(url)
+        db = int(parsed.path.lstrip("/") or 0)
+        return cls(parsed.hostname or "localhost", parsed.port or 6379, db, timeout)
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            conn = self._local.conn = (sock, sock.makefile("rb"))
+            if self.db:
+                self._call(conn, "SELECT", self.db)
+        return conn
+
+    def execute(self, *args):
+        conn = self._connection()
+        try:
+            return self._call(conn, *args)
+        except (OSError, ConnectionError):
+            self._local.conn = None  # Reconnect on the next call
+            conn[0].close()
+            raise
+
+    @staticmethod
+    def _call(conn, *args):
+        sock, reader = conn
+        parts = [a if isinstance(a, bytes) else str(a).encode("utf-8") for a in args]
+        sock.sendall(b"*%d\r\n" % len(parts) + b"".join(b"$%d\r\n%s\r\n" % (len(p), p) for p in parts))
+        return read_reply(reader)
+
+    def ping(self):
+        return self.execute("PING") == "PONG"
+
+    def get(self, key):
+        return self.execute("GET", key)
+
+    def set(self, key, value, nx: bool = False, px: int = None, ex: int = None):
+        args = ["SET", key, value]
+        if px is not None:
+            args += ["PX", px]
+        if ex is not None:
+            args += ["EX", ex]
+        if nx:
+            args.append("NX")
+        return self.execute(*args) == "OK" or None
+
+    def delete(self, *keys):
+        return self.execute("DEL", *keys)
+
+
+def read_reply(reader):
+    line = reader.readline()
+    if not line:
+        raise ConnectionError("Connection closed by server")
+    kind, rest = line[:1], line[1:-2]
+    if kind == b"+":
+        return rest.decode("utf-8")
+    if kind == b"-":
+        raise ConnectionError(f"Server error: {rest.decode('utf-8')}")
+    if kind == b":":
+        return int(rest)
+    if kind == b"$":
+        length = int(rest)
+        if length < 0:
+            return None
+        data = reader.read(length + 2)
+        return data[:-2]
+    if kind == b"*":
+        length = int(rest)
+        return None if length < 0 else [read_reply(reader) for _ in range(length)]
+    raise ConnectionError(f"Unexpected reply {line!r}")
+
+
+class FakeRedisServer:
+    """
+    In-memory server speaking the Redis protocol (PING, SELECT, GET, SET with
+    EX/PX/NX, DEL, DBSIZE, FLUSHDB) on a local port, for testing shared tiers
+    with real sockets and several processes.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self._data = {}  # key -> (value, expires_at)
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                while True:
+                    try:
+                        command = read_reply(self.rfile)
+                    except ConnectionError:
+                        return
+                    self.wfile.write(server._execute(command))
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self._server = socketserver.ThreadingTCPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self.host, self.port = self._server.server_address
+        self.url = f"redis://{self.host}:{self.port}/0"
+
+    def _alive(self, key):
+        value, expires_at = self._data.get(key, (None, None))
+        if expires_at is not None and time.time() >= expires_at:
+            self._data.pop(key, None)
+            return None
+        return value
+
+    def _execute(self, command) -> bytes:
+        if not isinstance(command, list) or not command:
+            return b"-ERR protocol error\r\n"
+        name, args = command[0].upper(), command[1:]
+        with self._lock:
+            if name in (b"PING", b"SELECT"):
+                return b"+PONG\r\n" if name == b"PING" else b"+OK\r\n"
+            if name == b"GET":
+                value = self._alive(args[0])
+                return b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value), value)
+            if name == b"SET":
+                key, value, options = args[0], args[1], [a.upper() for a in args[2:]]
+                if b"NX" in options and self._alive(key) is not None:
+                    return b"$-1\r\n"
+                ttl = None
+                if b"PX" in options:
+                    ttl = int(args[2 + options.index(b"PX") + 1]) / 1000.0
+                elif b"EX" in options:
+                    ttl = float(args[2 + options.index(b"EX") + 1])
+                self._data[key] = (value, time.time() + ttl if ttl is not None else None)
+                return b"+OK\r\n"
+            if name == b"DEL":
+                return b":%d\r\n" % sum(1 for key in args if self._data.pop(key, None) is not None)
+            if name == b"DBSIZE":
+                return b":%d\r\n" % sum(1 for key in list(self._data) if self._alive(key) is not None)
+            if name == b"FLUSHDB":
+                self._data.clear()
+                return b"+OK\r\n"
+        return b"-ERR unknown command '%s'\r\n" % name
+
+    def start(self) -> "FakeRedisServer":
+        threading.Thread(target=self.serve_forever, name="fake-redis", daemon=True).start()
+        return self
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+# --- Tiered cache ---
+class TieredCache:
+    def __init__(self, tiers: list, ttl_seconds: float = None, prefix: str = "vedcool:cache:"):
+        self.tiers = list(tiers)
+        self.ttl_seconds = ttl_seconds
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._tier_stats = [
+            {"tier": tier.name, "hits": 0, "misses": 0, "errors": 0, "sets": 0, "get_seconds": 0.0, "set_seconds": 0.0}
+            for tier in self.tiers
+        ]
+        self._namespace_stats = {}
+
+    def key(self, namespace: str, version: str, key: str) -> str:
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return f"{self.prefix}{namespace}:{version}:{digest}"
+
+    def _timed(self, position: int, action: str, call):
+        started = time.perf_counter()
+        try:
+            return call(), None
+        except Exception as e:
+            return None, e
+        finally:
+            with self._lock:
+                self._tier_stats[position][f"{action}_seconds"] += time.perf_counter() - started
+
+    def get(self, namespace: str, version: str, key: str):
+        """The cached value, from the first tier that has it (faster tiers are back-filled), or None."""
+        full_key = self.key(namespace, version, key)
+        value, found_at = None, None
+        for position, tier in enumerate(self.tiers):
+            value, error = self._timed(position, "get", lambda: tier.get(full_key))
+            with self._lock:
+                stats = self._tier_stats[position]
+                if error is not None:
+                    stats["errors"] += 1
+                elif value is None:
+                    stats["misses"] += 1
+                else:
+                    stats["hits"] += 1
+            if error is not None:
+                logging.warning(f"Cache tier '{tier.name}' failed on get: {error}")
+            if value is not None:
+                found_at = position
+                break
+        for position in range(found_at or 0):
+            self._set_tier(position, full_key, value)
+        with self._lock:
+            stats = self._namespace_stats.setdefault(namespace, {"lookups": 0, "hits": 0})
+            stats["lookups"] += 1
+            stats["hits"] += 1 if value is not None else 0
+        return value
+
+    def set(self, namespace: str, version: str, key: str, value):
+        full_key = self.key(namespace, version, key)
+        for position in range(len(self.tiers)):
+            self._set_tier(position, full_key, value)
+
+    def _set_tier(self, position: int, full_key: str, value):
+        tier = self.tiers[position]
+        _, error = self._timed(position, "set", lambda: tier.set(full_key, value, self.ttl_seconds))
+        with self._lock:
+            self._tier_stats[position]["errors" if error is not None else "sets"] += 1
+        if error is not None:
+            logging.warning(f"Cache tier '{tier.name}' failed on set: {error}")
+
+    def tier(self, name: str):
+        return next((tier for tier in self.tiers if tier.name == name), None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            tiers = [dict(stats) for stats in self._tier_stats]
+            namespaces = {name: dict(stats) for name, stats in self._namespace_stats.items()}
+        for stats in tiers:
+            lookups = stats["hits"] + stats["misses"]
+            stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+            stats["mean_get_ms"] = 1000 * stats["get_seconds"] / max(1, lookups + stats["errors"])
+            stats["mean_set_ms"] = 1000 * stats["set_seconds"] / max(1, stats["sets"])
+        for stats in namespaces.values():
+            stats["hit_rate"] = stats["hits"] / stats["lookups"] if stats["lookups"] else 0.0
+        return {"tiers": tiers, "namespaces": namespaces}
+
+    def describe(self) -> list:
+        return [{"tier": tier.name, **tier.describe()} for tier in self.tiers]
+
+
+def build_cache(tiers, ttl_seconds: float = None, memory_max_entries: int = 10000,
+                disk_path: str = None, redis_url: str = None) -> TieredCache:
+    backends = []
+    for kind in tiers:
+        if kind == "memory":
+            backends.append(InProcessCache(memory_max_entries))
+        elif kind == "disk":
+            backends.append(DiskCache(disk_path))
+        elif kind == "redis":
+            client = redis.Redis.from_url(redis_url) if redis is not None else RespClient.from_url(redis_url)
+            backends.append(RedisCache(client))
+        elif kind == "fake-redis":
+            backends.append(RedisCache(RespClient.from_url(FakeRedisServer().start().url)))
+        else:
+            raise ValueError(f"Unknown cache tier '{kind}'. Expected one of {CACHE_TIERS}.")
+    return TieredCache(backends, ttl_seconds)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local fake Redis server for shared cache tiers")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6379)
+    args = parser.parse_args()
+    server = FakeRedisServer(args.host, args.port)
+    print(f"Fake Redis server listening on {server.url}")
+    server.serve_forever()
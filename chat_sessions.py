@@ -0,0 +1,97 @@
+"""
+Bounded in-memory store of multi-turn chat sessions.
+
+A session keeps its last few turns (question, answer, the index rows that were
+retrieved and the section ids first sent to the model in that turn), so a
+follow-up such as "and how do I edit it?" can be answered against the sections
+already retrieved instead of a fresh search, and the prompt only has to carry
+sections the conversation hasn't seen yet. Sessions expire after a period of
+inactivity and the least recently used ones are evicted beyond a size cap.
+"""
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+
+class ChatSession:
+    def __init__(self, session_id: str, max_turns: int):
+        self.session_id = session_id
+        self.turns = deque(maxlen=max_turns)
+        self.last_used = time.monotonic()
+        self.lock = threading.Lock()  # One turn at a time per session
+
+    def add_turn(self, question: str, prompt: str, answer: str, rows: list, new_section_ids: list):
+        """`prompt` and `answer` are what the model saw and said; they are replayed as history."""
+        self.turns.append({
+            "question": question,
+            "prompt": prompt,
+            "answer": answer,
+            "rows": list(rows),
+            "new_section_ids": list(new_section_ids),
+        })
+
+    def history_contents(self) -> list:
+        """Retained turns as Gemini `contents` entries, oldest first."""
+        contents = []
+        for turn in self.turns:
+            contents.append({"role": "user", "parts": [turn["prompt"]]})
+            contents.append({"role": "model", "parts": [turn["answer"]]})
+        return contents
+
+    def retrieved_rows(self) -> list:
+        """Index rows retrieved in the retained turns, most recent turn first."""
+        rows = []
+        for turn in reversed(self.turns):
+            rows.extend(row for row in turn["rows"] if row not in rows)
+        return rows
+
+    def sent_section_ids(self) -> set:
+        """Sections whose text is already in the retained conversation history."""
+        return {section_id for turn in self.turns for section_id in turn["new_section_ids"]}
+
+    def last_question(self):
+        return self.turns[-1]["question"] if self.turns else None
+
+
+class SessionStore:
+    def __init__(self, ttl_seconds: float = 1800.0, max_sessions: int = 10000, max_turns: int = 6):
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self.max_turns = max_turns
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _evict_expired(self, now: float):
+        while self._sessions:
+            oldest = next(iter(self._sessions.values()))
+            if now - oldest.last_used < self.ttl_seconds:
+                break
+            self._sessions.popitem(last=False)
+
+    def get_or_create(self, session_id: str = None) -> ChatSession:
+        """
+        Returns the live session `session_id`, or a new one if it is unknown or expired. New sessions
+        always get a server-generated id; a client-supplied id is never adopted.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._evict_expired(now)
+            session = self._sessions.get(session_id) if session_id else None
+            if session is None:
+                session = ChatSession(uuid.uuid4().hex, self.max_turns)
+                self._sessions[session.session_id] = session
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+            session.last_used = now
+            self._sessions.move_to_end(session.session_id)
+            return session
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def __len__(self):
+        with self._lock:
+            self._evict_expired(time.monotonic())
+            return len(self._sessions)
@@ -1,17 +1,40 @@
 import re
+import datetime
 import numpy as np
-from scipy.spatial.distance import cosine
 import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
 import logging
 import pickle
 import os
 import time
 import sys
-from tenacity import retry, stop_after_attempt, wait_random_exponential, retry_if_exception_type
+import threading
+from collections import deque
+from tenacity import (
+    retry, stop_after_attempt, stop_any, wait_random_exponential,
+    retry_if_exception_type, retry_if_not_exception_type,
+)
+from answer_rendering import render_sections_as_answer, render_structured_answer
+from answer_store import AnswerStore, normalize_question
+from cache_backends import build_cache
+from chat_sessions import SessionStore
+from context_selection import select_context_sections
+from deadline import Deadline, DeadlineExceeded
+from dedup import CompactTexts, dedup_report, near_duplicate_groups
+from embedding_batcher import EmbeddingBatcher
+from heading_index import HeadingIndex
+from hedging import HedgedCaller, LatencyTracker
+from rate_limiter import QuotaWaitTooLong, RateScheduler, build_backend
+from retrieval_client import RetrievalClient, RetrievalServiceError
+from section_tree import SectionTree, outline_levels, section_paths
+from structured_logging import log_event
+from suggest_index import SuggestIndex
+from token_counting import TokenCounter, token_counts_path_for
+from vector_index import SectionIndex, full_precision_path_for, make_section_ids, projection_recall_report
 
 # --- Configuration & Setup ---
-# IMPORTANT: Replace with your actual Google AI API key
-GEMINI_API_KEY = ""  # Replace this with your real Gemini API key
+# IMPORTANT: Replace with your actual Google AI API key (or set GEMINI_API_KEY in the environment)
+GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY", "")  # Replace this with your real Gemini API key
 
 if GEMINI_API_KEY == "YOUR_ACTUAL_GEMINI_API_KEY" or not GEMINI_API_KEY:
     logging.error("CRITICAL ERROR: Please replace 'YOUR_ACTUAL_GEMINI_API_KEY' with your actual Gemini API key in the script.")
@@ -27,6 +50,113 @@ EMBEDDINGS_CACHE_FILE = "gemini_embeddings_cache.pkl"
 EMBEDDING_MODEL = "models/text-embedding-004"  # Gemini embedding model
 CHAT_MODEL = "gemini-2.0-flash"  # Gemini chat model
 MAX_TOKENS_FOR_EMBEDDING = 8000  # Adjusted for Gemini
+EMBED_BATCH_MAX = 100  # Texts per batched embed_content call (the API's per-request limit)
+EMBED_MICROBATCHING = True  # Concurrent question embeddings share one embed_content call
+EMBED_MICROBATCH_WINDOW_SECONDS = 0.005  # Longest a question waits for others to join its batch
+EMBED_MICROBATCH_MAX = 32  # A full micro-batch is sent without waiting out the window
+TOKEN_CALIBRATION_SAMPLES = 8  # Sections counted with the provider's count-tokens API to calibrate the local estimator (0 = off)
+REQUEST_DEADLINE_SECONDS = 20.0  # Total budget for one /ask; bounds p99 latency
+DEADLINE_MIN_ATTEMPT_SECONDS = 0.5  # Don't start a remote call or retry with less budget than this
+ANSWER_MODES = ("llm", "extractive", "auto")  # "extractive" renders manual steps directly, without Gemini
+DEFAULT_ANSWER_MODE = "llm"  # Mode used by /ask when the request doesn't pick one ("auto" only once EXTRACTIVE_AUTO_SIMILARITY is measured)
+EXTRACTIVE_AUTO_SIMILARITY = 0.85  # "auto" answers extractively when the top section is at least this similar
+EXTRACTIVE_MAX_SECTIONS = 1  # Sections rendered by an extractive answer
+EXTRACTIVE_MAX_STEPS = 8  # Steps kept per section by an extractive or degraded answer
+LOG_NONBLOCKING = True  # API request threads hand log records to a queue; a listener thread writes them
+LOG_QUEUE_SIZE = 10000  # Records beyond this are dropped (and counted) rather than blocking a request
+LOG_FORMAT = "text"  # "text" or "json" (one object per line, with the structured fields)
+LOG_DETAIL_SAMPLE_RATE = 0.05  # Share of requests whose per-request detail lines (similarities, sections) are logged
+GEMINI_DEGRADED_FAILURES = 3  # Failed generation attempts within the window that mark Gemini as degraded
+GEMINI_DEGRADED_WINDOW_SECONDS = 60.0
+CACHE_TIERS = ("memory",)  # Cache tiers checked in order: "memory", "disk" (workers on this host), "redis" (all replicas), "fake-redis"
+CACHE_TTL_SECONDS = 86400.0  # Lifetime of cached question embeddings, retrieval results and answers
+CACHE_MEMORY_MAX_ENTRIES = 4096  # In-process LRU tier
+CACHE_DISK_FILE = "response_cache.sqlite3"  # SQLite file of the "disk" tier
+CACHE_REDIS_URL = "redis://localhost:6379/1"  # Server of the "redis" tier
+CACHE_ANSWERS = True  # Serve repeated questions from the "answer" namespace (generated answers only)
+ANSWER_STORE_FILE = "answer_store.sqlite3"  # Persistent answers (SQLite); set to None to disable
+WARMUP_QUESTION_LOG = None  # Question log to precompute popular answers from at startup
+WARMUP_LIMIT = 200  # Most frequent logged questions to warm
+WARMUP_RATE_PER_SECOND = 1.0  # Pace of warm-up questions sent to Gemini
+WARMUP_BEFORE_READY = False  # Warm synchronously during startup instead of in the background
+READINESS_PROBE_QUESTION = "How do I log in?"  # Embedded once before /readyz reports ready (None to skip)
+RATE_LIMIT_BACKEND = "memory"  # "memory", "file" (all workers on this host), "redis" (all replicas) or None
+RATE_LIMIT_FILE = "gemini_rate_limit.json"  # Bucket state for the "file" backend
+RATE_LIMIT_REDIS_URL = "redis://localhost:6379/0"  # Server for the "redis" backend
+GEMINI_QUOTAS = {  # Per-minute quotas shared by every worker using the same backend
+    "embed": {"requests_per_minute": 1500, "tokens_per_minute": 0},
+    "generate": {"requests_per_minute": 2000, "tokens_per_minute": 4_000_000},
+}
+CONTEXT_SELECTION = "fixed"  # "fixed" keeps all above threshold; "adaptive" cuts at a sharp similarity drop (measure with eval_context.py first)
+CONTEXT_TOKEN_BUDGET = 1500  # Max manual-section tokens per prompt under adaptive selection
+CONTEXT_MAX_RELATIVE_GAP = 0.08  # Cut when a candidate scores this much (relatively) below the previous one
+CONTEXT_MIN_RELATIVE_SCORE = 0.90  # Cut candidates scoring under this fraction of the best match
+GENERATION_OUTPUT_FORMAT = "html"  # "html" (model writes the markup) or "json" (compact sections, rendered server-side)
+USE_CONTEXT_CACHE = True  # Cache SYSTEM_INSTRUCTION server-side when the model supports context caching
+CONTEXT_CACHE_TTL_SECONDS = 3600  # Lifetime of the cached instruction; refreshed shortly before expiry
+GENERATION_HEDGING = False  # Send a second generate_content call when the first one is slow
+HEDGE_PERCENTILE = 95.0  # Hedge once a call is slower than this percentile of recent latencies
+HEDGE_MAX_RATIO = 0.05  # At most this fraction of generation calls may be hedged
+HEDGE_MIN_SAMPLES = 20  # Latency samples needed before hedging starts
+HEDGE_MIN_DELAY_SECONDS = 0.5  # Never hedge sooner than this
+INDEX_STORAGE_DTYPE = "float32"  # "float32", "int8" (4x smaller, ~2x slower scan; the compact choice) or "float16" (2x smaller, ~10x slower scan); quantised scans are re-scored in float32
+INDEX_RESCORE_CANDIDATES = 20  # Candidates re-scored at full precision when the index is quantised
+INDEX_PROJECTION = None  # None, "truncate" (Matryoshka-style) or "pca" to search reduced-dimension vectors
+INDEX_PROJECTION_DIM = 256  # Scan dimension when INDEX_PROJECTION is set
+DEDUP_SIMILARITY = 0.8  # Word-shingle Jaccard similarity at which sections count as near-duplicates
+INDEX_MERGE_DUPLICATES = False  # Keep one vector per near-duplicate group (others answer through it)
+INDEX_COMPACT_TEXT = True  # Store repeated lines of section text once, when that saves memory
+INDEX_PROJECTION_REPORT_DIMS = (64, 128, 256, 384, 512)  # Dimensions covered by the build-time recall report
+ROLE_HEADING_PATTERN = r"^(?:SUPER |BRANCH )?ADMIN$|^(?:TEACHER|STUDENT|PARENT|ACCOUNTANT|LIBRARIAN|RECEPTIONIST)(?: ROLE)?$"  # All-caps TOC headings that are roles
+COARSE_TO_FINE = True  # Score module centroids first, then search only the best modules' sections
+COARSE_TOP_NODES = 4  # Modules (or other tree nodes) kept by the coarse step
+COARSE_MIN_SECTIONS = 1000  # Smaller search scopes are scanned flat; pruning only pays (and risks recall) beyond this
+HEADING_FAST_PATH = True  # Questions that name a section heading skip the remote question embedding
+HEADING_FUZZY_MIN_RATIO = 0.88  # Minimum similarity ratio (or share of a heading typed) for a near-exact heading match
+HEADING_MAX_QUERY_WORDS = 6  # Longer questions always go through embedding retrieval
+CHAT_SESSION_TTL_SECONDS = 1800.0  # Idle chat sessions are forgotten after this long
+CHAT_MAX_SESSIONS = 10000  # Least recently used sessions are evicted beyond this
+CHAT_MAX_TURNS = 6  # Turns replayed to the model as conversation history
+SUGGEST_MAX_QUESTIONS = 2000  # Popular questions kept as typeahead suggestions (least asked evicted beyond this)
+SUGGEST_MIN_QUESTION_COUNT = 2  # Times a question must be asked before it is suggested
+SUGGEST_TRACKED_QUESTIONS = 20000  # Distinct questions counted towards popularity
+SUGGEST_HEADING_WEIGHT = 3.0  # Section titles rank like a question asked this many times
+RETRIEVAL_SERVICE_SHARDS = None  # Replica URLs per shard of a retrieval service, e.g. [["http://127.0.0.1:8101", "http://127.0.0.1:8102"], ["http://127.0.0.1:8111"]]; None searches in-process
+RETRIEVAL_SERVICE_TIMEOUT_SECONDS = 1.0  # Per-replica timeout; a failed search falls back to the local index
+
+rate_scheduler = None
+if RATE_LIMIT_BACKEND:
+    rate_scheduler = RateScheduler(
+        build_backend(RATE_LIMIT_BACKEND, file_path=RATE_LIMIT_FILE, redis_url=RATE_LIMIT_REDIS_URL),
+        GEMINI_QUOTAS,
+    )
+
+generation_hedger = None
+if GENERATION_HEDGING:
+    generation_hedger = HedgedCaller(
+        percentile=HEDGE_PERCENTILE,
+        max_hedge_ratio=HEDGE_MAX_RATIO,
+        min_samples=HEDGE_MIN_SAMPLES,
+        min_delay_seconds=HEDGE_MIN_DELAY_SECONDS,
+    )
+
+token_counter = TokenCounter()
+
+response_cache = build_cache(
+    CACHE_TIERS, CACHE_TTL_SECONDS,
+    memory_max_entries=CACHE_MEMORY_MAX_ENTRIES, disk_path=CACHE_DISK_FILE, redis_url=CACHE_REDIS_URL,
+)
+
+retrieval_client = None
+if RETRIEVAL_SERVICE_SHARDS:
+    retrieval_client = RetrievalClient(RETRIEVAL_SERVICE_SHARDS, RETRIEVAL_SERVICE_TIMEOUT_SECONDS)
+
+chat_sessions = SessionStore(CHAT_SESSION_TTL_SECONDS, CHAT_MAX_SESSIONS, CHAT_MAX_TURNS)
+
+suggestions = SuggestIndex(
+    max_questions=SUGGEST_MAX_QUESTIONS, min_count=SUGGEST_MIN_QUESTION_COUNT,
+    max_tracked=SUGGEST_TRACKED_QUESTIONS, heading_weight=SUGGEST_HEADING_WEIGHT,
+)
 
 # --- Manual Text (Replace with your full manual content) ---
 
@@ -1492,14 +1622,212 @@ Adjust additional configurations. Accessing Module Permissions
 • Click on Module Permission.
 """ # Make sure to use your full manual_text here
 
+# --- Prompt ---
+SYSTEM_INSTRUCTION = (
+    "You are a professional and helpful AI assistant for the VedCool platform. "
+    "Your goal is to answer user questions clearly and concisely, using only the information "
+    "from the provided VedCool user manual excerpts.\n\n"
+
+    "INSTRUCTION RULES:\n"
+    "1. Base your answer *only* on the text provided in the 'CONTEXT FROM MANUAL'.\n"
+    "2. Respond concisely and accurately to the 'USER'S QUESTION'.\n"
+    "3. If the answer requires multiple sections (e.g., Student Reports, Exam Reports), "
+    "present each in a clearly separated block.\n"
+    "4. Each section must begin with an emoji icon and bold title, just like this style:\n"
+    "   📘 **Section Title**\n"
+    "5. Use numbered lists for steps (1., 2., 3., ...), and keep formatting consistent.\n"
+    "6. If the context mentions but doesn’t explain a detail, say so briefly.\n"
+    "7. If no relevant info is found, write: '⚠️ **Information not found** in the provided manual excerpts.'\n"
+    "8. Do not include any introductory phrases like 'Based on the manual'. Start directly with content.\n\n"
+
+    "OUTPUT FORMAT:\n"
+    "- Wrap the full response in <div class='vedcool-answer'> ... </div>.\n"
+    "- Each section should use this structure:\n"
+    "  <div class='section'>\n"
+    "    <p>📘 <strong>Section Title</strong></p>\n"
+    "    <p>Short description or intro.</p>\n"
+    "    <ol>\n"
+    "      <li>Step 1...</li>\n"
+    "      <li>Step 2...</li>\n"
+    "    </ol>\n"
+    "  </div>\n"
+    "- Keep styling minimal, clean, and consistent with the example in the image."
+)
+
+STRUCTURED_SYSTEM_INSTRUCTION = (
+    "You are a professional and helpful AI assistant for the VedCool platform. "
+    "Answer user questions clearly and concisely, using only the information "
+    "from the provided VedCool user manual excerpts.\n\n"
+
+    "INSTRUCTION RULES:\n"
+    "1. Base your answer *only* on the text provided in the 'CONTEXT FROM MANUAL'.\n"
+    "2. Respond concisely and accurately to the 'USER'S QUESTION'.\n"
+    "3. If the answer requires multiple sections (e.g., Student Reports, Exam Reports), use one entry per section.\n"
+    "4. Put each step in its own string, without numbering.\n"
+    "5. If the context mentions but doesn’t explain a detail, say so briefly in the intro.\n"
+    "6. If no relevant info is found, return {\"not_found\": true, \"sections\": []}.\n"
+    "7. Do not include introductory phrases like 'Based on the manual'.\n\n"
+
+    "OUTPUT FORMAT (JSON only, no markup):\n"
+    "{\"not_found\": false, \"sections\": [{\"title\": \"Section Title\", "
+    "\"intro\": \"Short description.\", \"steps\": [\"Step 1\", \"Step 2\"]}]}"
+)
+
 # --- Helper Functions ---
 def truncate_text_to_tokens(text: str, max_tokens: int) -> str:
-    """Truncates text to approximate token count (rough estimation for Gemini)."""
-    # Simple approximation: 1 token ≈ 4 characters for most languages
-    max_chars = max_tokens * 4
-    if len(text) > max_chars:
-        return text[:max_chars]
-    return text
+    """Truncates text (at a word boundary) to `max_tokens` by the calibrated token estimator."""
+    return token_counter.truncate(text, max_tokens)
+
+def estimate_tokens(text: str) -> int:
+    """Token count from the calibrated local estimator (cached for manual sections)."""
+    return token_counter.count(text)
+
+def calibrate_token_counter(parsed_manual_sections: list, samples: int = None, counts_file: str = None,
+                            allow_remote: bool = True):
+    """
+    Fits the local token estimator to the provider's tokenizer using a spread of manual
+    sections, then caches the token count of every section's content. With `counts_file`,
+    an earlier calibration of the same sections is reused and a new one is saved there.
+    Without `allow_remote` no count-tokens call is made: only a saved calibration is used.
+    """
+    samples = TOKEN_CALIBRATION_SAMPLES if samples is None else samples
+    contents = [content for _, content in parsed_manual_sections]
+    if counts_file and samples > 0 and token_counter.load(counts_file, contents):
+        logging.info(f"Token estimator calibration loaded from {counts_file} (scale {token_counter.scale:.3f})")
+        token_counter.cache_texts(contents)
+        return
+    exact_counts = {}
+    if samples > 0 and contents and not allow_remote:
+        logging.info(f"No saved token calibration; keeping estimator scale {token_counter.scale:.3f}.")
+    elif samples > 0 and contents:
+        step = max(1, len(contents) // samples)
+        sample_texts = contents[::step][:samples]
+        try:
+            model = genai.GenerativeModel(CHAT_MODEL)
+            exact_counts = token_counter.calibrate(sample_texts, lambda text: model.count_tokens(text).total_tokens)
+        except Exception as e:
+            logging.warning(f"Token estimator calibration failed ({e}); keeping scale {token_counter.scale:.3f}.")
+    token_counter.cache_texts(contents, exact_counts)
+    if counts_file and exact_counts:
+        try:
+            token_counter.save(counts_file)
+        except OSError as e:
+            logging.warning(f"Could not save token counts to '{counts_file}': {e}")
+
+def acquire_quota(kind: str, text: str, deadline: Deadline = None):
+    """Waits for the rate scheduler to admit one `kind` ("embed"/"generate") call for `text`."""
+    if rate_scheduler is not None:
+        max_wait = deadline.remaining() if deadline is not None else None
+        rate_scheduler.acquire(kind, tokens=estimate_tokens(text), max_wait=max_wait)
+
+def try_acquire_quota(kind: str, text: str) -> bool:
+    """Admits a `kind` call only if quota is available right now (used for optional hedges)."""
+    if rate_scheduler is None:
+        return True
+    try:
+        rate_scheduler.acquire(kind, tokens=estimate_tokens(text), max_wait=0.0)
+        return True
+    except QuotaWaitTooLong:
+        return False
+
+def request_options_for(deadline: Deadline = None) -> dict:
+    """Extra kwargs that bound a Gemini call by the time left on the request."""
+    if deadline is None:
+        return {}
+    deadline.check(DEADLINE_MIN_ATTEMPT_SECONDS, "remote call")
+    return {"request_options": {"timeout": deadline.remaining()}}
+
+def report_quota_error(kind: str, error: Exception):
+    """Lets every worker sharing the scheduler back off after a provider 429."""
+    if rate_scheduler is not None and isinstance(error, google_exceptions.ResourceExhausted):
+        rate_scheduler.report_quota_exceeded(kind)
+
+_generation_failures = deque()  # Monotonic timestamps of recent failed generation attempts
+_generation_failures_lock = threading.Lock()
+
+def record_generation_outcome(ok: bool):
+    with _generation_failures_lock:
+        if ok:
+            _generation_failures.clear()
+        else:
+            _generation_failures.append(time.monotonic())
+
+def gemini_degraded() -> bool:
+    """True when generation has failed repeatedly within the recent window."""
+    cutoff = time.monotonic() - GEMINI_DEGRADED_WINDOW_SECONDS
+    with _generation_failures_lock:
+        while _generation_failures and _generation_failures[0] < cutoff:
+            _generation_failures.popleft()
+        return len(_generation_failures) >= GEMINI_DEGRADED_FAILURES
+
+question_embedding_latency = LatencyTracker()  # Remote question-embedding calls only
+
+def embed_questions(questions: list, deadline: Deadline = None) -> list:
+    """
+    Embeds `questions` with a single embed_content call (one request against the quota,
+    however many questions); at most EMBED_BATCH_MAX per call.
+    """
+    acquire_quota("embed", " ".join(questions), deadline)
+    for question in questions:
+        token_counter.record("embedding_input", estimate_tokens(question))
+    started = time.monotonic()
+    try:
+        result = genai.embed_content(
+            model=EMBEDDING_MODEL,
+            content=questions if len(questions) > 1 else questions[0],
+            task_type="retrieval_query",
+            **request_options_for(deadline)
+        )
+    except Exception as e:
+        report_quota_error("embed", e)
+        raise
+    question_embedding_latency.record(time.monotonic() - started)
+    vectors = result['embedding'] if len(questions) > 1 else [result['embedding']]
+    return [np.array(vector) for vector in vectors]
+
+question_batcher = None
+if EMBED_MICROBATCHING:
+    question_batcher = EmbeddingBatcher(
+        embed_questions, window_seconds=EMBED_MICROBATCH_WINDOW_SECONDS,
+        max_batch=min(EMBED_MICROBATCH_MAX, EMBED_BATCH_MAX), min_seconds=DEADLINE_MIN_ATTEMPT_SECONDS,
+    )
+
+def get_question_embedding(question: str, deadline: Deadline = None) -> np.ndarray:
+    """
+    Embeds a question for retrieval, reusing cached embeddings of earlier questions.
+    Cache misses are micro-batched with concurrent requests when EMBED_MICROBATCHING is on.
+    """
+    key = normalize_question(question)
+    cached = response_cache.get("question_embedding", EMBEDDING_MODEL, key)
+    if cached is not None:
+        return cached
+    if question_batcher is not None:
+        embedding = question_batcher.embed(question, deadline)
+    else:
+        embedding = embed_questions([question], deadline)[0]
+    response_cache.set("question_embedding", EMBEDDING_MODEL, key, embedding)
+    return embedding
+
+def get_question_embeddings(questions: list, deadline: Deadline = None) -> list:
+    """Embeddings for many questions: cached ones reused, the rest fetched in batched calls."""
+    keys = [normalize_question(question) for question in questions]
+    embeddings = {}
+    missing = {}  # key -> first spelling, so repeated questions are embedded once
+    for key, question in zip(keys, questions):
+        if key in embeddings or key in missing:
+            continue
+        cached = response_cache.get("question_embedding", EMBEDDING_MODEL, key)
+        if cached is not None:
+            embeddings[key] = cached
+        else:
+            missing[key] = question
+    pending = list(missing.items())
+    for start in range(0, len(pending), EMBED_BATCH_MAX):
+        batch = pending[start:start + EMBED_BATCH_MAX]
+        for (key, _), embedding in zip(batch, embed_questions([question for _, question in batch], deadline)):
+            response_cache.set("question_embedding", EMBEDDING_MODEL, key, embedding)
+            embeddings[key] = embedding
+    return [embeddings[key] for key in keys]
 
 # --- Core Gemini API Functions with Tenacity Retries ---
 @retry(
@@ -1511,6 +1839,8 @@ def get_embedding_with_retry(text: str, model: str = EMBEDDING_MODEL):
     if not text or not text.strip():
         logging.warning("Attempted to get embedding for empty text.")
         return None
+    acquire_quota("embed", text)
+    token_counter.record("embedding_input", estimate_tokens(text))
     try:
         result = genai.embed_content(
             model=model,
@@ -1520,30 +1850,209 @@ def get_embedding_with_retry(text: str, model: str = EMBEDDING_MODEL):
         return np.array(result['embedding'])
     except Exception as e:
         logging.error(f"Error generating Gemini embedding: {e}")
+        report_quota_error("embed", e)
         raise
 
+_chat_models = {}  # (genai provider, model name, output format) -> (model instance, expires_at or None)
+_chat_models_lock = threading.Lock()
+
+def _create_chat_model(model: str, output_format: str = "html"):
+    """
+    Creates a model client carrying SYSTEM_INSTRUCTION, preferring a server-side context cache
+    (billed as cached input tokens). Caching has a minimum prompt size and isn't available on
+    every model, so any failure falls back to a plain system instruction.
+    """
+    system_instruction = STRUCTURED_SYSTEM_INSTRUCTION if output_format == "json" else SYSTEM_INSTRUCTION
+    generation_config = {"response_mime_type": "application/json"} if output_format == "json" else None
+    caching = getattr(genai, "caching", None)
+    if USE_CONTEXT_CACHE and caching is not None:
+        try:
+            cached_content = caching.CachedContent.create(
+                model=model if model.startswith("models/") else f"models/{model}",
+                system_instruction=system_instruction,
+                ttl=datetime.timedelta(seconds=CONTEXT_CACHE_TTL_SECONDS),
+            )
+            logging.info(f"Using context cache '{cached_content.name}' for the system instruction of {model}")
+            # Refresh a minute early so in-flight requests never hit an expired cache
+            expires_at = time.monotonic() + max(0, CONTEXT_CACHE_TTL_SECONDS - 60)
+            model_instance = genai.GenerativeModel.from_cached_content(
+                cached_content=cached_content, generation_config=generation_config
+            )
+            return model_instance, expires_at
+        except Exception as e:
+            logging.info(f"Context caching unavailable for {model} ({e}); using a plain system instruction.")
+    return genai.GenerativeModel(model, system_instruction=system_instruction, generation_config=generation_config), None
+
+def get_chat_model(model: str = CHAT_MODEL, output_format: str = "html"):
+    """
+    Returns the long-lived, shared model client for `model` (created once, reused by every
+    request). `output_format` "json" selects the compact structured-answer instruction.
+    """
+    key = (id(genai), model, output_format)
+    with _chat_models_lock:
+        entry = _chat_models.get(key)
+        if entry is None or (entry[1] is not None and time.monotonic() >= entry[1]):
+            entry = _create_chat_model(model, output_format)
+            _chat_models[key] = entry
+        return entry[0]
+
+def _stop_at_deadline(retry_state) -> bool:
+    deadline = retry_state.kwargs.get("deadline")
+    return deadline is not None and deadline.remaining() <= DEADLINE_MIN_ATTEMPT_SECONDS
+
+def _wait_within_deadline(base_wait):
+    """Caps a tenacity wait so the sleep still leaves budget for one more attempt."""
+    def wait(retry_state) -> float:
+        seconds = base_wait(retry_state)
+        deadline = retry_state.kwargs.get("deadline")
+        if deadline is not None:
+            seconds = min(seconds, max(0.0, deadline.remaining() - DEADLINE_MIN_ATTEMPT_SECONDS))
+        return seconds
+    return wait
+
 @retry(
-    wait=wait_random_exponential(min=1, max=60),
-    stop=stop_after_attempt(3),
-    retry=retry_if_exception_type((Exception,))
+    wait=_wait_within_deadline(wait_random_exponential(min=1, max=60)),
+    stop=stop_any(stop_after_attempt(3), _stop_at_deadline),
+    retry=retry_if_exception_type((Exception,)) & retry_if_not_exception_type((DeadlineExceeded, QuotaWaitTooLong))
 )
-def generate_response_with_retry(prompt: str, model: str = CHAT_MODEL):
+def generate_response_with_retry(prompt, model: str = CHAT_MODEL, deadline: Deadline = None,
+                                 output_format: str = "html"):
+    """`prompt` is a single prompt string or a list of Gemini contents (chat history + new turn)."""
+    prompt_text = prompt if isinstance(prompt, str) else "\n".join(
+        str(part) for content in prompt for part in content["parts"]
+    )
+    acquire_quota("generate", prompt_text, deadline)
     try:
-        model_instance = genai.GenerativeModel(model)
-        response = model_instance.generate_content(prompt)
+        model_instance = get_chat_model(model, output_format)
+        request_options = request_options_for(deadline)
+        if generation_hedger is not None:
+            response = generation_hedger.call(
+                model_instance.generate_content,
+                prompt,
+                before_hedge=lambda: try_acquire_quota("generate", prompt_text),
+                **request_options
+            )
+        else:
+            response = model_instance.generate_content(prompt, **request_options)
+        record_generation_outcome(True)
+        record_generation_tokens(prompt_text, response)
         return response.text
     except Exception as e:
         logging.error(f"Error generating Gemini response: {e}")
+        if not isinstance(e, (DeadlineExceeded, QuotaWaitTooLong)):
+            record_generation_outcome(False)
+        report_quota_error("generate", e)
         raise
 
+def record_generation_tokens(prompt_text: str, response):
+    """Prompt/response token accounting; exact when the response carries usage metadata."""
+    usage = getattr(response, "usage_metadata", None)
+    prompt_tokens = getattr(usage, "prompt_token_count", None)
+    response_tokens = getattr(usage, "candidates_token_count", None)
+    if prompt_tokens:
+        token_counter.record("prompt", prompt_tokens, exact=True)
+    else:
+        token_counter.record("prompt", estimate_tokens(prompt_text))
+    if response_tokens:
+        token_counter.record("response", response_tokens, exact=True)
+    else:
+        token_counter.record("response", estimate_tokens(response.text or ""))
+
+def build_section_index(section_data: list, cache_file: str = EMBEDDINGS_CACHE_FILE, shard: tuple = None,
+                        outline: list = None) -> SectionIndex:
+    """
+    Builds the search index using the configured storage dtype. `shard` = (i, n) keeps
+    every n-th section starting at i, for one shard of the retrieval service. `outline`
+    (from parse_manual(..., with_outline=True)) gives the section tree its hierarchy.
+    """
+    full_precision_path = None
+    if INDEX_STORAGE_DTYPE != "float32" or INDEX_PROJECTION:
+        full_precision_path = full_precision_path_for(cache_file, shard)
+    # Ids come from the whole manual so that they are the same in every shard and after merging
+    section_ids = make_section_ids([heading for heading, _, _ in section_data])
+
+    merged_sections = {}
+    if INDEX_MERGE_DUPLICATES:
+        groups = near_duplicate_groups([content for _, content, _ in section_data], DEDUP_SIMILARITY)
+        for row, group in enumerate(groups):
+            if group != row:
+                merged_sections.setdefault(section_data[group][0], []).append(section_data[row][0])
+        section_ids = [section_id for row, section_id in enumerate(section_ids) if groups[row] == row]
+        section_data = [item for row, item in enumerate(section_data) if groups[row] == row]
+
+    if shard is not None:
+        shard_index, shard_count = shard
+        section_ids = section_ids[shard_index::shard_count]
+        section_data = section_data[shard_index::shard_count]
+
+    index = SectionIndex.from_section_data(
+        section_data,
+        section_ids=section_ids,
+        dtype=INDEX_STORAGE_DTYPE,
+        rescore_candidates=INDEX_RESCORE_CANDIDATES,
+        full_precision_path=full_precision_path,
+        projection=INDEX_PROJECTION,
+        projection_dim=INDEX_PROJECTION_DIM,
+    )
+    token_counter.cache_texts(index.contents)
+
+    # Near-duplicate groups keep retrieval from returning several copies of the same steps
+    plain_contents = list(index.contents)
+    index.duplicate_groups = near_duplicate_groups(plain_contents, DEDUP_SIMILARITY)
+    index.merged_sections = merged_sections
+    compacted = INDEX_COMPACT_TEXT and index.compact_contents()
+    index.dedup_report = dedup_report(
+        index.headings, plain_contents, index.duplicate_groups,
+        index.contents if compacted else CompactTexts(plain_contents),
+        vectors_dropped=sum(len(others) for others in merged_sections.values()),
+    )
+    index.dedup_report["text_compacted"] = compacted
+    logging.info(
+        f"Deduplication: {index.dedup_report['near_duplicate_groups']} near-duplicate group(s), "
+        f"{index.dedup_report['vectors_dropped']} vector(s) merged, "
+        f"{index.dedup_report['unique_lines']}/{index.dedup_report['lines']} unique lines, "
+        f"section text {index.dedup_report['text_bytes_before']} -> {index.dedup_report['text_bytes_after']} bytes"
+        f"{'' if compacted else ' (not smaller; plain strings kept)'}"
+    )
+    index.shard = shard
+    logging.info(
+        f"Built {INDEX_STORAGE_DTYPE} section index{f' shard {shard[0]}/{shard[1]}' if shard else ''}: {len(index)} vectors, "
+        f"{index.scan_dimension}/{index.dimension} dims, {index.nbytes()['scan_vectors']} bytes"
+    )
+
+    # Parent/child structure from the TOC, for scoped and coarse-to-fine search
+    if not outline:
+        logging.warning("No TOC outline given to build_section_index; the section tree is flat.")
+    paths = section_paths(index.headings, outline or [])
+    index.tree = SectionTree(paths, np.vstack([index.vector(i) for i in range(len(index))]) if len(index) else None)
+    tree_report = index.tree.describe()
+    logging.info(
+        f"Section tree: {tree_report['internal_nodes']} parent node(s), "
+        f"depth {tree_report['max_depth']}, {len(tree_report['scopes'])} scope(s)"
+    )
+
+    index.projection_report = []
+    if INDEX_PROJECTION and len(index) > 1:
+        vectors = np.vstack([index.vector(i) for i in range(len(index))])
+        dims = sorted(set(INDEX_PROJECTION_REPORT_DIMS) | {INDEX_PROJECTION_DIM, index.dimension})
+        index.projection_report = projection_recall_report(vectors, INDEX_PROJECTION, dims)
+        for row in index.projection_report:
+            logging.info(f"  {INDEX_PROJECTION} projection to {row['dim']} dims: recall@{row['k']} = {row['recall_at_k']:.3f}")
+    return index
+
 # --- Manual Parsing Function ---
-def parse_manual(manual_text_content: str):
+# What the last parse_manual call left out, for index introspection
+parse_report = {"toc_headings": 0, "sections": 0, "headings_not_found": [], "empty_sections": [], "outline": []}
+
+def _parse_manual(manual_text_content: str):
+    """Returns (sections, outline); see parse_manual."""
     lines = manual_text_content.splitlines()
+    parse_report.update(toc_headings=0, sections=0, headings_not_found=[], empty_sections=[], outline=[])
     try:
         toc_start_idx = next(i for i, line in enumerate(lines) if line.strip().upper() == "TABLE OF CONTENT")
     except StopIteration:
         logging.error("Table of Contents (TABLE OF CONTENT) not found in manual.")
-        return []
+        return [], []
 
     toc_entry_pattern = re.compile(r"^(.*?)\s*\.{3,}\s*(\d+)\s*$")
     toc_lines_texts = []
@@ -1585,7 +2094,7 @@ def parse_manual(manual_text_content: str):
     
     if not toc_lines_texts:
         logging.error("No valid Table of Contents entries extracted.")
-        return []
+        return [], []
 
     extracted_headings_info = []
     for toc_line in toc_lines_texts:
@@ -1641,6 +2150,7 @@ def parse_manual(manual_text_content: str):
                 section_positions.append((display_heading, found_line_idx))
             else:
                 logging.warning(f"Heading '{display_heading}' (uppercase: '{match_heading_upper}') not found as a standalone heading in manual content (searched from line {current_search_line}).")
+                parse_report["headings_not_found"].append(display_heading)
         except Exception as e:
             logging.error(f"Error finding position for heading '{display_heading}': {e}")
         if found_line_idx != -1 :
@@ -1667,158 +2177,511 @@ def parse_manual(manual_text_content: str):
             parsed_sections.append((heading_display, content_text))
         else:
             logging.info(f"Section '{heading_display}' resulted in no content after parsing (lines {content_block_start_line}-{content_block_end_line}). This might be a container heading or formatting issue.")
+            parse_report["empty_sections"].append(heading_display)
 
     logging.info(f"Successfully parsed {len(parsed_sections)} sections with content from the manual.")
+    parse_report["toc_headings"] = len(extracted_headings_info)
+    outline = outline_levels([display for display, _ in extracted_headings_info], ROLE_HEADING_PATTERN)
+    parse_report["outline"] = outline
+    parse_report["sections"] = len(parsed_sections)
     if not parsed_sections and extracted_headings_info:
         logging.warning("Headings were extracted from TOC, but no content sections were parsed. Check heading matching logic in content.")
-    return parsed_sections
+    return parsed_sections, outline
 
-# --- Q&A Function ---
-def answer_question(question: str, section_data: list, threshold=0.40, top_n=3):
-    logging.info(f"Embedding question for Gemini: '{question}'")
-    
-    # Get question embedding for retrieval
-    try:
-        result = genai.embed_content(
-            model=EMBEDDING_MODEL,
-            content=question,
-            task_type="retrieval_query"
-        )
-        question_embedding = np.array(result['embedding'])
-    except Exception as e:
-        logging.error(f"Error generating question embedding: {e}")
-        return "I encountered an issue processing your question with the embedding model. Please try again."
+def parse_manual(manual_text_content: str, with_outline: bool = False):
+    """
+    (heading, content) pairs of the manual's sections. With `with_outline`, returns
+    (sections, outline): the TOC's (heading, depth) pairs that build_section_index needs
+    for the section tree.
+    """
+    parsed_sections, outline = _parse_manual(manual_text_content)
+    return (parsed_sections, outline) if with_outline else parsed_sections
 
-    similarities = []
-    for heading, content, embedding in section_data:
-        if embedding is None or not isinstance(embedding, np.ndarray) or embedding.ndim == 0 or embedding.size == 0:
-            logging.warning(f"Skipping section '{heading}' due to invalid or empty embedding.")
+# --- Q&A Function ---
+def section_candidate(index: SectionIndex, score: float, row: int) -> dict:
+    return {
+        "heading": index.headings[row],
+        "content": index.contents[row],
+        "similarity": score,
+        "section_id": index.section_ids[row],
+        "content_hash": index.content_hashes[row],
+        "row": row,
+    }
+
+def diverse_rows(index: SectionIndex, scored_rows: list, top_n: int) -> list:
+    """Keeps the best-scoring row of each near-duplicate group, up to `top_n` rows."""
+    seen_groups, kept = set(), []
+    for score, row in scored_rows:
+        group = index.duplicate_groups[row]
+        if group in seen_groups:
             continue
+        seen_groups.add(group)
+        kept.append((score, row))
+        if len(kept) == top_n:
+            break
+    return kept
+
+def resolve_scope(index: SectionIndex, scope: str = None) -> tuple:
+    """The section-tree node a scope names ("Settings", "Branch Admin > Settings"); () for no scope."""
+    if not scope:
+        return ()
+    tree = getattr(index, "tree", None)
+    node = tree.find(scope) if tree is not None else None
+    if node is None:
+        raise ValueError(f"Unknown scope '{scope}'.")
+    return node
+
+def search_scope_rows(index: SectionIndex, question_embedding, scope: tuple = ()):
+    """
+    Rows to scan for a question: the scope's subtree (None = the whole index), narrowed
+    to the best-matching modules first when there are enough sections to make that pay.
+    """
+    tree = getattr(index, "tree", None)
+    if tree is None:
+        return None
+    rows = tree.rows(scope) if scope else None
+    scanned = len(index) if rows is None else len(rows)
+    if COARSE_TO_FINE and scanned >= COARSE_MIN_SECTIONS:
+        rows = tree.coarse_rows(index.prepare_query(question_embedding), scope, COARSE_TOP_NODES)
+        log_event(logging.INFO, "Coarse-to-fine search", detail=True, scope=list(scope), rows=len(rows), of=scanned)
+    return rows
+
+def remote_search_rows(index: SectionIndex, question_embedding, top_n: int, scope: tuple = (),
+                       deadline: Deadline = None) -> list:
+    """
+    (similarity, row) pairs from the retrieval service, mapped onto the local index. Results
+    for sections the local index doesn't have in the same version mean the service serves
+    another manual, which is treated like an unreachable service.
+    """
+    timeout = RETRIEVAL_SERVICE_TIMEOUT_SECONDS
+    if deadline is not None:
+        timeout = max(0.01, min(timeout, deadline.remaining()))
+    results = retrieval_client.search(question_embedding, top_n, " > ".join(scope) or None, timeout=timeout)
+    scored_rows = []
+    for result in results:
+        row = index.row_of(result["section_id"])
+        if row is None or index.content_hashes[row] != result["content_hash"]:
+            raise RetrievalServiceError(f"Retrieval service returned section '{result['section_id']}' of another manual version.")
+        scored_rows.append((result["similarity"], row))
+    return scored_rows
+
+def search_section_rows(index: SectionIndex, question_embedding, top_n: int, scope: tuple = (),
+                        deadline: Deadline = None) -> list:
+    """Top (similarity, row) pairs, from the retrieval service when one is configured."""
+    if retrieval_client is not None:
         try:
-            similarity = 1 - cosine(question_embedding, embedding)
-            similarities.append((similarity, heading, content))
-        except Exception as e:
-            logging.error(f"Error calculating cosine similarity for section '{heading}': {e}.")
-            continue
+            return remote_search_rows(index, question_embedding, top_n, scope, deadline)
+        except RetrievalServiceError as e:
+            logging.warning(f"Retrieval service unavailable ({e}); searching the local index.")
+    rows = search_scope_rows(index, question_embedding, scope)
+    return index.search_rows(question_embedding, top_n=top_n, rows=rows)
+
+def section_candidates(index: SectionIndex, question_embedding, top_n: int, scope: tuple = (),
+                       deadline: Deadline = None) -> list:
+    """Top `top_n` sections for a question embedding, as dicts used to build the prompt."""
+    if index.has_near_duplicates:
+        scored_rows = diverse_rows(index, search_section_rows(index, question_embedding, top_n * 3, scope, deadline), top_n)
+    else:
+        scored_rows = search_section_rows(index, question_embedding, top_n, scope, deadline)
+    return [section_candidate(index, score, row) for score, row in scored_rows]
+
+def batch_section_candidates(index: SectionIndex, question_embeddings: list, top_n: int) -> list:
+    """`section_candidates` for many questions at once, searched with one matrix product."""
+    fetch = top_n * 3 if index.has_near_duplicates else top_n
+    batch = []
+    for scored_rows in index.search_rows_batch(question_embeddings, top_n=fetch):
+        if index.has_near_duplicates:
+            scored_rows = diverse_rows(index, scored_rows, top_n)
+        batch.append([section_candidate(index, score, row) for score, row in scored_rows])
+    return batch
+
+def follow_up_candidates(index: SectionIndex, question: str, session, top_n: int, threshold: float,
+                         deadline: Deadline = None) -> list:
+    """
+    Candidates for a follow-up turn. The question is embedded together with the previous
+    one, so "how do I edit it?" keeps its subject, and the sections retrieved earlier in
+    the session are re-scored first. Only if none of them is still relevant is the whole
+    index searched, with the contextual and the plain question, so a change of topic works.
+    """
+    contextual_embedding = get_question_embedding(f"{session.last_question()} {question}", deadline=deadline)
+    previous = index.score_rows(contextual_embedding, session.retrieved_rows())
+    if previous and previous[0][0] >= threshold:
+        log_event(logging.INFO, "Follow-up reuses previously retrieved sections", detail=True,
+                  session_id=session.session_id, sections=len(previous))
+        return [section_candidate(index, score, row) for score, row in previous[:top_n]]
+
+    log_event(logging.INFO, "Follow-up: previous sections not relevant, searching the index", detail=True,
+              session_id=session.session_id)
+    best = dict((row, score) for score, row in index.search_rows(contextual_embedding, top_n=top_n))
+    for score, row in index.search_rows(get_question_embedding(question, deadline=deadline), top_n=top_n):
+        best[row] = max(score, best.get(row, score))
+    ranked = sorted(best.items(), key=lambda item: -item[1])[:top_n]
+    return [section_candidate(index, score, row) for row, score in ranked]
+
+_heading_indexes = {}  # manual version -> HeadingIndex
+_heading_indexes_lock = threading.Lock()
+
+def get_heading_index(index: SectionIndex) -> HeadingIndex:
+    """The heading lookup for `index`, built once per manual version."""
+    with _heading_indexes_lock:
+        heading_index = _heading_indexes.get(index.manual_version)
+        if heading_index is None:
+            heading_index = HeadingIndex(
+                index.headings, max_query_words=HEADING_MAX_QUERY_WORDS, fuzzy_min_ratio=HEADING_FUZZY_MIN_RATIO
+            )
+            _heading_indexes.clear()  # Only the current manual is ever searched
+            _heading_indexes[index.manual_version] = heading_index
+        return heading_index
+
+def heading_candidates(index: SectionIndex, question: str, top_n: int, scope: tuple = ()) -> list:
+    """
+    Candidates from a confident heading match (no remote call), or [] to fall back to embeddings.
+    Without a question embedding there is no cosine similarity: these candidates carry
+    "heading_match" (exact/prefix/fuzzy) and a similarity of None.
+    """
+    match = get_heading_index(index).match(question)
+    if match is None:
+        return []
+    kind, score, rows = match
+    if scope:
+        in_scope = set(index.tree.rows(scope).tolist())
+        rows = [row for row in rows if row in in_scope]
+    rows = [row for _, row in diverse_rows(index, [(score, row) for row in rows], top_n)]
+    log_event(logging.INFO, "Heading fast path: %s match", kind, detail=True,
+              sections=lambda: [index.headings[row] for row in rows[:top_n]])
+    return [dict(section_candidate(index, None, row), heading_match=kind) for row in rows[:top_n]]
+
+def similarity_label(candidate: dict):
+    """The similarity for logs, or how the section was matched when it has none."""
+    if candidate["similarity"] is None:
+        return f"{candidate.get('heading_match')} heading match"
+    return round(candidate["similarity"], 4)
+
+def heading_fast_path_stats() -> dict:
+    """Hit rate of the heading fast path and the embedding latency it saved (estimated from the median)."""
+    with _heading_indexes_lock:
+        heading_index = next(iter(_heading_indexes.values()), None)
+    if heading_index is None:
+        return {"enabled": HEADING_FAST_PATH, "lookups": 0}
+    stats = heading_index.stats()
+    median_embedding_seconds = question_embedding_latency.percentile(50) or 0.0
+    hits = stats["exact"] + stats["prefix"] + stats["fuzzy"]
+    stats["enabled"] = HEADING_FAST_PATH
+    stats["median_question_embedding_seconds"] = median_embedding_seconds
+    stats["estimated_latency_saved_seconds"] = max(0.0, hits * median_embedding_seconds - stats["lookup_seconds"])
+    return stats
+
+def cached_candidates(index: SectionIndex, key: str) -> list:
+    """Candidates retrieved earlier for the same question (no embedding, no search), or []."""
+    cached = response_cache.get("retrieval", index.manual_version, key) or []
+    rows = [(score, index.row_of(section_id)) for score, section_id in cached]
+    if any(row is None for _, row in rows):
+        return []
+    return [section_candidate(index, score, row) for score, row in rows]
 
-    if not similarities:
-        logging.warning("No sections with valid embeddings available to compare against.")
-        return "The user manual content could not be searched at this time due to an issue with section embeddings."
-
-    similarities.sort(key=lambda x: x[0], reverse=True)
-
-    logging.info(f"Top {top_n} potential similarities for question '{question}':")
-    for i, (sim_score, head, _) in enumerate(similarities[:top_n]):
-        logging.info(f"  {i+1}. Similarity: {sim_score:.4f} with Section: '{head}'")
-
-    relevant_sections_info = []
-    for sim_score, heading, content in similarities[:top_n]:
-        if sim_score >= threshold:
-            relevant_sections_info.append({
-                "heading": heading,
-                "content": content,
-                "similarity": sim_score
-            })
-        else:
-            break 
-            
-    if not relevant_sections_info:
-        highest_sim_score = similarities[0][0] if similarities else -1.0
-        logging.info(f"No sections found above threshold {threshold} among the top {top_n} candidates. Highest similarity was {highest_sim_score:.4f}.")
-        return "I've searched the VedCool user manual, but I couldn't find specific information that directly addresses your question in the available excerpts."
+def cache_candidates(index: SectionIndex, key: str, candidates: list):
+    response_cache.set(
+        "retrieval", index.manual_version, key,
+        [[candidate["similarity"], candidate["section_id"]] for candidate in candidates],
+    )
 
-    combined_context = ""
-    log_message_context_parts = []
-    for i, section_info in enumerate(relevant_sections_info):
+def answer_cache_key(mode: str, question_key: str, output_format: str = None) -> str:
+    """Key of a cached answer: answers differ by requested mode and output format."""
+    return f"{mode}:{output_format or GENERATION_OUTPUT_FORMAT}:{question_key}"
+
+def answer_is_cached(section_data, question: str, mode: str) -> bool:
+    """True when the answer cache holds `question` under the key an unscoped request in `mode` reads."""
+    if not CACHE_ANSWERS:
+        return False
+    index = section_data if isinstance(section_data, SectionIndex) else SectionIndex.from_section_data(section_data)
+    key = answer_cache_key(mode, normalize_question(question))
+    return response_cache.get("answer", index.manual_version, key) is not None
+
+def select_relevant_sections(candidates: list, threshold: float, strategy: str = None) -> list:
+    """
+    Chooses which candidates go into the prompt ("fixed" or "adaptive", default CONTEXT_SELECTION).
+    Heading matches have no similarity to cut on and are all kept.
+    """
+    if candidates and candidates[0]["similarity"] is None:
+        return list(candidates)
+    if (strategy or CONTEXT_SELECTION) == "adaptive":
+        return select_context_sections(
+            candidates, threshold, CONTEXT_TOKEN_BUDGET, estimate_tokens,
+            max_relative_gap=CONTEXT_MAX_RELATIVE_GAP,
+            min_relative_score=CONTEXT_MIN_RELATIVE_SCORE,
+        )
+    relevant = []
+    for candidate in candidates:
+        if candidate["similarity"] < threshold:
+            break
+        relevant.append(candidate)
+    return relevant
+
+def build_prompt(question: str, sections_info: list, output_format: str = "html") -> str:
+    """
+    The per-request part of the prompt: retrieved context and the question. The static
+    rules live in the system instruction of the reused model client.
+    """
+    combined_context = "" if sections_info else "(No new sections: use the manual sections given earlier in this conversation.)\n"
+    for i, section_info in enumerate(sections_info):
+        similarity = section_info["similarity"]
+        match_note = "Matched by title" if similarity is None else f"Similarity: {similarity:.4f}"
         combined_context += (
-            f"MANUAL SECTION {i+1} TITLE: \"{section_info['heading']}\" (Similarity: {section_info['similarity']:.4f})\n"
+            f"MANUAL SECTION {i+1} TITLE: \"{section_info['heading']}\" ({match_note})\n"
             f"SECTION {i+1} CONTENT:\n\"\"\"\n{section_info['content']}\n\"\"\"\n\n"
         )
-        log_message_context_parts.append(f"'{section_info['heading']}' (Sim: {section_info['similarity']:.4f})")
-
-    prompt_for_llm = (
-    f"You are a professional and helpful AI assistant for the VedCool platform. "
-    f"Your goal is to answer user questions clearly and concisely, using only the information "
-    f"from the provided VedCool user manual excerpts.\n\n"
-
-    f"INSTRUCTION RULES:\n"
-    f"1. Base your answer *only* on the text provided in the 'CONTEXT FROM MANUAL'.\n"
-    f"2. Respond concisely and accurately to the 'USER'S QUESTION'.\n"
-    f"3. If the answer requires multiple sections (e.g., Student Reports, Exam Reports), "
-    f"present each in a clearly separated block.\n"
-    f"4. Each section must begin with an emoji icon and bold title, just like this style:\n"
-    f"   📘 **Section Title**\n"
-    f"5. Use numbered lists for steps (1., 2., 3., ...), and keep formatting consistent.\n"
-    f"6. If the context mentions but doesn’t explain a detail, say so briefly.\n"
-    f"7. If no relevant info is found, write: '⚠️ **Information not found** in the provided manual excerpts.'\n"
-    f"8. Do not include any introductory phrases like 'Based on the manual'. Start directly with content.\n\n"
-
-    f"OUTPUT FORMAT:\n"
-    f"- Wrap the full response in <div class='vedcool-answer'> ... </div>.\n"
-    f"- Each section should use this structure:\n"
-    f"  <div class='section'>\n"
-    f"    <p>📘 <strong>Section Title</strong></p>\n"
-    f"    <p>Short description or intro.</p>\n"
-    f"    <ol>\n"
-    f"      <li>Step 1...</li>\n"
-    f"      <li>Step 2...</li>\n"
-    f"    </ol>\n"
-    f"  </div>\n"
-    f"- Keep styling minimal, clean, and consistent with the example in the image.\n\n"
-
-    f"CONTEXT FROM MANUAL:\n{combined_context}\n\n"
-    f"USER'S QUESTION: \"{question}\"\n\n"
-    f"RESPOND BELOW IN HTML ONLY (NO MARKDOWN):\n"
-    f"<div class='vedcool-answer'>...</div>"
+    if output_format == "json":
+        response_instruction = "RESPOND WITH JSON ONLY, IN THE FORMAT FROM YOUR INSTRUCTIONS."
+    else:
+        response_instruction = "RESPOND BELOW IN HTML ONLY (NO MARKDOWN):\n<div class='vedcool-answer'>...</div>"
+    return (
+        f"CONTEXT FROM MANUAL:\n{combined_context}\n\n"
+        f"USER'S QUESTION: \"{question}\"\n\n"
+        f"{response_instruction}"
     )
 
+def answer_question(question: str, section_data: list, threshold=0.40, top_n=3, answer_store=None,
+                    deadline: Deadline = None, mode: str = "llm", session=None, scope: str = None,
+                    candidates: list = None, outcome: dict = None):
+    """
+    Answers `question` from the manual. `mode` is "llm" (Gemini writes the answer),
+    "extractive" (the top section's best-matching steps are rendered directly) or
+    "auto" (extractive when the top match is very close or Gemini is degraded).
+    With a chat `session`, follow-ups reuse the session's earlier retrieval and the
+    earlier turns are sent as history, so only sections new to the conversation are
+    added to the prompt. A `scope` (a role or module, e.g. "Settings") restricts the
+    search to that part of the manual. `candidates` skips retrieval altogether.
+    `outcome`, if given, gets "found": whether the answer is built from relevant sections.
+    """
+    if mode not in ANSWER_MODES:
+        raise ValueError(f"Unknown answer mode '{mode}'. Expected one of {ANSWER_MODES}.")
+    outcome = outcome if outcome is not None else {}
+    outcome["found"] = False
+    index = section_data if isinstance(section_data, SectionIndex) else SectionIndex.from_section_data(section_data)
+    scope_node = resolve_scope(index, scope)
+    store_question = f"{question} [scope: {' > '.join(scope_node)}]" if scope_node else question
+    follow_up = session is not None and len(session.turns) > 0
+    if follow_up:
+        answer_store = None  # Follow-up answers depend on the conversation, not just the question
+
+    # A session's first turn still runs retrieval so that its follow-ups have sections to reuse
+    question_key = normalize_question(store_question)
+    # Only generated answers are cached or stored
+    answer_key = answer_cache_key(mode, question_key)
+    if CACHE_ANSWERS and session is None:
+        cached_answer = response_cache.get("answer", index.manual_version, answer_key)
+        if cached_answer is not None:
+            log_event(logging.INFO, "Serving cached answer for question: %r", question)
+            outcome["found"] = True
+            return cached_answer
+    if answer_store is not None and session is None and mode != "extractive":
+        stored_answer = answer_store.get(store_question, index.section_hashes())
+        if stored_answer is not None:
+            log_event(logging.INFO, "Serving stored answer for question: %r", question)
+            outcome["found"] = True
+            if CACHE_ANSWERS:
+                response_cache.set("answer", index.manual_version, answer_key, stored_answer)
+            return stored_answer
+
+    def record_turn(answer_for_history: str, prompt: str = None, sections_sent: list = ()):
+        """Adds this turn to the chat session, whatever the answer, so turn numbers stay in step."""
+        if session is not None:
+            session.add_turn(
+                question, prompt or question, answer_for_history,
+                [candidate["row"] for candidate in candidates or []],
+                [info["section_id"] for info in sections_sent],
+            )
+
+    # Batch jobs pass in candidates they retrieved for many questions at once
+    out_of_budget = False
+    if candidates is None:
+        # A question that names a section heading needs no embedding, nor does one retrieved before
+        candidates = heading_candidates(index, question, top_n, scope_node) if HEADING_FAST_PATH and not follow_up else []
+        retrieval_key = f"{top_n}:{question_key}"
+        if not follow_up and not candidates:
+            candidates = cached_candidates(index, retrieval_key)
+
+        # Get question embedding for retrieval
+        try:
+            if follow_up:
+                candidates = follow_up_candidates(index, question, session, top_n, threshold, deadline)
+            elif not candidates:
+                log_event(logging.INFO, "Embedding question for Gemini: %r", question, detail=True)
+                question_embedding = get_question_embedding(question, deadline=deadline)
+        except ValueError as e:
+            logging.error(f"Error calculating similarities: {e}.")
+            candidates = []
+        except (DeadlineExceeded, QuotaWaitTooLong) as e:
+            logging.warning(f"Request deadline exhausted while embedding the question ({e}).")
+            # Only local lookups fit in the budget now (a first turn has tried both already)
+            if follow_up:
+                candidates = heading_candidates(index, question, top_n, scope_node) if HEADING_FAST_PATH else []
+                candidates = candidates or cached_candidates(index, retrieval_key)
+            if not candidates:
+                answer = "Answering your question took too long. Please try again in a moment."
+                record_turn(answer)
+                return answer
+            out_of_budget = True
+        except Exception as e:
+            logging.error(f"Error generating question embedding: {e}")
+            answer = "I encountered an issue processing your question with the embedding model. Please try again."
+            record_turn(answer)
+            return answer
 
-    logging.info(f"Generating Gemini response using section(s): {', '.join(log_message_context_parts)}")
-    response = generate_response_with_retry(prompt=prompt_for_llm)
-    return response
+        try:
+            if not follow_up and not candidates:
+                candidates = section_candidates(index, question_embedding, top_n, scope_node, deadline)
+                cache_candidates(index, retrieval_key, candidates)
+        except ValueError as e:
+            logging.error(f"Error calculating similarities: {e}.")
+            candidates = []
+
+    if not candidates:
+        logging.warning("No sections with valid embeddings available to compare against.")
+        answer = "The user manual content could not be searched at this time due to an issue with section embeddings."
+        record_turn(answer)
+        return answer
 
-# --- Main Execution ---
-if __name__ == "__main__":
-    parsed_manual_sections = parse_manual(manual_text)
+    log_event(
+        logging.INFO, "Top %d potential similarities", top_n, detail=True,
+        candidates=lambda: [[candidate["heading"], similarity_label(candidate)] for candidate in candidates],
+    )
 
-    if not parsed_manual_sections:
-        logging.error("No sections were parsed from the manual. Chatbot cannot proceed.")
-        print("Error: Unable to parse the manual. Please check the logs. Ensure 'TABLE OF CONTENT' exists and TOC entries are clear.")
-        sys.exit(1)
+    relevant_sections_info = select_relevant_sections(candidates, threshold)
 
-    section_data_for_chatbot = []
+    if not relevant_sections_info:
+        highest_sim_score = candidates[0]["similarity"]
+        log_event(logging.INFO, "No sections found above threshold %s among the top %d candidates", threshold, top_n,
+                  highest_similarity=round(highest_sim_score, 4))
+        answer = "I've searched the VedCool user manual, but I couldn't find specific information that directly addresses your question in the available excerpts."
+        record_turn(answer)
+        return answer
+    outcome["found"] = True
+
+    if mode == "auto":
+        # Only a measured near-exact match qualifies; a heading match alone goes to the LLM
+        best_similarity = relevant_sections_info[0]["similarity"]
+        if best_similarity is not None and best_similarity >= EXTRACTIVE_AUTO_SIMILARITY:
+            mode = "extractive"
+        elif gemini_degraded():
+            logging.warning("Gemini is degraded; answering extractively.")
+            mode = "extractive"
+    output_format = GENERATION_OUTPUT_FORMAT
+    already_sent = session.sent_section_ids() if session is not None else set()
+    new_sections_info = [info for info in relevant_sections_info if info["section_id"] not in already_sent]
+    prompt_for_llm = build_prompt(question, new_sections_info, output_format)
+
+    if out_of_budget:
+        logging.warning("No budget left for generation; serving degraded answer from locally matched sections.")
+        answer = render_sections_as_answer(relevant_sections_info, question, max_steps=EXTRACTIVE_MAX_STEPS)
+        record_turn(answer, prompt_for_llm, new_sections_info)
+        return answer
+
+    if mode == "extractive":
+        log_event(logging.INFO, "Answering extractively", section=relevant_sections_info[0]["heading"])
+        answer = render_sections_as_answer(
+            relevant_sections_info[:EXTRACTIVE_MAX_SECTIONS], question, max_steps=EXTRACTIVE_MAX_STEPS
+        )
+        record_turn(answer, prompt_for_llm, new_sections_info)
+        return answer
 
-    if os.path.exists(EMBEDDINGS_CACHE_FILE):
+    if follow_up:
+        log_event(logging.INFO, "Follow-up adds new sections to the history", detail=True,
+                  new_sections=len(new_sections_info), history_turns=len(session.turns))
+
+    log_event(
+        logging.INFO, "Generating Gemini response", detail=True,
+        sections=lambda: [[info["heading"], similarity_label(info)] for info in relevant_sections_info],
+    )
+    contents = session.history_contents() + [{"role": "user", "parts": [prompt_for_llm]}] if follow_up else prompt_for_llm
+    try:
+        response = generate_response_with_retry(prompt=contents, deadline=deadline, output_format=output_format)
+    except Exception as e:
+        budget_exhausted = isinstance(e, (DeadlineExceeded, QuotaWaitTooLong)) or (
+            deadline is not None and deadline.remaining() <= DEADLINE_MIN_ATTEMPT_SECONDS
+        )
+        if deadline is None or not budget_exhausted:
+            raise
+        logging.warning(f"Request deadline exhausted during generation ({e}); serving degraded answer from retrieved sections.")
+        answer = render_sections_as_answer(relevant_sections_info, question, max_steps=EXTRACTIVE_MAX_STEPS)
+        record_turn(answer, prompt_for_llm, new_sections_info)
+        return answer
+
+    history_answer = response  # The history keeps what the model wrote, in its own format
+    if output_format == "json":
+        try:
+            response = render_structured_answer(response)
+        except ValueError as e:
+            if "vedcool-answer" in response:
+                logging.warning(f"Structured answer did not parse ({e}); model returned HTML, using it as-is.")
+            else:
+                logging.warning(f"Structured answer did not parse ({e}); serving extractive answer instead.")
+                answer = render_sections_as_answer(relevant_sections_info, question, max_steps=EXTRACTIVE_MAX_STEPS)
+                record_turn(answer, prompt_for_llm, new_sections_info)
+                return answer
+    record_turn(history_answer, prompt_for_llm, new_sections_info)
+
+    if CACHE_ANSWERS and session is None and response:
+        response_cache.set("answer", index.manual_version, answer_key, response)
+    if answer_store is not None and response:
         try:
-            with open(EMBEDDINGS_CACHE_FILE, 'rb') as f:
+            answer_store.put(
+                store_question,
+                response,
+                [(info["section_id"], info["content_hash"]) for info in relevant_sections_info],
+                index.manual_version,
+            )
+        except Exception as e:
+            logging.error(f"Error saving answer to store: {e}")
+    return response
+
+# --- Section Data Loading ---
+def load_section_data(parsed_manual_sections: list, cache_file: str = EMBEDDINGS_CACHE_FILE, progress=None) -> list:
+    """
+    Loads (heading, content, embedding) tuples from the cache, recomputing them if stale or missing.
+    `progress(source, sections_done, failed_heading)` is called once for a valid cache ("cache")
+    and after every computed section ("computed"; failed_heading names a section left out).
+    """
+    section_data = []
+
+    if os.path.exists(cache_file):
+        try:
+            with open(cache_file, 'rb') as f:
                 loaded_data = pickle.load(f)
             if isinstance(loaded_data, list) and \
                (not loaded_data or \
                 (all(isinstance(item, tuple) and len(item) == 3 and isinstance(item[0], str) and isinstance(item[1], str) and isinstance(item[2], np.ndarray) for item in loaded_data))):
-                section_data_for_chatbot = loaded_data
-                logging.info(f"Loaded {len(section_data_for_chatbot)} Gemini embeddings from cache: {EMBEDDINGS_CACHE_FILE}")
+                section_data = loaded_data
+                logging.info(f"Loaded {len(section_data)} Gemini embeddings from cache: {cache_file}")
             else:
-                logging.warning(f"Cached Gemini data in '{EMBEDDINGS_CACHE_FILE}' is not in the expected format. Recomputing.")
-                section_data_for_chatbot = []
+                logging.warning(f"Cached Gemini data in '{cache_file}' is not in the expected format. Recomputing.")
+                section_data = []
 
-            if section_data_for_chatbot:
-                if len(section_data_for_chatbot) != len(parsed_manual_sections):
-                    logging.warning(f"Cached Gemini embeddings count ({len(section_data_for_chatbot)}) does not match current parsed sections count ({len(parsed_manual_sections)}). Recomputing all.")
-                    section_data_for_chatbot = []
+            if section_data:
+                if len(section_data) != len(parsed_manual_sections):
+                    logging.warning(f"Cached Gemini embeddings count ({len(section_data)}) does not match current parsed sections count ({len(parsed_manual_sections)}). Recomputing all.")
+                    section_data = []
                 else:
-                    cached_headings = [item[0] for item in section_data_for_chatbot]
+                    cached_headings = [item[0] for item in section_data]
                     parsed_headings = [item[0] for item in parsed_manual_sections]
                     if cached_headings != parsed_headings:
                         logging.warning("Headings or their order in Gemini cache do not match current parsed headings. Recomputing all.")
-                        section_data_for_chatbot = []
+                        section_data = []
+            if section_data and progress is not None:
+                progress("cache", len(section_data), None)
         except (pickle.UnpicklingError, EOFError, AttributeError, ImportError, IndexError, TypeError) as e:
-            logging.error(f"Error loading or validating Gemini embeddings cache '{EMBEDDINGS_CACHE_FILE}': {e}. Recomputing.")
-            section_data_for_chatbot = []
+            logging.error(f"Error loading or validating Gemini embeddings cache '{cache_file}': {e}. Recomputing.")
+            section_data = []
         except Exception as e:
-            logging.error(f"Unexpected error loading or validating Gemini embeddings cache '{EMBEDDINGS_CACHE_FILE}': {e}. Recomputing.")
-            section_data_for_chatbot = []
+            logging.error(f"Unexpected error loading or validating Gemini embeddings cache '{cache_file}': {e}. Recomputing.")
+            section_data = []
+
+    # A warm start (valid embeddings cache) makes no remote calls, count-tokens included
+    calibrate_token_counter(
+        parsed_manual_sections, counts_file=token_counts_path_for(cache_file), allow_remote=not section_data,
+    )
 
-    if not section_data_for_chatbot:
+    if not section_data:
         logging.info("Computing Gemini embeddings for manual sections...")
         temp_section_data = []
         for i, (heading, content) in enumerate(parsed_manual_sections):
@@ -1830,30 +2693,104 @@ if __name__ == "__main__":
 
             if not truncated_text.strip():
                 logging.warning(f"Skipping embedding for section '{heading}' as text became empty after truncation or was initially empty.")
+                if progress is not None:
+                    progress("computed", i + 1, heading)
                 continue
             
+            failed_heading = None
             try:
                 embedding_array = get_embedding_with_retry(text=truncated_text)
                 if embedding_array is not None and embedding_array.size > 0:
                     temp_section_data.append((heading, content, embedding_array))
                 else:
                     logging.warning(f"Failed to compute or got empty/invalid Gemini embedding for section: {heading}. It will be excluded.")
+                    failed_heading = heading
             except Exception as e:
                  logging.error(f"All retries failed for embedding section '{heading}': {e}. This section will be excluded.")
+                 failed_heading = heading
+            if progress is not None:
+                progress("computed", i + 1, failed_heading)
 
-        section_data_for_chatbot = temp_section_data
+        section_data = temp_section_data
 
-        if section_data_for_chatbot:
+        if section_data:
             try:
-                with open(EMBEDDINGS_CACHE_FILE, 'wb') as f:
-                    pickle.dump(section_data_for_chatbot, f)
-                logging.info(f"Gemini embeddings computed and saved to cache: {EMBEDDINGS_CACHE_FILE}")
+                with open(cache_file, 'wb') as f:
+                    pickle.dump(section_data, f)
+                logging.info(f"Gemini embeddings computed and saved to cache: {cache_file}")
             except Exception as e:
-                logging.error(f"Error saving Gemini embeddings to cache '{EMBEDDINGS_CACHE_FILE}': {e}")
+                logging.error(f"Error saving Gemini embeddings to cache '{cache_file}': {e}")
         else:
             logging.error("No Gemini embeddings were successfully computed for any section. The chatbot may not function correctly.")
 
+    return section_data
+
+def load_section_index(cache_file: str = EMBEDDINGS_CACHE_FILE) -> SectionIndex:
+    """Parses the manual and returns the search index over its embedded sections."""
+    parsed_manual_sections, outline = parse_manual(manual_text, with_outline=True)
+    if not parsed_manual_sections:
+        raise RuntimeError("No sections were parsed from the manual.")
+    section_data = load_section_data(parsed_manual_sections, cache_file)
+    if not section_data:
+        raise RuntimeError("No section data with embeddings is available.")
+    return build_section_index(section_data, cache_file, outline=outline)
+
+def describe_index(index: SectionIndex, largest: int = 10) -> dict:
+    """Capacity report for a loaded index: sizes, memory use, largest and skipped sections."""
+    token_counts = sorted(
+        ((estimate_tokens(content), section_id) for content, section_id in zip(index.contents, index.section_ids)),
+        reverse=True,
+    )
+    memory_tier = response_cache.tier("memory")
+    vector_bytes = index.nbytes()
+    return {
+        "sections": len(index),
+        "chunks": len(index),  # One vector per section; sections are not split further
+        "embedding_dimension": index.dimension,
+        "scan_dimension": index.scan_dimension,
+        "dtype": index.dtype,
+        "projection": index.projection,
+        "manual_version": index.manual_version,
+        "bytes": {
+            **vector_bytes,
+            "question_embedding_cache": memory_tier.describe()["embedding_bytes"] if memory_tier is not None else 0,
+        },
+        "caches": {
+            "tiers": response_cache.describe(),
+            "chat_sessions": len(chat_sessions),
+        },
+        "tokens": {
+            "total": sum(count for count, _ in token_counts),
+            "largest_sections": [{"section_id": section_id, "tokens": count} for count, section_id in token_counts[:largest]],
+        },
+        "shard": list(index.shard) if getattr(index, "shard", None) else None,
+        "tree": index.tree.describe() if getattr(index, "tree", None) is not None else None,
+        "dedup": getattr(index, "dedup_report", None),
+        "merged_sections": getattr(index, "merged_sections", {}),
+        "skipped": {
+            "headings_not_found": list(parse_report["headings_not_found"]),
+            "empty_sections": list(parse_report["empty_sections"]),
+            "invalid_embeddings": [{"heading": heading, "reason": reason} for heading, reason in index.skipped_sections],
+        },
+    }
+
+# --- Main Execution ---
+if __name__ == "__main__":
+    parsed_manual_sections, outline = parse_manual(manual_text, with_outline=True)
+
+    if not parsed_manual_sections:
+        logging.error("No sections were parsed from the manual. Chatbot cannot proceed.")
+        print("Error: Unable to parse the manual. Please check the logs. Ensure 'TABLE OF CONTENT' exists and TOC entries are clear.")
+        sys.exit(1)
+
+    section_data_for_chatbot = load_section_data(parsed_manual_sections)
+
     if section_data_for_chatbot:
+        section_data_for_chatbot = build_section_index(section_data_for_chatbot, outline=outline)
+        cli_answer_store = None
+        if ANSWER_STORE_FILE:
+            cli_answer_store = AnswerStore(ANSWER_STORE_FILE)
+            cli_answer_store.invalidate_changed(section_data_for_chatbot.section_hashes())
         print("\nVedCool Chatbot (Gemini Edition) is ready! Ask your question.")
         print("Type 'exit' or 'quit' to stop.")
         print(f"Using threshold: 0.40, top_n: 3 for context retrieval.")
@@ -1869,7 +2806,7 @@ if __name__ == "__main__":
                     continue
 
                 logging.info(f"--- Processing question with Gemini: {question} ---")
-                answer = answer_question(question, section_data_for_chatbot, threshold=0.40, top_n=3)
+                answer = answer_question(question, section_data_for_chatbot, threshold=0.40, top_n=3, answer_store=cli_answer_store)
                 print(f"\nResponse:\n{answer}\n")
 
             except KeyboardInterrupt:
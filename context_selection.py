@@ -0,0 +1,51 @@
+"""
+Adaptive choice of how many retrieved sections go into the prompt.
+
+Instead of sending every candidate above a fixed threshold, the ranked list is
+cut where similarity drops off sharply relative to the previous candidate or to
+the best match, and the kept sections must fit a context token budget. Fewer,
+better sections mean a smaller prompt and faster generation.
+"""
+import logging
+
+from structured_logging import log_event
+
+
+def select_context_sections(candidates: list, threshold: float, token_budget: int,
+                            count_tokens, max_relative_gap: float = 0.08,
+                            min_relative_score: float = 0.90) -> list:
+    """
+    `candidates` are section dicts with "similarity", "heading" and "content", most
+    similar first. Returns the prefix to put in the prompt; the best candidate above
+    `threshold` is always kept, even if it alone exceeds the budget.
+    """
+    selected = []
+    used_tokens = 0
+    reason = "end of candidates"
+    for i, candidate in enumerate(candidates):
+        score = candidate["similarity"]
+        if score < threshold:
+            reason = f"below threshold {threshold:.2f}"
+            break
+        if selected:
+            previous = selected[-1]["similarity"]
+            top = selected[0]["similarity"]
+            if previous > 0 and (previous - score) / previous >= max_relative_gap:
+                reason = f"score gap {previous:.4f} -> {score:.4f}"
+                break
+            if top > 0 and score / top < min_relative_score:
+                reason = f"score {score:.4f} under {min_relative_score:.0%} of top {top:.4f}"
+                break
+        section_tokens = count_tokens(candidate["content"])
+        if selected and used_tokens + section_tokens > token_budget:
+            reason = f"token budget {token_budget} ({used_tokens} used, next needs {section_tokens})"
+            break
+        selected.append(candidate)
+        used_tokens += section_tokens
+
+    if selected:
+        log_event(
+            logging.INFO, "Adaptive context: kept %d/%d section(s), ~%d tokens", len(selected), len(candidates),
+            used_tokens, detail=True, cut_off=reason,
+        )
+    return selected
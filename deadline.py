@@ -0,0 +1,34 @@
+"""
+Per-request time budget threaded through the answer pipeline.
+
+Every remote call, quota wait and retry sleep on the request path asks the
+deadline how much time is left, so a single /ask cannot outlive the budget
+configured in chatbot.REQUEST_DEADLINE_SECONDS.
+"""
+import time
+
+
+class DeadlineExceeded(Exception):
+    """Raised when there is not enough budget left to start another step."""
+
+
+class Deadline:
+    def __init__(self, seconds: float, started_at: float = None):
+        """`started_at` (time.monotonic()) backdates the budget, e.g. to when the request arrived."""
+        self.seconds = seconds
+        self.expires_at = (time.monotonic() if started_at is None else started_at) + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0.0
+
+    def check(self, min_seconds: float = 0.0, step: str = "request"):
+        """Raises DeadlineExceeded unless at least `min_seconds` remain for `step`."""
+        if self.remaining() <= min_seconds:
+            raise DeadlineExceeded(f"Deadline of {self.seconds:.1f}s exhausted before {step}")
+
+    def cap(self, seconds: float) -> float:
+        """Clamps a timeout or sleep to the time left."""
+        return min(seconds, self.remaining())
@@ -0,0 +1,176 @@
+"""
+Build-time detection of repeated manual text.
+
+The manual repeats a lot of boilerplate: "Navigate to ...", "Log in as an
+administrator." and whole step lists shared across modules. Two passes handle it:
+
+- Near-duplicate sections: MinHash signatures over word 3-shingles, bucketed
+  with LSH banding, with candidate pairs verified by exact Jaccard similarity.
+  Sections in the same group are treated as one for retrieval diversity and
+  can optionally share a single index vector.
+- Repeated passages: section text is split into lines and each distinct line is
+  stored once (`CompactTexts`); sections keep only line ids. Reconstruction is
+  exact, so content hashes and prompts are unchanged. The compact form is only
+  used when it is actually smaller than the plain strings.
+"""
+import hashlib
+import re
+import sys
+
+import numpy as np
+
+_WORD_PATTERN = re.compile(r"[a-z0-9]+")
+_MINHASH_PRIME = (1 << 31) - 1  # Keeps a * h + b inside uint64
+
+
+def shingles(text: str, k: int = 3) -> set:
+    words = _WORD_PATTERN.findall(text.lower())
+    if len(words) <= k:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + k]) for i in range(len(words) - k + 1)}
+
+
+def _shingle_hashes(shingle_set: set) -> np.ndarray:
+    return np.array(
+        [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little") % _MINHASH_PRIME
+         for s in shingle_set],
+        dtype=np.uint64,
+    )
+
+
+def minhash_signatures(shingle_sets: list, num_perm: int = 64, seed: int = 0) -> np.ndarray:
+    """One row of `num_perm` MinHash values per shingle set (all-max for empty sets)."""
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, _MINHASH_PRIME, num_perm, dtype=np.uint64)
+    b = rng.integers(0, _MINHASH_PRIME, num_perm, dtype=np.uint64)
+    signatures = np.full((len(shingle_sets), num_perm), _MINHASH_PRIME, dtype=np.uint64)
+    for row, shingle_set in enumerate(shingle_sets):
+        if shingle_set:
+            hashes = _shingle_hashes(shingle_set)
+            signatures[row] = ((a[:, None] * hashes[None, :] + b[:, None]) % _MINHASH_PRIME).min(axis=1)
+    return signatures
+
+
+def jaccard(a: set, b: set) -> float:
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+def near_duplicate_groups(texts: list, threshold: float = 0.85, num_perm: int = 64, bands: int = 16) -> list:
+    """
+    Returns a group id per text; texts whose word-shingle Jaccard similarity is at
+    least `threshold` (directly or transitively) share the id of the group's first text.
+    """
+    shingle_sets = [shingles(text) for text in texts]
+    signatures = minhash_signatures(shingle_sets, num_perm)
+    rows_per_band = num_perm // bands
+
+    parent = list(range(len(texts)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    checked = set()
+    for band in range(bands):
+        buckets = {}
+        columns = slice(band * rows_per_band, (band + 1) * rows_per_band)
+        for row in range(len(texts)):
+            if shingle_sets[row]:
+                buckets.setdefault(signatures[row, columns].tobytes(), []).append(row)
+        for rows in buckets.values():
+            for i in range(len(rows)):
+                for j in range(i + 1, len(rows)):
+                    pair = (rows[i], rows[j])
+                    if pair in checked:
+                        continue
+                    checked.add(pair)
+                    if jaccard(shingle_sets[pair[0]], shingle_sets[pair[1]]) >= threshold:
+                        root_i, root_j = find(pair[0]), find(pair[1])
+                        parent[max(root_i, root_j)] = min(root_i, root_j)
+    return [find(row) for row in range(len(texts))]
+
+
+class CompactTexts:
+    """
+    Read-only list of strings in which every distinct line is stored once. The unique
+    lines live in one string and the per-text line ids in one array, so the per-object
+    overhead of many small strings is avoided. Indexing rebuilds the exact original.
+    """
+
+    def __init__(self, texts: list):
+        lines, line_ids, ids, offsets = [], {}, [], [0]
+        for text in texts:
+            for line in text.split("\n"):
+                line_id = line_ids.get(line)
+                if line_id is None:
+                    line_id = line_ids[line] = len(lines)
+                    lines.append(line)
+                ids.append(line_id)
+            offsets.append(len(ids))
+        self._blob = "".join(lines)
+        ends = np.cumsum([len(line) for line in lines], dtype=np.int64)
+        self._line_ends = ends.astype(np.uint32)
+        self._line_starts = (ends - [len(line) for line in lines]).astype(np.uint32) if lines else ends.astype(np.uint32)
+        id_dtype = np.uint16 if len(lines) <= np.iinfo(np.uint16).max else np.uint32
+        self._ids = np.array(ids, dtype=id_dtype)
+        self._offsets = np.array(offsets, dtype=np.uint32)
+        self.total_lines = len(ids)
+        self.unique_lines = len(lines)
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("CompactTexts index out of range")
+        ids = self._ids[self._offsets[i]:self._offsets[i + 1]]
+        return "\n".join(self._blob[self._line_starts[j]:self._line_ends[j]] for j in ids)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def nbytes(self) -> int:
+        """In-memory size, object overhead included, comparable with `text_bytes`."""
+        return sys.getsizeof(self._blob) + sum(
+            a.nbytes for a in (self._line_starts, self._line_ends, self._ids, self._offsets)
+        )
+
+
+def text_bytes(texts) -> int:
+    """In-memory size of a list of plain strings."""
+    return sum(sys.getsizeof(text) for text in texts) + sys.getsizeof(list(texts))
+
+
+def dedup_report(headings: list, texts: list, groups: list, compact: CompactTexts, vectors_dropped: int = 0) -> dict:
+    """How much repetition the passes found and how much smaller the index got."""
+    line_counts = {}
+    for text in texts:
+        for line in text.split("\n"):
+            if line.strip():
+                line_counts[line] = line_counts.get(line, 0) + 1
+    repeated = sorted(((count, line) for line, count in line_counts.items() if count > 1), reverse=True)
+    members = {}
+    for row, group in enumerate(groups):
+        members.setdefault(group, []).append(headings[row])
+    duplicate_groups = [names for names in members.values() if len(names) > 1]
+    original_bytes = text_bytes(texts)
+    return {
+        "sections": len(texts),
+        "near_duplicate_groups": len(duplicate_groups),
+        "sections_in_duplicate_groups": sum(len(names) for names in duplicate_groups),
+        "groups": duplicate_groups,
+        "lines": compact.total_lines,
+        "unique_lines": compact.unique_lines,
+        "most_repeated_lines": [{"line": line, "count": count} for count, line in repeated[:10]],
+        "text_bytes_before": original_bytes,
+        "text_bytes_after": compact.nbytes(),
+        "text_shrink": 1 - compact.nbytes() / original_bytes if original_bytes else 0.0,
+        "vectors_dropped": vectors_dropped,
+    }
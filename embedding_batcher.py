@@ -0,0 +1,139 @@
+"""
+Micro-batching of concurrent question embeddings.
+
+Under load many requests embed their question at the same moment, each with
+its own embed_content call and its own request against the per-minute quota.
+The batcher lets them share one call instead: the first caller opens a batch
+and waits up to `window_seconds` (a few milliseconds) for others to join, or
+until `max_batch` questions have arrived; it then sends the whole batch in one
+call and hands every waiting caller its own vector. There is no background
+thread: the caller that opened a batch sends it.
+
+Members whose deadline has run out by the time the batch is sent are dropped
+and get DeadlineExceeded on their own; the rest are sent under the loosest of
+their deadlines, so one request about to time out cannot fail its neighbours.
+A failed call still fails every member that was sent (each request then
+handles the error as before).
+"""
+import threading
+import time
+
+from deadline import DeadlineExceeded
+
+
+class _Batch:
+    __slots__ = ("texts", "slots", "members", "opened_at", "done", "vectors", "expired", "error")
+
+    def __init__(self):
+        self.texts = []
+        self.slots = {}  # text -> position, so identical questions share one vector
+        self.members = []  # (slot, deadline) per caller
+        self.opened_at = time.monotonic()
+        self.done = threading.Event()
+        self.vectors = {}  # slot -> vector
+        self.expired = set()  # Members dropped because their deadline ran out before sending
+        self.error = None
+
+
+class EmbeddingBatcher:
+    def __init__(self, embed_batch, window_seconds: float = 0.005, max_batch: int = 32, min_seconds: float = 0.0):
+        """
+        `embed_batch(texts, deadline)` returns one vector per text. Members with no more than
+        `min_seconds` left when the batch is sent are dropped from it.
+        """
+        self.embed_batch = embed_batch
+        self.window_seconds = window_seconds
+        self.max_batch = max(1, max_batch)
+        self.min_seconds = min_seconds
+        self._cond = threading.Condition()
+        self._open = None  # Batch still accepting questions
+        self._stats = {"questions": 0, "deduplicated": 0, "batches": 0, "full_batches": 0, "errors": 0,
+                       "expired": 0, "max_batch_size": 0, "wait_seconds": 0.0, "call_seconds": 0.0}
+
+    def embed(self, text: str, deadline=None):
+        """The embedding of `text`, sent together with any other questions arriving within the window."""
+        with self._cond:
+            batch = self._open
+            leader = batch is None
+            if leader:
+                batch = self._open = _Batch()
+            slot = batch.slots.get(text)
+            if slot is None:
+                slot = batch.slots[text] = len(batch.texts)
+                batch.texts.append(text)
+            else:
+                self._stats["deduplicated"] += 1
+            member = len(batch.members)
+            batch.members.append((slot, deadline))
+            self._stats["questions"] += 1
+            if len(batch.texts) >= self.max_batch:
+                self._open = None
+                self._stats["full_batches"] += 1
+                self._cond.notify_all()
+
+        if leader:
+            self._collect(batch, deadline)
+            self._send(batch)
+        else:
+            batch.done.wait()
+        if member in batch.expired:
+            raise DeadlineExceeded(f"Deadline of {deadline.seconds:.1f}s exhausted before question embedding")
+        if batch.error is not None:
+            raise batch.error
+        return batch.vectors[slot]
+
+    def _collect(self, batch: _Batch, deadline):
+        """Waits out the window (never past the leader's deadline) unless the batch fills up first."""
+        window = deadline.cap(self.window_seconds) if deadline is not None else self.window_seconds
+        closes_at = batch.opened_at + window
+        with self._cond:
+            while self._open is batch:
+                remaining = closes_at - time.monotonic()
+                if remaining <= 0:
+                    self._open = None
+                    break
+                self._cond.wait(remaining)
+
+    def _send(self, batch: _Batch):
+        started = time.monotonic()
+        live_slots, deadlines, unbounded = set(), [], False
+        for member, (slot, deadline) in enumerate(batch.members):
+            if deadline is None:
+                unbounded = True
+            elif deadline.remaining() <= self.min_seconds:
+                batch.expired.add(member)
+                continue
+            else:
+                deadlines.append(deadline)
+            live_slots.add(slot)
+        slots = sorted(live_slots)
+        loosest = None if unbounded or not deadlines else max(deadlines, key=lambda deadline: deadline.expires_at)
+        if slots:
+            try:
+                vectors = self.embed_batch([batch.texts[slot] for slot in slots], loosest)
+                batch.vectors = dict(zip(slots, vectors))
+            except Exception as e:
+                batch.error = e
+        finished = time.monotonic()
+        with self._cond:
+            self._stats["batches"] += bool(slots)
+            self._stats["errors"] += batch.error is not None
+            self._stats["expired"] += len(batch.expired)
+            if slots:
+                self._stats["max_batch_size"] = max(self._stats["max_batch_size"], len(slots))
+                self._stats["wait_seconds"] += started - batch.opened_at
+                self._stats["call_seconds"] += finished - started
+        batch.done.set()
+
+    def stats(self) -> dict:
+        with self._cond:
+            stats = dict(self._stats)
+        batches = stats["batches"]
+        stats["window_ms"] = 1000 * self.window_seconds
+        stats["max_batch"] = self.max_batch
+        stats["mean_batch_size"] = stats["questions"] / batches if batches else 0.0
+        # Embedding requests counted against the quota per question (1.0 without batching)
+        stats["requests_per_question"] = batches / stats["questions"] if stats["questions"] else 0.0
+        stats["mean_wait_ms"] = 1000 * stats.pop("wait_seconds") / batches if batches else 0.0
+        stats["mean_call_ms"] = 1000 * stats.pop("call_seconds") / batches if batches else 0.0
+        return stats
@@ -0,0 +1,60 @@
+"""
+Compares fixed and adaptive context selection on a small local eval set.
+
+For every question in context_eval_set.jsonl the top candidates are retrieved
+once, then both strategies pick the prompt sections. Reported per strategy:
+sections per prompt, context tokens per prompt, and recall of the expected
+section(s), the quality guard for the smaller prompts.
+
+    python eval_context.py                 # real Gemini question embeddings + cached section embeddings
+    python eval_context.py --fake          # offline, with the fake provider's hashed embeddings
+"""
+import argparse
+import json
+import os
+import tempfile
+
+
+def load_eval_set(path: str) -> list:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate adaptive context selection")
+    parser.add_argument("--eval-set", default="context_eval_set.jsonl")
+    parser.add_argument("--threshold", type=float, default=0.40)
+    parser.add_argument("--top-n", type=int, default=3)
+    parser.add_argument("--fake", action="store_true", help="Use the local fake provider instead of Gemini")
+    args = parser.parse_args()
+
+    cache_file = None
+    if args.fake:
+        os.environ.setdefault("GEMINI_API_KEY", "fake-key-for-eval")
+        import fake_genai
+        fake_genai.install()
+        cache_file = os.path.join(tempfile.mkdtemp(prefix="vedcool-eval-"), "embeddings.pkl")
+
+    import chatbot
+
+    index = chatbot.load_section_index(cache_file or chatbot.EMBEDDINGS_CACHE_FILE)
+    totals = {strategy: {"sections": 0, "tokens": 0, "hits": 0} for strategy in ("fixed", "adaptive")}
+    examples = load_eval_set(args.eval_set)
+
+    for example in examples:
+        embedding = chatbot.get_question_embedding(example["question"])
+        candidates = chatbot.section_candidates(index, embedding, args.top_n)
+        for strategy, total in totals.items():
+            selected = chatbot.select_relevant_sections(candidates, args.threshold, strategy)
+            total["sections"] += len(selected)
+            total["tokens"] += sum(chatbot.estimate_tokens(s["content"]) for s in selected)
+            total["hits"] += any(s["heading"] in example["expected_sections"] for s in selected)
+
+    n = len(examples)
+    print(f"{n} questions, threshold {args.threshold}, top_n {args.top_n}")
+    print(f"{'strategy':>9} {'sections/q':>11} {'tokens/q':>9} {'recall':>7}")
+    for strategy, total in totals.items():
+        print(f"{strategy:>9} {total['sections'] / n:11.2f} {total['tokens'] / n:9.0f} {total['hits'] / n:7.2%}")
+    fixed_tokens = totals["fixed"]["tokens"]
+    if fixed_tokens:
+        print(f"Adaptive context tokens: {1 - totals['adaptive']['tokens'] / fixed_tokens:.1%} fewer than fixed")
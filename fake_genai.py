@@ -0,0 +1,179 @@
+"""
+Local stand-in for the parts of `google.generativeai` the chatbot uses.
+
+Used by the load-testing harness (and any offline run) so the API can be
+exercised without a Gemini key or quota. Embeddings are deterministic hashed
+bag-of-words vectors, so retrieval still behaves sensibly, and every call
+sleeps for a configurable, log-normally jittered latency to mimic the
+provider's long tail.
+
+The vectors are tuned so that similarities land where real ones do: stopwords
+are dropped, words are crudely stemmed, term counts are damped, section titles
+weigh more than body text, and every vector shares a common direction (real
+embedding models never score unrelated texts near 0). Manual questions then
+score about 0.4-0.8 against their section and off-topic ones stay below 0.40,
+so the default threshold separates answered from not-found questions.
+"""
+import hashlib
+import json
+import math
+import random
+import re
+import time
+
+import numpy as np
+
+EMBEDDING_DIM = 768  # Same width as models/text-embedding-004
+
+_WORD_PATTERN = re.compile(r"[a-z0-9]+")
+_TITLE_PATTERN = re.compile(r"Section Title: (.*)\n")  # How chatbot.py lays out section texts
+_STOPWORDS = frozenset(
+    "a an the and or of to in on for with by at from is are be can do does i my me we you your how what where "
+    "when which who why will would should could it its this that these there their them as if into about under "
+    "using use via not no so than then also all any each more most other some such only own same too very just "
+    "please new".split()
+)
+TITLE_WEIGHT = 3.0  # A title word counts like this many body words
+COMMON_SHARE = 0.15  # Cosine every pair of fake embeddings shares, like the baseline of real models
+
+
+def _jittered_sleep(median_ms: float, sigma: float, request_options: dict = None):
+    """Sleeps like a remote call would, honouring a request_options timeout like the real client."""
+    if median_ms <= 0:
+        return
+    seconds = median_ms * random.lognormvariate(0.0, sigma) / 1000.0
+    timeout = (request_options or {}).get("timeout")
+    if timeout is not None and seconds > timeout:
+        time.sleep(timeout)
+        raise TimeoutError(f"Fake provider call timed out after {timeout:.2f}s")
+    time.sleep(seconds)
+
+
+def _terms(text: str) -> list:
+    terms = []
+    for word in _WORD_PATTERN.findall(text.lower()):
+        if word in _STOPWORDS:
+            continue
+        for suffix in ("ing", "ed", "es", "s"):
+            if len(word) > len(suffix) + 2 and word.endswith(suffix):
+                word = word[:-len(suffix)]
+                break
+        terms.append(word)
+    return terms
+
+
+def fake_embedding(text: str, dim: int = EMBEDDING_DIM) -> list:
+    """Hashes (title-weighted, log-damped) content words into a unit-length vector."""
+    counts = {}
+    for term in _terms(text):
+        counts[term] = counts.get(term, 0.0) + 1.0
+    title = _TITLE_PATTERN.match(text)
+    if title:
+        for term in _terms(title.group(1)):
+            counts[term] = counts.get(term, 0.0) + TITLE_WEIGHT
+    vector = np.zeros(dim)
+    for term, count in counts.items():
+        digest = hashlib.md5(term.encode("utf-8")).digest()
+        index = int.from_bytes(digest[:4], "little") % dim
+        vector[index] += (1.0 + math.log(count)) * (1.0 if digest[4] & 1 else -1.0)
+    norm = np.linalg.norm(vector)
+    if norm > 0:
+        vector /= norm
+    vector *= math.sqrt(1.0 - COMMON_SHARE)
+    vector[0] += math.sqrt(COMMON_SHARE)
+    return vector.tolist()
+
+
+def fake_token_count(text: str) -> int:
+    """Roughly what a subword tokenizer would produce: ~1.3 tokens per word plus punctuation."""
+    return len(re.findall(r"[^\w\s]", text)) + round(1.3 * len(_WORD_PATTERN.findall(text.lower())))
+
+
+class FakeUsage:
+    def __init__(self, prompt_token_count: int, candidates_token_count: int):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+        self.total_token_count = prompt_token_count + candidates_token_count
+
+
+class FakeResponse:
+    def __init__(self, text: str, prompt: str = ""):
+        self.text = text
+        self.usage_metadata = FakeUsage(fake_token_count(prompt), fake_token_count(text))
+
+
+class FakeTokenCount:
+    def __init__(self, total_tokens: int):
+        self.total_tokens = total_tokens
+
+
+class FakeGenerativeModel:
+    def __init__(self, provider, model_name: str = "fake-model", **kwargs):
+        self._provider = provider
+        self.model_name = model_name
+        self.generation_config = kwargs.get("generation_config") or {}
+
+    def count_tokens(self, contents, **kwargs):
+        return FakeTokenCount(fake_token_count(str(contents)))
+
+    def generate_content(self, contents, **kwargs):
+        self._provider.generate_calls += 1
+        _jittered_sleep(self._provider.generate_latency_ms, self._provider.latency_sigma,
+                        kwargs.get("request_options"))
+        if random.random() < self._provider.error_rate:
+            raise RuntimeError("Fake provider injected generation failure")
+        if isinstance(contents, list):  # Chat history: answer the latest user turn
+            contents = contents[-1]["parts"][0]
+        titles = re.findall(r'TITLE: "([^"]+)"', str(contents))
+        if self.generation_config.get("response_mime_type") == "application/json":
+            sections = [{"title": "Fake Answer", "intro": "", "steps": [f"See {title}." for title in titles]}]
+            return FakeResponse(json.dumps({"not_found": not titles, "sections": sections if titles else []}), str(contents))
+        items = "".join(f"      <li>See {title}.</li>\n" for title in titles) or "      <li>No steps.</li>\n"
+        return FakeResponse(
+            "<div class='vedcool-answer'>\n"
+            "  <div class='section'>\n"
+            "    <p>📘 <strong>Fake Answer</strong></p>\n"
+            "    <ol>\n"
+            f"{items}"
+            "    </ol>\n"
+            "  </div>\n"
+            "</div>",
+            str(contents),
+        )
+
+
+class FakeGenAI:
+    """Drop-in replacement for the `genai` module object used in chatbot.py."""
+
+    def __init__(self, embed_latency_ms: float = 0.0, generate_latency_ms: float = 0.0,
+                 latency_sigma: float = 0.5, error_rate: float = 0.0):
+        self.embed_latency_ms = embed_latency_ms
+        self.generate_latency_ms = generate_latency_ms
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.embed_calls = 0
+        self.generate_calls = 0
+
+    def configure(self, **kwargs):
+        pass
+
+    def embed_content(self, model, content, task_type=None, **kwargs):
+        self.embed_calls += 1
+        _jittered_sleep(self.embed_latency_ms, self.latency_sigma, kwargs.get("request_options"))
+        if random.random() < self.error_rate:
+            raise RuntimeError("Fake provider injected embedding failure")
+        if isinstance(content, (list, tuple)):
+            return {"embedding": [fake_embedding(item) for item in content]}
+        return {"embedding": fake_embedding(content)}
+
+    def GenerativeModel(self, model_name: str = "fake-model", **kwargs):
+        return FakeGenerativeModel(self, model_name, **kwargs)
+
+
+def install(provider: FakeGenAI = None) -> FakeGenAI:
+    """Routes every Gemini call made by chatbot.py through the fake provider."""
+    import chatbot
+
+    provider = provider or FakeGenAI()
+    chatbot.genai = provider
+    return provider
@@ -0,0 +1,139 @@
+"""
+Local lookup of questions that are essentially a section title.
+
+Questions like "module permission" or "how do I change password" name a TOC
+heading. Matching them against the section headings locally lets retrieval skip
+the remote question embedding. Lookups go through three stages. An exact match
+compares normalised headings. A prefix match binary-searches a sorted array of
+every word-suffix of every heading, so "update profile change passw" finds
+"Update Profile & Change Password". A fuzzy match tolerates typos ("modul
+permision"). Only near-exact matches pointing at a single heading are treated
+as confident: a prefix must cover at least `fuzzy_min_ratio` of the heading, so
+"change password" alone (which may be about something else) goes through
+embedding retrieval and its similarity threshold instead.
+"""
+import bisect
+import difflib
+import re
+import threading
+import time
+from collections import OrderedDict
+
+_WORD_PATTERN = re.compile(r"[a-z0-9]+")
+# Question phrasing around a title: "how do I ...", "what is ...", "... in vedcool?"
+_LEADING_FILLER = re.compile(
+    r"^(?:(?:how|where|what|when)\s+(?:do|can|should|to|is|are|does)?\s*(?:i|we|you|one)?\s*"
+    r"|(?:show|tell)\s+me\s+(?:about|how\s+to)?\s*|help\s+(?:with|me)?\s*|about\s+|the\s+)+"
+)
+_TRAILING_FILLER = re.compile(r"\s+(?:in|on|for)\s+vedcool$")
+
+
+def normalize_heading(text: str) -> str:
+    return " ".join(_WORD_PATTERN.findall(text.lower()))
+
+
+def title_query(question: str) -> str:
+    """The part of a question that could be a heading, with question phrasing removed."""
+    text = normalize_heading(question)
+    text = _TRAILING_FILLER.sub("", _LEADING_FILLER.sub("", text)).strip()
+    return text
+
+
+class HeadingIndex:
+    def __init__(self, headings: list, min_query_chars: int = 4, max_query_words: int = 6,
+                 fuzzy_min_ratio: float = 0.88, cache_size: int = 4096):
+        self.min_query_chars = min_query_chars
+        self.max_query_words = max_query_words
+        self.fuzzy_min_ratio = fuzzy_min_ratio
+        self._rows_by_heading = {}  # normalised heading -> section rows
+        for row, heading in enumerate(headings):
+            key = normalize_heading(heading)
+            if key:
+                self._rows_by_heading.setdefault(key, []).append(row)
+        # Sorted (word-suffix, heading) pairs for prefix search
+        suffixes = set()
+        for key in self._rows_by_heading:
+            words = key.split()
+            for i in range(len(words)):
+                suffixes.add((" ".join(words[i:]), key))
+        self._suffixes = sorted(suffixes)
+        self._suffix_keys = [suffix for suffix, _ in self._suffixes]
+        self._cache = OrderedDict()  # title query -> match result (repeated questions skip the fuzzy scan)
+        self.cache_size = cache_size
+        self._stats_lock = threading.Lock()
+        self._stats = {"lookups": 0, "exact": 0, "prefix": 0, "fuzzy": 0, "misses": 0, "lookup_seconds": 0.0}
+
+    def _prefix_matches(self, query: str) -> set:
+        start = bisect.bisect_left(self._suffix_keys, query)
+        matches = set()
+        for suffix, key in self._suffixes[start:]:
+            if not suffix.startswith(query):
+                break
+            matches.add(key)
+        return matches
+
+    def _fuzzy_match(self, query: str):
+        best_key, best_ratio, runner_up = None, 0.0, 0.0
+        for key in self._rows_by_heading:
+            if abs(len(key) - len(query)) > max(3, len(query) // 4):
+                continue
+            matcher = difflib.SequenceMatcher(None, query, key)
+            # Cheap upper bounds first; the full ratio only for plausible headings
+            if matcher.real_quick_ratio() < self.fuzzy_min_ratio or matcher.quick_ratio() < self.fuzzy_min_ratio:
+                continue
+            ratio = matcher.ratio()
+            if ratio > best_ratio:
+                best_key, best_ratio, runner_up = key, ratio, best_ratio
+            elif ratio > runner_up:
+                runner_up = ratio
+        if best_ratio >= self.fuzzy_min_ratio and best_ratio - runner_up >= 0.05:
+            return best_key, best_ratio
+        return None, 0.0
+
+    def match(self, question: str):
+        """
+        Returns (kind, score, rows) for a confident heading match, else None. `kind` is
+        "exact", "prefix" or "fuzzy"; `score` is 1.0, the share of the heading covered by
+        the prefix, or the fuzzy similarity ratio.
+        """
+        started = time.perf_counter()
+        query = title_query(question)
+        with self._stats_lock:
+            cached = query in self._cache
+            result = self._cache.get(query)
+        if not cached:
+            result = self._lookup(query)
+            with self._stats_lock:
+                self._cache[query] = result
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+        with self._stats_lock:
+            self._stats["lookups"] += 1
+            self._stats[result[0] if result else "misses"] += 1
+            self._stats["lookup_seconds"] += time.perf_counter() - started
+        return result
+
+    def _lookup(self, query: str):
+        if len(query) < self.min_query_chars or len(query.split()) > self.max_query_words:
+            return None
+        if query in self._rows_by_heading:
+            return "exact", 1.0, self._rows_by_heading[query]
+        prefix_keys = self._prefix_matches(query)
+        if len(prefix_keys) == 1:
+            key = prefix_keys.pop()
+            coverage = len(query) / len(key)
+            return ("prefix", coverage, self._rows_by_heading[key]) if coverage >= self.fuzzy_min_ratio else None
+        if not prefix_keys:
+            key, ratio = self._fuzzy_match(query)
+            if key is not None:
+                return "fuzzy", ratio, self._rows_by_heading[key]
+        return None
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        hits = stats["exact"] + stats["prefix"] + stats["fuzzy"]
+        stats["hit_rate"] = hits / stats["lookups"] if stats["lookups"] else 0.0
+        stats["headings"] = len(self._rows_by_heading)
+        return stats
@@ -0,0 +1,151 @@
+"""
+Hedged requests for tail-latency control.
+
+The first call is sent as usual; if it hasn't finished after the configured
+percentile of recently observed latencies, an identical second call is sent
+and whichever succeeds first wins. Hedges are limited to a fraction of primary
+calls by a small budget so quota use stays bounded. The Gemini SDK calls used
+here are blocking, so the loser cannot be interrupted mid-flight: it is
+cancelled if it hasn't started yet, otherwise its result is discarded.
+"""
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+class LatencyTracker:
+    """Sliding window of recent call latencies (seconds)."""
+
+    def __init__(self, window: int = 200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, pct: float, min_samples: int = 1):
+        with self._lock:
+            if len(self._samples) < max(1, min_samples):
+                return None
+            ordered = sorted(self._samples)
+        rank = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered))) - 1))
+        return ordered[rank]
+
+
+class HedgeBudget:
+    """Every primary call earns `ratio` of a hedge; a hedge spends one. Capped at `burst` saved hedges."""
+
+    def __init__(self, ratio: float, burst: float = 5.0):
+        self.ratio = ratio
+        self.burst = burst
+        self._balance = 0.0
+        self._lock = threading.Lock()
+
+    def earn(self):
+        with self._lock:
+            self._balance = min(self.burst, self._balance + self.ratio)
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            if self._balance >= 1.0:
+                self._balance -= 1.0
+                return True
+            return False
+
+
+class HedgedCaller:
+    def __init__(self, percentile: float = 95.0, max_hedge_ratio: float = 0.05, min_samples: int = 20,
+                 min_delay_seconds: float = 0.2, max_workers: int = 64, window: int = 200):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.min_delay_seconds = min_delay_seconds
+        self.latencies = LatencyTracker(window)
+        self.budget = HedgeBudget(max_hedge_ratio)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hedged-call")
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "calls": 0,
+            "hedges_sent": 0,
+            "hedge_wins": 0,  # The hedge returned first: hedging helped
+            "primary_wins": 0,  # A hedge was sent but the primary still won
+            "budget_denied": 0,  # Hedge wanted but over budget (or refused by `before_hedge`)
+            "hedge_latency_saved_seconds": 0.0,  # Measured when the beaten primary eventually returns
+        }
+
+    def _count(self, key: str, amount=1):
+        with self._stats_lock:
+            self._stats[key] += amount
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["hedge_delay_seconds"] = self.hedge_delay()
+        stats["hedge_win_rate"] = stats["hedge_wins"] / stats["hedges_sent"] if stats["hedges_sent"] else 0.0
+        return stats
+
+    def hedge_delay(self):
+        delay = self.latencies.percentile(self.percentile, self.min_samples)
+        return None if delay is None else max(delay, self.min_delay_seconds)
+
+    def _timed(self, fn, args, kwargs):
+        started = time.monotonic()
+        result = fn(*args, **kwargs)
+        return result, started, time.monotonic() - started
+
+    def call(self, fn, *args, before_hedge=None, **kwargs):
+        """
+        Runs fn(*args, **kwargs), hedging it once if it is slow. `before_hedge` (optional)
+        is called right before a hedge is sent and may return False to veto it, e.g. when
+        the rate scheduler has no spare quota.
+        """
+        self._count("calls")
+        self.budget.earn()
+        called_at = time.monotonic()
+        primary = self._executor.submit(self._timed, fn, args, kwargs)
+
+        delay = self.hedge_delay()
+        if delay is None:
+            return self._finish(primary.result())
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return self._finish(primary.result())
+
+        if not self.budget.try_spend() or (before_hedge is not None and not before_hedge()):
+            self._count("budget_denied")
+            return self._finish(primary.result())
+
+        self._count("hedges_sent")
+        logging.debug(f"Hedging slow call after {delay:.3f}s")
+        hedge = self._executor.submit(self._timed, fn, args, kwargs)
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    error = future.exception()
+                    continue
+                won_at = time.monotonic()
+                for loser in pending:
+                    if not loser.cancel() and future is hedge:
+                        loser.add_done_callback(lambda f: self._record_saving(f, won_at))
+                self._count("hedge_wins" if future is hedge else "primary_wins")
+                result, _, _ = future.result()
+                self.latencies.record(won_at - called_at)
+                return result
+        raise error
+
+    def _record_saving(self, primary, won_at: float):
+        """Once a beaten primary finally returns, credit the hedge with the time it saved."""
+        if primary.cancelled() or primary.exception() is not None:
+            return
+        _, started, elapsed = primary.result()
+        self._count("hedge_latency_saved_seconds", max(0.0, started + elapsed - won_at))
+
+    def _finish(self, timed_result):
+        result, _, elapsed = timed_result
+        self.latencies.record(elapsed)
+        return result
@@ -0,0 +1,274 @@
+"""
+Load-testing harness for the VedCool Chatbot API.
+
+Replays a question corpus against POST /ask while ramping concurrency and
+reports throughput, p50/p95/p99 latency and error rate for every stage, plus
+the highest sustained QPS that stayed within the p99 latency SLO. Each stage
+also reports how many answers found something in the manual and, in-process,
+how many were actually generated, so a fast "not found" path can't pass for
+generation throughput.
+
+By default the app is driven in-process through ASGI with the local fake
+Gemini provider (see fake_genai.py), so it runs on a laptop without an API key:
+
+    python loadtest.py run --levels 1,2,4,8,16 --stage-seconds 10 --slo-p99-ms 1500
+
+To load a real deployment instead, point it at a URL:
+
+    python loadtest.py run --url http://127.0.0.1:8000
+
+`python loadtest.py serve` starts uvicorn on main.app with the fake provider
+installed, for testing the full network stack locally.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+
+import httpx
+import numpy as np
+
+DEFAULT_QUESTIONS = [
+    "How do I create a new admission?",
+    "How can I import multiple students at once?",
+    "How do I change my password?",
+    "How do I add a new employee?",
+    "Where can I see the student list?",
+    "How do I set up exam marks?",
+    "How do I send bulk SMS to parents?",
+    "How do I collect a fee payment?",
+    "How can I issue a library book?",
+    "How do I take student attendance?",
+    "How do I configure module permission?",
+    "How do I run a system update?",
+    "How do I create a database backup?",
+    "How do I assign homework?",
+    "How do I add a hostel?",
+]
+NOT_FOUND_MARKER = "couldn't find specific information"  # In chatbot.answer_question's not-found reply
+
+
+# --- Corpus & Provider Setup ---
+def load_questions(path: str = None) -> list:
+    """Loads questions from a .txt file (one per line) or .jsonl file ({"question": ...})."""
+    if not path:
+        return list(DEFAULT_QUESTIONS)
+    questions = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if path.endswith(".jsonl"):
+                question = json.loads(line).get("question", "")
+            else:
+                question = line
+            if question.strip():
+                questions.append(question.strip())
+    if not questions:
+        raise ValueError(f"No questions found in corpus file '{path}'")
+    return questions
+
+
+def install_fake_provider(args):
+    """Imports the app with the fake Gemini provider and a throwaway embeddings cache."""
+    os.environ.setdefault("GEMINI_API_KEY", "fake-key-for-load-testing")
+    import chatbot
+    import fake_genai
+    import main
+
+    fake_genai.install(fake_genai.FakeGenAI(
+        embed_latency_ms=args.embed_latency_ms,
+        generate_latency_ms=args.generate_latency_ms,
+        error_rate=args.fake_error_rate,
+    ))
+    # Never mix fake vectors with the real cache on disk, and measure the generation path
+    # rather than answers persisted by earlier runs or cached by this one
+    main.EMBEDDINGS_CACHE_FILE = os.path.join(tempfile.mkdtemp(prefix="vedcool-loadtest-"), "embeddings.pkl")
+    main.ANSWER_STORE_FILE = None
+    chatbot.CACHE_ANSWERS = False
+    return main
+
+
+# --- Load Generation ---
+def summarize_stage(concurrency: int, latencies_ms: list, errors: int, elapsed: float,
+                    found: int = 0, generated: int = None) -> dict:
+    total = len(latencies_ms) + errors
+    ok = len(latencies_ms)
+    stats = {
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": errors,
+        "error_rate": errors / total if total else 0.0,
+        "throughput_qps": len(latencies_ms) / elapsed if elapsed > 0 else 0.0,
+        "p50_ms": None,
+        "p95_ms": None,
+        "p99_ms": None,
+        "found_share": found / ok if ok else None,
+        # Share of answers that called generation (in-process only); the rest were not-found,
+        # extractive or cached
+        "generated_share": min(1.0, generated / ok) if ok and generated is not None else None,
+    }
+    if latencies_ms:
+        p50, p95, p99 = np.percentile(latencies_ms, [50, 95, 99])
+        stats.update({"p50_ms": float(p50), "p95_ms": float(p95), "p99_ms": float(p99)})
+    return stats
+
+
+async def run_stage(client: httpx.AsyncClient, questions: list, concurrency: int,
+                    duration_s: float, timeout_s: float, mode: str = None, provider=None) -> dict:
+    """
+    Runs `concurrency` closed-loop clients against /ask for `duration_s` seconds.
+    `provider` is the fake Gemini provider when in-process, for counting generation calls.
+    """
+    latencies_ms = []
+    errors = 0
+    found = 0
+    generate_calls = provider.generate_calls if provider is not None else None
+    stop_at = time.perf_counter() + duration_s
+
+    async def worker():
+        nonlocal errors, found
+        while time.perf_counter() < stop_at:
+            question = random.choice(questions)
+            started = time.perf_counter()
+            try:
+                payload = {"question": question, "mode": mode} if mode else {"question": question}
+                response = await client.post("/ask", json=payload, timeout=timeout_s)
+                ok = response.status_code == 200
+            except (httpx.HTTPError, asyncio.TimeoutError) as e:
+                logging.debug(f"Request failed: {e}")
+                ok = False
+            if ok:
+                latencies_ms.append((time.perf_counter() - started) * 1000.0)
+                found += NOT_FOUND_MARKER not in response.json().get("answer", "")
+            else:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    generated = provider.generate_calls - generate_calls if provider is not None else None
+    return summarize_stage(concurrency, latencies_ms, errors, time.perf_counter() - started, found, generated)
+
+
+async def ramp(client: httpx.AsyncClient, questions: list, levels: list, stage_seconds: float,
+               slo_p99_ms: float, max_error_rate: float, timeout_s: float,
+               stages_past_knee: int = 1, mode: str = None, provider=None) -> dict:
+    """Steps through concurrency levels until the latency/error curve bends past the SLO."""
+    stages = []
+    breaches = 0
+    for concurrency in levels:
+        stats = await run_stage(client, questions, concurrency, stage_seconds, timeout_s, mode, provider)
+        stats["within_slo"] = (
+            stats["p99_ms"] is not None
+            and stats["p99_ms"] <= slo_p99_ms
+            and stats["error_rate"] <= max_error_rate
+        )
+        stages.append(stats)
+        logging.info(
+            f"Stage c={concurrency}: {stats['throughput_qps']:.1f} qps, "
+            f"p99={stats['p99_ms'] or 0:.0f} ms, errors={stats['error_rate']:.1%}, "
+            f"found={stats['found_share'] or 0:.0%}"
+        )
+        if not stats["within_slo"]:
+            breaches += 1
+            if breaches > stages_past_knee:
+                break
+
+    passing = [s for s in stages if s["within_slo"]]
+    best = max(passing, key=lambda s: s["throughput_qps"]) if passing else None
+    return {
+        "slo_p99_ms": slo_p99_ms,
+        "max_error_rate": max_error_rate,
+        "max_sustainable_qps": best["throughput_qps"] if best else 0.0,
+        "max_sustainable_concurrency": best["concurrency"] if best else None,
+        "stages": stages,
+    }
+
+
+def format_report(report: dict) -> str:
+    lines = [
+        f"{'conc':>5} {'reqs':>7} {'qps':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7} "
+        f"{'found':>6} {'gen':>6}  SLO",
+    ]
+    for s in report["stages"]:
+        pct = [f"{s[k]:8.0f}" if s[k] is not None else f"{'-':>8}" for k in ("p50_ms", "p95_ms", "p99_ms")]
+        shares = [f"{s[k]:6.0%}" if s.get(k) is not None else f"{'-':>6}" for k in ("found_share", "generated_share")]
+        lines.append(
+            f"{s['concurrency']:>5} {s['requests']:>7} {s['throughput_qps']:8.1f} {' '.join(pct)} "
+            f"{s['error_rate']:7.1%} {' '.join(shares)}  {'ok' if s['within_slo'] else 'BREACH'}"
+        )
+    lines.append(
+        f"Max sustainable throughput at p99 <= {report['slo_p99_ms']:.0f} ms: "
+        f"{report['max_sustainable_qps']:.1f} qps (concurrency {report['max_sustainable_concurrency']})"
+    )
+    return "\n".join(lines)
+
+
+async def run_load_test(args) -> dict:
+    questions = load_questions(args.questions)
+    levels = [int(x) for x in args.levels.split(",") if x.strip()]
+
+    provider = None
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url)
+    else:
+        main = install_fake_provider(args)
+        import chatbot
+        provider = chatbot.genai  # The fake installed above
+        await main.startup_event()
+        await asyncio.to_thread(main.wait_until_ready)
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://loadtest")
+
+    async with client:
+        return await ramp(
+            client, questions, levels, args.stage_seconds,
+            args.slo_p99_ms, args.max_error_rate, args.timeout_s, mode=args.mode, provider=provider,
+        )
+
+
+# --- CLI ---
+def build_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Load-test the VedCool Chatbot API")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    fake_args = argparse.ArgumentParser(add_help=False)
+    fake_args.add_argument("--embed-latency-ms", type=float, default=40.0, help="Median fake embedding latency")
+    fake_args.add_argument("--generate-latency-ms", type=float, default=400.0, help="Median fake generation latency")
+    fake_args.add_argument("--fake-error-rate", type=float, default=0.0, help="Fraction of fake calls that fail")
+
+    run = sub.add_parser("run", parents=[fake_args], help="Ramp load against /ask and report latency")
+    run.add_argument("--url", help="Target a running server instead of the in-process ASGI app")
+    run.add_argument("--questions", help="Question corpus (.txt one per line, or .jsonl with 'question')")
+    run.add_argument("--levels", default="1,2,4,8,16,32", help="Comma-separated concurrency levels")
+    run.add_argument("--stage-seconds", type=float, default=10.0)
+    run.add_argument("--slo-p99-ms", type=float, default=2000.0)
+    run.add_argument("--max-error-rate", type=float, default=0.01)
+    run.add_argument("--timeout-s", type=float, default=120.0)
+    run.add_argument("--mode", choices=["llm", "extractive", "auto"], help="Answer mode sent with every request")
+    run.add_argument("--json", dest="json_path", help="Also write the report as JSON to this path")
+
+    serve = sub.add_parser("serve", parents=[fake_args], help="Run the API with the fake provider")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8000)
+    return parser
+
+
+if __name__ == "__main__":
+    args = build_arg_parser().parse_args()
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    if args.command == "serve":
+        import uvicorn
+        main = install_fake_provider(args)
+        uvicorn.run(main.app, host=args.host, port=args.port)
+    else:
+        report = asyncio.run(run_load_test(args))
+        print(format_report(report))
+        if args.json_path:
+            with open(args.json_path, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
@@ -1,24 +1,62 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
+from typing import Literal, Optional
 import logging
 import os
-import pickle
+import threading
+import time
 import numpy as np
+from answer_store import AnswerStore
+from deadline import Deadline
+import structured_logging
+from structured_logging import begin_request, log_event
 from chatbot import (
     parse_manual,
-    truncate_text_to_tokens,
-    get_embedding_with_retry,
+    get_question_embedding,
+    get_chat_model,
+    heading_fast_path_stats,
+    describe_index,
+    resolve_scope,
+    load_section_data,
+    token_counter,
     answer_question,
+    build_section_index,
+    chat_sessions,
+    suggestions,
     manual_text,
+    CHAT_MODEL,
+    GENERATION_OUTPUT_FORMAT,
+    READINESS_PROBE_QUESTION,
+    ANSWER_STORE_FILE,
     EMBEDDINGS_CACHE_FILE,
-    MAX_TOKENS_FOR_EMBEDDING
+    REQUEST_DEADLINE_SECONDS,
+    DEFAULT_ANSWER_MODE,
+    LOG_NONBLOCKING,
+    LOG_QUEUE_SIZE,
+    LOG_FORMAT,
+    LOG_DETAIL_SAMPLE_RATE,
+    generation_hedger,
+    rate_scheduler,
+    retrieval_client,
+    response_cache,
+    question_batcher,
+    SUGGEST_MAX_QUESTIONS,
+    WARMUP_QUESTION_LOG,
+    WARMUP_LIMIT,
+    WARMUP_RATE_PER_SECOND,
+    WARMUP_BEFORE_READY,
 )
+from warmup import load_question_counts, rank_questions, start_background_warm_up, warm_up
 
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s [%(levelname)s] %(message)s"
 )
+# Keep handler I/O off the request path
+if LOG_NONBLOCKING:
+    structured_logging.install_queue_logging(LOG_QUEUE_SIZE, json_format=LOG_FORMAT == "json")
 
 app = FastAPI(
     title="VedCool Chatbot API",
@@ -35,13 +73,35 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+class RequestArrivalMiddleware:
+    """
+    Stamps every request with its arrival time (added last, so it runs first). Request
+    deadlines start from it and also cover the time spent waiting for a worker thread.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            scope.setdefault("state", {})["arrived_at"] = time.monotonic()
+        await self.app(scope, receive, send)
+
+app.add_middleware(RequestArrivalMiddleware)
+
 class QuestionRequest(BaseModel):
     question: str
+    # "llm" = Gemini-written answer, "extractive" = manual steps rendered directly (fast, free),
+    # "auto" = extractive for near-exact matches or while Gemini is degraded
+    mode: Optional[Literal["llm", "extractive", "auto"]] = None
+    # Role or module to search within, e.g. "Settings" or "Branch Admin > Settings" (see /admin/index)
+    scope: Optional[str] = None
     
     class Config:
         json_schema_extra = {
             "example": {
-                "question": "How do I create a new admission?"
+                "question": "How do I create a new admission?",
+                "scope": "Admission"
             }
         }
 
@@ -50,72 +110,170 @@ class QuestionResponse(BaseModel):
     answer: str
     status: str = "success"
 
+class ChatRequest(BaseModel):
+    question: str
+    # Omit on the first turn; send back the returned session_id for follow-ups
+    session_id: Optional[str] = None
+    mode: Optional[Literal["llm", "extractive", "auto"]] = None
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "question": "And how do I edit it?",
+                "session_id": "3f2b9c0e5d7a4e6f8a1b2c3d4e5f6a7b"
+            }
+        }
+
+class ChatResponse(BaseModel):
+    session_id: str
+    question: str
+    answer: str
+    turn: int
+    status: str = "success"
+
 # Global variable to store section data
 section_data_for_chatbot = []
+answer_store = None
 
-@app.on_event("startup")
-async def startup_event():
-    """Load embeddings on application startup"""
-    global section_data_for_chatbot
-    
-    logging.info("Starting VedCool Chatbot API...")
-    
-    # Parse manual
-    parsed_manual_sections = parse_manual(manual_text)
-    
-    if not parsed_manual_sections:
-        logging.error("Failed to parse manual sections!")
-        raise RuntimeError("Manual parsing failed - cannot start API")
-    
-    logging.info(f"Parsed {len(parsed_manual_sections)} manual sections")
-    
-    # Load or compute embeddings
-    if os.path.exists(EMBEDDINGS_CACHE_FILE):
+# Progress of the background index load, reported by /readyz
+startup_state = {
+    "phase": "not started",
+    "sections_total": 0,
+    "sections_embedded": 0,
+    "embedding_failures": [],
+    "embeddings_source": None,
+    "error": None,
+    "started_at": None,
+    "index_built_at": None,
+    "ready_at": None,
+}
+index_ready = threading.Event()
+
+def set_startup_phase(phase: str):
+    startup_state["phase"] = phase
+    logging.info(f"Startup phase: {phase}")
+
+def report_embedding_progress(source: str, sections_done: int, failed_heading: str = None):
+    """Progress callback of chatbot.load_section_data, surfaced by /readyz."""
+    if startup_state["embeddings_source"] != source:
+        startup_state["embeddings_source"] = source
+        if source == "computed":
+            set_startup_phase("embedding sections")
+    startup_state["sections_embedded"] = sections_done
+    if failed_heading:
+        startup_state["embedding_failures"].append(failed_heading)
+
+def warm_up_runtime(section_index):
+    """
+    Pays the one-off costs of the first request before reporting ready: the shared
+    Gemini model client, NumPy/BLAS initialisation of the search path and, if
+    enabled, the embedding connection (the probe question lands in the embedding cache).
+    """
+    started = time.monotonic()
+    try:
+        get_chat_model(CHAT_MODEL, GENERATION_OUTPUT_FORMAT)
+    except Exception as e:
+        logging.warning(f"Warm-up: could not create the chat model client: {str(e)}")
+
+    probe = np.random.default_rng(0).standard_normal(section_index.dimension).astype(np.float32)
+    for _ in range(3):
+        section_index.search_rows(probe, top_n=3)
+
+    if READINESS_PROBE_QUESTION:
         try:
-            with open(EMBEDDINGS_CACHE_FILE, "rb") as f:
-                cached = pickle.load(f)
-            if isinstance(cached, list) and all(
-                isinstance(item, tuple) and len(item) == 3 
-                for item in cached
-            ):
-                section_data_for_chatbot = cached
-                logging.info(f"Loaded {len(section_data_for_chatbot)} embeddings from cache")
-            else:
-                logging.warning("Cached data invalid. Recomputing embeddings.")
+            section_index.search_rows(get_question_embedding(READINESS_PROBE_QUESTION), top_n=3)
         except Exception as e:
-            logging.warning(f"Error loading embeddings cache: {str(e)}")
+            logging.warning(f"Warm-up: probe question embedding failed: {str(e)}")
+    logging.info(f"Runtime warm-up finished in {time.monotonic() - started:.2f}s")
 
-    if not section_data_for_chatbot:
-        logging.info("Computing embeddings fresh...")
-        section_data_for_chatbot = []
+def load_index_and_warm_up():
+    """Builds the search index and warms caches; runs on a background thread."""
+    global section_data_for_chatbot, answer_store
+    try:
+        set_startup_phase("parsing manual")
+        parsed_manual_sections, outline = parse_manual(manual_text, with_outline=True)
         
-        for i, (heading, content) in enumerate(parsed_manual_sections):
-            logging.info(f"Processing section {i+1}/{len(parsed_manual_sections)}: '{heading}'")
-            text_to_embed = f"Section Title: {heading}\n\nContent:\n{content}"
-            truncated = truncate_text_to_tokens(text_to_embed, MAX_TOKENS_FOR_EMBEDDING)
-            
-            try:
-                emb = get_embedding_with_retry(truncated)
-                if emb is not None and emb.size > 0:
-                    section_data_for_chatbot.append((heading, content, emb))
-                else:
-                    logging.warning(f"Skipping section '{heading}' due to invalid embedding")
-            except Exception as e:
-                logging.error(f"Failed to embed section '{heading}': {str(e)}")
-                continue
+        if not parsed_manual_sections:
+            logging.error("Failed to parse manual sections!")
+            raise RuntimeError("Manual parsing failed - cannot start API")
         
-        if section_data_for_chatbot:
+        startup_state["sections_total"] = len(parsed_manual_sections)
+        logging.info(f"Parsed {len(parsed_manual_sections)} manual sections")
+
+        # Typeahead works from the TOC and past questions alone, so it is ready before the index
+        suggestions.add_headings([heading for heading, _ in outline])
+        if WARMUP_QUESTION_LOG:
             try:
-                with open(EMBEDDINGS_CACHE_FILE, "wb") as f:
-                    pickle.dump(section_data_for_chatbot, f)
-                logging.info(f"Embeddings saved to {EMBEDDINGS_CACHE_FILE}")
-            except Exception as e:
-                logging.error(f"Error saving embeddings cache: {str(e)}")
-        else:
-            logging.error("No embeddings generated!")
+                for question, count in load_question_counts(WARMUP_QUESTION_LOG).most_common(SUGGEST_MAX_QUESTIONS):
+                    suggestions.record_question(question, count)
+            except OSError as e:
+                logging.warning(f"Cannot read question log '{WARMUP_QUESTION_LOG}' for suggestions: {str(e)}")
+
+        # Validates the cache against the parsed headings; calibrates token counts before any re-embedding
+        set_startup_phase("loading embeddings")
+        section_data = load_section_data(parsed_manual_sections, EMBEDDINGS_CACHE_FILE, progress=report_embedding_progress)
+        if not section_data:
             raise RuntimeError("Embedding generation failed - cannot start API")
-    
-    logging.info(f"API ready with {len(section_data_for_chatbot)} sections loaded")
+
+        # Swap the float64 tuples for the (optionally quantised) search index
+        set_startup_phase("building index")
+        section_index = build_section_index(section_data, EMBEDDINGS_CACHE_FILE, outline=outline)
+        startup_state["index_built_at"] = time.time()
+
+        # Reuse answers from previous runs unless the sections they were built from changed
+        if ANSWER_STORE_FILE:
+            try:
+                answer_store = AnswerStore(ANSWER_STORE_FILE)
+                answer_store.invalidate_changed(section_index.section_hashes())
+            except Exception as e:
+                logging.error(f"Error opening answer store '{ANSWER_STORE_FILE}': {str(e)}")
+                answer_store = None
+
+        set_startup_phase("warming up")
+        warm_up_runtime(section_index)
+        section_data_for_chatbot = section_index
+
+        # Precompute answers for popular questions so the first users after a deploy don't pay for them
+        if WARMUP_QUESTION_LOG:
+            if WARMUP_BEFORE_READY:
+                try:
+                    questions = rank_questions(load_question_counts(WARMUP_QUESTION_LOG), WARMUP_LIMIT)
+                    warm_up(questions, section_data_for_chatbot, answer_store, WARMUP_RATE_PER_SECOND)
+                except OSError as e:
+                    logging.warning(f"Cannot read warm-up question log '{WARMUP_QUESTION_LOG}': {str(e)}")
+            else:
+                start_background_warm_up(
+                    WARMUP_QUESTION_LOG, WARMUP_LIMIT, section_data_for_chatbot,
+                    answer_store, WARMUP_RATE_PER_SECOND,
+                )
+
+        startup_state["ready_at"] = time.time()
+        set_startup_phase("ready")
+        index_ready.set()
+        logging.info(
+            f"API ready with {len(section_data_for_chatbot)} sections loaded "
+            f"in {startup_state['ready_at'] - startup_state['started_at']:.1f}s"
+        )
+    except Exception as e:
+        startup_state["error"] = str(e)
+        set_startup_phase("failed")
+        logging.error(f"Index loading failed: {str(e)}", exc_info=True)
+
+def wait_until_ready(timeout: float = None) -> bool:
+    """Blocks until the background load finished; raises if it failed."""
+    while not index_ready.wait(0.05):
+        if startup_state["phase"] == "failed":
+            raise RuntimeError(f"Index loading failed: {startup_state['error']}")
+        if timeout is not None and time.time() - startup_state["started_at"] > timeout:
+            return False
+    return True
+
+@app.on_event("startup")
+async def startup_event():
+    """Start loading the index in the background so the server accepts connections (and /livez) at once"""
+    logging.info("Starting VedCool Chatbot API...")
+    startup_state["started_at"] = time.time()
+    threading.Thread(target=load_index_and_warm_up, name="index-loader", daemon=True).start()
 
 @app.get("/")
 async def root():
@@ -125,7 +283,14 @@ async def root():
         "version": "1.0.0",
         "endpoints": {
             "POST /ask": "Ask a question about VedCool",
-            "GET /health": "Health check endpoint"
+            "POST /chat": "Ask a question within a multi-turn chat session",
+            "GET /suggest": "Typeahead suggestions (section titles and popular questions) for typed text",
+            "DELETE /chat/{session_id}": "End a chat session",
+            "GET /health": "Health check endpoint",
+            "GET /livez": "Liveness probe",
+            "GET /readyz": "Readiness probe with index loading progress",
+            "GET /admin/index": "Loaded index: sizes, memory use, largest and skipped sections",
+            "GET /metrics": "Runtime metrics (hedging, rate limiting, logging, heading fast path, tokens, cache tiers, embedding batching)"
         }
     }
 
@@ -135,41 +300,131 @@ async def health_check():
     return {
         "status": "healthy",
         "sections_loaded": len(section_data_for_chatbot),
-        "ready": len(section_data_for_chatbot) > 0
+        "ready": index_ready.is_set()
     }
 
-@app.post("/ask", response_model=QuestionResponse)
-async def ask_question(data: QuestionRequest):
-    """
-    Ask a question about the VedCool platform.
-    
-    - **question**: Your question about VedCool features or usage
-    """
-    q = data.question.strip()
-    
+@app.get("/livez")
+async def liveness():
+    """Liveness probe: the process is up and serving, even while the index is still loading"""
+    return {"status": "alive"}
+
+@app.get("/readyz")
+async def readiness():
+    """Readiness probe: 200 once the index is loaded and warmed up, 503 (with progress) until then"""
+    progress = dict(startup_state)
+    if progress["sections_total"]:
+        progress["progress"] = round(progress["sections_embedded"] / progress["sections_total"], 3)
+    if index_ready.is_set():
+        return {"status": "ready", **progress}
+    return JSONResponse(status_code=503, content={"status": "not ready", **progress})
+
+@app.get("/metrics")
+async def metrics():
+    """Runtime metrics for the Gemini and retrieval call paths"""
+    return {
+        "hedging": generation_hedger.stats() if generation_hedger is not None else None,
+        "rate_limiter": rate_scheduler.stats if rate_scheduler is not None else None,
+        "logging": structured_logging.stats(),
+        "heading_fast_path": heading_fast_path_stats(),
+        "tokens": token_counter.stats(),
+        "retrieval_service": retrieval_client.stats() if retrieval_client is not None else None,
+        "cache": response_cache.stats(),
+        "suggest": suggestions.stats(),
+        "embedding_batcher": question_batcher.stats() if question_batcher is not None else None,
+    }
+
+def validate_question(question: str) -> str:
+    """Shared request checks for /ask and /chat; returns the stripped question."""
+    q = question.strip()
+
     if not q:
         raise HTTPException(status_code=400, detail="Question cannot be empty")
-    
+
     if len(q) > 500:
         raise HTTPException(
-            status_code=400, 
+            status_code=400,
             detail="Question is too long. Please limit to 500 characters."
         )
-    
+
     if not section_data_for_chatbot:
         raise HTTPException(
             status_code=503,
             detail="Chatbot is not ready yet. Embeddings are still loading."
         )
+    return q
+
+@app.get("/admin/index")
+async def index_report(largest: int = 10):
+    """What this worker has loaded: counts, dimensions, memory use, largest and skipped sections"""
+    if not index_ready.is_set() or not section_data_for_chatbot:
+        raise HTTPException(status_code=503, detail="Index is not loaded yet. See /readyz for progress.")
+    report = describe_index(section_data_for_chatbot, largest=max(1, min(largest, 100)))
+    report["skipped"]["embedding_failures"] = list(startup_state["embedding_failures"])
+    report["artifact"] = {
+        "embeddings_cache_file": EMBEDDINGS_CACHE_FILE,
+        "embeddings_source": startup_state["embeddings_source"],
+        "manual_version": report["manual_version"],
+    }
+    if EMBEDDINGS_CACHE_FILE and os.path.exists(EMBEDDINGS_CACHE_FILE):
+        stat = os.stat(EMBEDDINGS_CACHE_FILE)
+        report["artifact"].update(bytes=stat.st_size, modified_at=stat.st_mtime)
+    report["load"] = {
+        "started_at": startup_state["started_at"],
+        "index_built_at": startup_state["index_built_at"],
+        "ready_at": startup_state["ready_at"],
+        "seconds_to_ready": startup_state["ready_at"] - startup_state["started_at"],
+    }
+    if answer_store is not None:
+        report["caches"]["stored_answers"] = answer_store.count()
+    return report
+
+@app.get("/suggest")
+async def suggest(q: str, limit: int = 8):
+    """
+    Suggestions while the user types: section titles and popular past questions
+    matching the typed text at the start of any word. Answered locally, no remote calls.
+
+    - **q**: Text typed so far
+    - **limit**: Maximum number of suggestions (1-20)
+    """
+    return {"query": q, "suggestions": suggestions.suggest(q[:200], max(1, min(limit, 20)))}
+
+# Plain def: FastAPI runs it on its thread pool, so Gemini calls, quota waits and embedding
+# micro-batching block a worker thread instead of the event loop
+@app.post("/ask", response_model=QuestionResponse)
+def ask_question(data: QuestionRequest, request: Request):
+    """
+    Ask a question about the VedCool platform.
+    
+    - **question**: Your question about VedCool features or usage
+    - **mode**: Optional answer mode: "llm", "extractive" or "auto"
+    - **scope**: Optional role or module to restrict the search to
+    """
+    deadline = Deadline(REQUEST_DEADLINE_SECONDS, started_at=request.state.arrived_at)
+    begin_request(LOG_DETAIL_SAMPLE_RATE)
+    q = validate_question(data.question)
+    if data.scope:
+        try:
+            resolve_scope(section_data_for_chatbot, data.scope)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"{e} Known scopes are listed under 'tree' in /admin/index.")
     
     try:
-        logging.info(f"Processing question: {q}")
+        log_event(logging.INFO, "Processing question: %s", q, scope=data.scope)
+        outcome = {}
         answer = answer_question(
             question=q,
             section_data=section_data_for_chatbot,
             threshold=0.40,
             top_n=3,
+            answer_store=answer_store,
+            deadline=deadline,
+            mode=data.mode or DEFAULT_ANSWER_MODE,
+            scope=data.scope,
+            outcome=outcome,
         )
+        if outcome["found"]:  # Only questions the manual answers are worth suggesting
+            suggestions.record_question(q)
         return QuestionResponse(question=q, answer=answer)
     except Exception as e:
         logging.error(f"Error answering question: {str(e)}", exc_info=True)
@@ -178,6 +433,54 @@ async def ask_question(data: QuestionRequest):
             detail="An error occurred while processing your question. Please try again."
         )
 
+@app.post("/chat", response_model=ChatResponse)
+def chat(data: ChatRequest, request: Request):
+    """
+    Ask a question as part of a conversation. Follow-ups ("and how do I edit it?")
+    are answered with the earlier turns and their retrieved sections as context.
+
+    - **question**: Your question or follow-up
+    - **session_id**: Session returned by a previous /chat call (omit to start one; an unknown or expired id starts a new session under a new id)
+    - **mode**: Optional answer mode: "llm", "extractive" or "auto"
+    """
+    deadline = Deadline(REQUEST_DEADLINE_SECONDS, started_at=request.state.arrived_at)
+    begin_request(LOG_DETAIL_SAMPLE_RATE)
+    q = validate_question(data.question)
+    session = chat_sessions.get_or_create(data.session_id)
+
+    try:
+        log_event(logging.INFO, "Processing chat question: %s", q, session_id=session.session_id,
+                  turn=len(session.turns) + 1)
+        outcome = {}
+        with session.lock:
+            answer = answer_question(
+                question=q,
+                section_data=section_data_for_chatbot,
+                threshold=0.40,
+                top_n=3,
+                answer_store=answer_store,
+                deadline=deadline,
+                mode=data.mode or DEFAULT_ANSWER_MODE,
+                session=session,
+                outcome=outcome,
+            )
+            turn = len(session.turns)
+        # Follow-ups ("and how do I edit it?") make poor suggestions on their own, as do unanswered questions
+        if turn == 1 and outcome["found"]:
+            suggestions.record_question(q)
+        return ChatResponse(session_id=session.session_id, question=q, answer=answer, turn=turn)
+    except Exception as e:
+        logging.error(f"Error answering chat question: {str(e)}", exc_info=True)
+        raise HTTPException(
+            status_code=500,
+            detail="An error occurred while processing your question. Please try again."
+        )
+
+@app.delete("/chat/{session_id}")
+async def end_chat(session_id: str):
+    """Forget a chat session and its history"""
+    return {"session_id": session_id, "deleted": chat_sessions.delete(session_id)}
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="127.0.0.1", port=8000)
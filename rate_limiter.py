@@ -0,0 +1,224 @@
+"""
+Quota-aware rate scheduler for Gemini embedding and generation calls.
+
+Every call reserves capacity from two token buckets for its kind of call
+("embed" or "generate"): one counting requests and one counting input tokens,
+each refilled at the per-minute quota. A reservation may put a bucket into
+debt; the caller then sleeps until its turn instead of firing a request that
+would be rejected with a 429 and retried blindly. Waiting callers are therefore
+served roughly in arrival order across every process sharing the backend.
+
+Bucket state lives in a pluggable backend:
+
+- InProcessBackend: one worker process.
+- FileBackend: a JSON file guarded by flock, shared by workers on one host.
+- RedisBackend: any Redis-compatible server (redis-py client or the in-process
+  FakeRedis), shared by every replica.
+"""
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+
+try:
+    import redis
+except ImportError:  # Optional; only needed for the "redis" backend
+    redis = None
+
+
+class QuotaWaitTooLong(Exception):
+    """Raised when a reservation would have to wait longer than the caller allows."""
+
+
+def _reserve(state, amount: float, rate_per_s: float, capacity: float, now: float, max_wait):
+    """
+    Pure token-bucket step. `state` is (tokens, updated_at) or None for a full bucket.
+    Returns (new_state, wait_seconds); wait_seconds is None if the reservation was refused.
+    """
+    tokens, updated_at = state if state else (capacity, now)
+    tokens = min(capacity, tokens + (now - updated_at) * rate_per_s)
+    remaining = tokens - amount
+    wait = max(0.0, -remaining / rate_per_s) if rate_per_s > 0 else 0.0
+    if max_wait is not None and wait > max_wait:
+        return (tokens, now), None
+    return (remaining, now), wait
+
+
+class InProcessBackend:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def reserve(self, key: str, amount: float, rate_per_s: float, capacity: float, max_wait=None):
+        with self._lock:
+            self._buckets[key], wait = _reserve(
+                self._buckets.get(key), amount, rate_per_s, capacity, time.time(), max_wait
+            )
+        return wait
+
+
+class FileBackend:
+    """Bucket state in a small JSON file, updated under an exclusive flock."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()  # flock is per-process; serialise our own threads too
+        with open(self.path, "a"):
+            pass
+
+    def reserve(self, key: str, amount: float, rate_per_s: float, capacity: float, max_wait=None):
+        with self._lock, open(self.path, "r+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                raw = f.read()
+                buckets = json.loads(raw) if raw.strip() else {}
+                state, wait = _reserve(buckets.get(key), amount, rate_per_s, capacity, time.time(), max_wait)
+                buckets[key] = list(state)
+                f.seek(0)
+                f.truncate()
+                json.dump(buckets, f)
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        return wait
+
+
+class RedisBackend:
+    """
+    Bucket state in a Redis-compatible store. Uses only GET/SET (with NX/PX) and
+    DEL, guarded by a short-lived lock key, so it works against any server or
+    client speaking that subset, including FakeRedis.
+    """
+
+    def __init__(self, client, prefix: str = "vedcool:ratelimit:", lock_timeout_ms: int = 2000):
+        self.client = client
+        self.prefix = prefix
+        self.lock_timeout_ms = lock_timeout_ms
+
+    def reserve(self, key: str, amount: float, rate_per_s: float, capacity: float, max_wait=None):
+        state_key = f"{self.prefix}{key}"
+        lock_key = f"{state_key}:lock"
+        token = f"{os.getpid()}:{threading.get_ident()}:{time.time()}"
+        while not self.client.set(lock_key, token, nx=True, px=self.lock_timeout_ms):
+            time.sleep(0.001)
+        try:
+            raw = self.client.get(state_key)
+            state = json.loads(raw) if raw else None
+            state, wait = _reserve(state, amount, rate_per_s, capacity, time.time(), max_wait)
+            self.client.set(state_key, json.dumps(list(state)))
+        finally:
+            if self.client.get(lock_key) in (token, token.encode("utf-8")):
+                self.client.delete(lock_key)
+        return wait
+
+
+class FakeRedis:
+    """In-process stand-in for a Redis client, implementing the GET/SET/DEL subset used here."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = {}
+
+    def _alive(self, key):
+        value, expires_at = self._data.get(key, (None, None))
+        if expires_at is not None and time.time() >= expires_at:
+            self._data.pop(key, None)
+            return None
+        return value
+
+    def get(self, key):
+        with self._lock:
+            return self._alive(key)
+
+    def set(self, key, value, nx: bool = False, px: int = None, ex: int = None):
+        with self._lock:
+            if nx and self._alive(key) is not None:
+                return None
+            ttl = px / 1000.0 if px is not None else ex
+            self._data[key] = (value, time.time() + ttl if ttl is not None else None)
+            return True
+
+    def delete(self, *keys):
+        with self._lock:
+            return sum(1 for key in keys if self._data.pop(key, None) is not None)
+
+
+class RateScheduler:
+    """
+    `quotas` maps a call kind to its per-minute limits, e.g.
+    {"embed": {"requests_per_minute": 1500, "tokens_per_minute": 1_000_000}}.
+    A limit of 0/None leaves that dimension unlimited.
+    """
+
+    def __init__(self, backend, quotas: dict, burst_seconds: float = 1.0):
+        self.backend = backend
+        self.quotas = quotas
+        self.burst_seconds = burst_seconds
+        self._stats_lock = threading.Lock()
+        self.stats = {kind: {"calls": 0, "waited": 0, "wait_seconds": 0.0} for kind in quotas}
+
+    def _limits(self, kind: str):
+        quota = self.quotas.get(kind, {})
+        for dimension in ("requests", "tokens"):
+            per_minute = quota.get(f"{dimension}_per_minute")
+            if per_minute:
+                rate = per_minute / 60.0
+                # Allow at most a short burst so many replicas starting at once can't exceed the quota
+                yield dimension, rate, max(1.0, rate * self.burst_seconds)
+
+    def acquire(self, kind: str, tokens: int = 0, max_wait: float = None) -> float:
+        """
+        Blocks until a `kind` call costing `tokens` input tokens may be sent.
+        Returns the seconds waited; raises QuotaWaitTooLong if that would exceed `max_wait`,
+        in which case nothing stays reserved. The wait sleeps the calling thread, so callers
+        must not be on the event loop (the API's /ask and /chat run on the thread pool).
+        """
+        wait = 0.0
+        held = []  # Reservations to give back if a later dimension refuses
+        for dimension, rate, capacity in self._limits(kind):
+            amount = 1 if dimension == "requests" else tokens
+            if amount <= 0:
+                continue
+            # A single call larger than the burst capacity is admitted once the bucket is full
+            amount = min(amount, capacity)
+            reserved = self.backend.reserve(f"{kind}:{dimension}", amount, rate, capacity, max_wait)
+            if reserved is None:
+                for key, held_amount, held_rate, held_capacity in held:
+                    # A negative reservation puts the tokens back
+                    self.backend.reserve(key, -held_amount, held_rate, held_capacity)
+                raise QuotaWaitTooLong(f"{kind} {dimension} quota would need more than {max_wait:.2f}s of waiting")
+            held.append((f"{kind}:{dimension}", amount, rate, capacity))
+            wait = max(wait, reserved)
+
+        if wait > 0:
+            logging.debug(f"Rate scheduler: waiting {wait:.3f}s for {kind} quota")
+            time.sleep(wait)
+        with self._stats_lock:
+            stats = self.stats.setdefault(kind, {"calls": 0, "waited": 0, "wait_seconds": 0.0})
+            stats["calls"] += 1
+            stats["waited"] += 1 if wait > 0 else 0
+            stats["wait_seconds"] += wait
+        return wait
+
+    def report_quota_exceeded(self, kind: str, backoff_seconds: float = 5.0):
+        """After a provider 429, push every sharer of the bucket back by `backoff_seconds`."""
+        for dimension, rate, capacity in self._limits(kind):
+            if dimension == "requests":
+                self.backend.reserve(f"{kind}:{dimension}", rate * backoff_seconds, rate, capacity)
+        logging.warning(f"Provider quota exceeded for {kind}; backing off all workers for {backoff_seconds:.1f}s")
+
+
+def build_backend(kind: str, file_path: str = None, redis_url: str = None):
+    if kind == "memory":
+        return InProcessBackend()
+    if kind == "file":
+        return FileBackend(file_path)
+    if kind == "redis":
+        if redis is None:
+            raise RuntimeError("The 'redis' rate-limit backend requires the redis package (pip install redis).")
+        return RedisBackend(redis.Redis.from_url(redis_url))
+    if kind == "fake-redis":
+        return RedisBackend(FakeRedis())
+    raise ValueError(f"Unknown rate-limit backend '{kind}'")
@@ -0,0 +1,85 @@
+"""
+Client for the standalone retrieval service (see retrieval_service.py).
+
+The index may be split into shards, each served by one or more replicas. A
+search is scattered to every shard in parallel, one replica each (round-robin,
+failing over to the next replica on errors), and the per-shard top-k lists are
+merged into the global top-k. Every shard must answer: a partial result would
+silently drop sections, so a shard with no healthy replica fails the search and
+the caller falls back to searching locally.
+"""
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+
+class RetrievalServiceError(Exception):
+    pass
+
+
+class RetrievalClient:
+    def __init__(self, shards: list, timeout: float = 1.0):
+        if not shards or not all(shards):
+            raise ValueError("Every retrieval shard needs at least one replica URL.")
+        self.shards = [[url.rstrip("/") for url in replicas] for replicas in shards]
+        self.timeout = timeout
+        self._turns = [itertools.count() for _ in self.shards]  # Round-robin position per shard
+        self._http = httpx.Client(timeout=timeout)
+        self._pool = ThreadPoolExecutor(max_workers=max(2, 2 * len(self.shards)), thread_name_prefix="retrieval")
+        self._lock = threading.Lock()
+        self._stats = {"searches": 0, "errors": 0, "replica_failovers": 0, "seconds": 0.0}
+
+    def _search_shard(self, shard: int, payload: dict, timeout: float) -> list:
+        replicas = self.shards[shard]
+        first = next(self._turns[shard])
+        last_error = None
+        for attempt in range(len(replicas)):
+            url = replicas[(first + attempt) % len(replicas)]
+            try:
+                response = self._http.post(f"{url}/search", json=payload, timeout=timeout)
+                response.raise_for_status()
+                return response.json()["results"]
+            except (httpx.HTTPError, ValueError, KeyError) as e:
+                last_error = e
+                with self._lock:
+                    self._stats["replica_failovers"] += 1
+        raise RetrievalServiceError(f"No replica of shard {shard} answered: {last_error}")
+
+    def search(self, embedding, top_n: int, scope: str = None, timeout: float = None) -> list:
+        """
+        Global top `top_n` results, best first: dicts with section_id, heading,
+        content_hash and similarity. Raises RetrievalServiceError if a shard is unreachable.
+        """
+        started = time.perf_counter()
+        payload = {"embedding": [float(x) for x in embedding], "top_n": top_n, "scope": scope}
+        futures = [
+            self._pool.submit(self._search_shard, shard, payload, timeout or self.timeout)
+            for shard in range(len(self.shards))
+        ]
+        try:
+            results = [result for future in futures for result in future.result()]
+        except RetrievalServiceError:
+            with self._lock:
+                self._stats["errors"] += 1
+            raise
+        finally:
+            with self._lock:
+                self._stats["searches"] += 1
+                self._stats["seconds"] += time.perf_counter() - started
+        return heapq.nlargest(top_n, results, key=lambda result: result["similarity"])
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["shards"] = len(self.shards)
+        stats["replicas"] = [len(replicas) for replicas in self.shards]
+        stats["mean_seconds"] = stats["seconds"] / stats["searches"] if stats["searches"] else 0.0
+        return stats
+
+    def close(self):
+        self._pool.shutdown(wait=False)
+        self._http.close()
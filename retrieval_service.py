@@ -0,0 +1,229 @@
+"""
+Standalone retrieval service: vector search over one shard of the section index.
+
+Retrieval is CPU work and generation is slow network I/O, so the answer API
+(main.py) can hand the vector scan to separate processes that scale on their
+own. Each process loads the same artifacts as the API (the manual and its
+embeddings cache), keeps every n-th section for its shard and answers
+POST /search with its local top-k. Run one process per shard replica:
+
+    python retrieval_service.py serve --shard 0 --shards 2 --port 8101
+    python retrieval_service.py serve --shard 0 --shards 2 --port 8102
+    python retrieval_service.py serve --shard 1 --shards 2 --port 8111
+
+and list the replica URLs per shard in chatbot.RETRIEVAL_SERVICE_SHARDS; the
+answer API scatters each search to all shards and merges the results.
+
+`python retrieval_service.py check --shards 2 --replicas 2` starts such a
+cluster as local processes with the fake Gemini provider, compares its merged
+results with a search of the whole index, then stops one replica per shard to
+exercise failover.
+"""
+import argparse
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List, Optional
+
+from fastapi import FastAPI, HTTPException
+from pydantic import BaseModel
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+app = FastAPI(title="VedCool Retrieval Service", version="1.0.0")
+shard_index = None  # SectionIndex of this process's shard, set by load_shard
+
+
+class SearchRequest(BaseModel):
+    embedding: List[float]
+    top_n: int = 3
+    # Section-tree node to search within, e.g. "BRANCH ADMIN > SETTINGS"
+    scope: Optional[str] = None
+
+
+class SearchResult(BaseModel):
+    section_id: str
+    heading: str
+    content_hash: str
+    similarity: float
+
+
+class SearchResponse(BaseModel):
+    shard: List[int]
+    results: List[SearchResult]
+
+
+def load_shard(shard: int, shards: int, cache_file: str):
+    """Parses the manual, loads its embeddings and builds this shard's index."""
+    global shard_index
+    import chatbot
+
+    parsed_manual_sections, outline = chatbot.parse_manual(chatbot.manual_text, with_outline=True)
+    if not parsed_manual_sections:
+        raise RuntimeError("No sections were parsed from the manual.")
+    section_data = chatbot.load_section_data(parsed_manual_sections, cache_file)
+    shard_index = chatbot.build_section_index(section_data, cache_file, shard=(shard, shards), outline=outline)
+    logging.info(f"Retrieval shard {shard}/{shards} ready with {len(shard_index)} sections")
+
+
+@app.get("/healthz")
+async def health():
+    if shard_index is None:
+        raise HTTPException(status_code=503, detail="Shard index is not loaded yet.")
+    return {"status": "ready", "shard": list(shard_index.shard), "sections": len(shard_index),
+            "manual_version": shard_index.manual_version}
+
+
+@app.post("/search", response_model=SearchResponse)
+def search(data: SearchRequest):
+    """This shard's top `top_n` sections for a question embedding."""
+    import chatbot
+
+    if shard_index is None:
+        raise HTTPException(status_code=503, detail="Shard index is not loaded yet.")
+    try:
+        # A scope whose sections all live on other shards simply has no results here
+        scope = chatbot.resolve_scope(shard_index, data.scope)
+    except ValueError:
+        return SearchResponse(shard=list(shard_index.shard), results=[])
+    try:
+        rows = chatbot.search_scope_rows(shard_index, data.embedding, scope)
+        scored_rows = shard_index.search_rows(data.embedding, top_n=max(0, min(data.top_n, 100)), rows=rows)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return SearchResponse(
+        shard=list(shard_index.shard),
+        results=[
+            SearchResult(
+                section_id=shard_index.section_ids[row],
+                heading=shard_index.headings[row],
+                content_hash=shard_index.content_hashes[row],
+                similarity=score,
+            )
+            for score, row in scored_rows
+        ],
+    )
+
+
+# --- Local Cluster Check ---
+def install_fake_provider():
+    os.environ.setdefault("GEMINI_API_KEY", "fake-key-for-local-testing")
+    import fake_genai
+    fake_genai.install()
+
+
+def wait_for_replicas(urls: list, timeout: float = 120.0):
+    import httpx
+
+    deadline = time.monotonic() + timeout
+    pending = list(urls)
+    while pending:
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"Replicas did not become ready: {pending}")
+        url = pending[0]
+        try:
+            if httpx.get(f"{url}/healthz", timeout=1.0).status_code == 200:
+                pending.pop(0)
+                continue
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+
+
+def check_cluster(args):
+    """Starts shards x replicas local processes and checks merged results against a full-index search."""
+    install_fake_provider()
+    import numpy as np
+    import chatbot
+    from retrieval_client import RetrievalClient
+
+    cache_file = os.path.join(tempfile.mkdtemp(prefix="vedcool-retrieval-"), "embeddings.pkl")
+    parsed_manual_sections, outline = chatbot.parse_manual(chatbot.manual_text, with_outline=True)
+    section_data = chatbot.load_section_data(parsed_manual_sections, cache_file)  # Written once, shared by all replicas
+    full_index = chatbot.build_section_index(section_data, cache_file, outline=outline)
+
+    shards, processes = [], []
+    for shard in range(args.shards):
+        replicas = []
+        for replica in range(args.replicas):
+            port = args.base_port + 10 * shard + replica
+            processes.append(subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__), "serve", "--fake", "--cache-file", cache_file,
+                 "--shard", str(shard), "--shards", str(args.shards), "--port", str(port)],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            ))
+            replicas.append(f"http://127.0.0.1:{port}")
+        shards.append(replicas)
+
+    client = RetrievalClient(shards, timeout=2.0)
+    try:
+        wait_for_replicas([url for replicas in shards for url in replicas])
+        rng = np.random.default_rng(0)
+        queries = [full_index.vector(i) for i in range(len(full_index))]
+        queries += [rng.standard_normal(full_index.dimension) for _ in range(args.random_queries)]
+
+        def agreement(sample):
+            matches, started = 0, time.perf_counter()
+            for query in sample:
+                expected = [full_index.section_ids[row] for _, row in full_index.search_rows(query, args.top_n)]
+                merged = [result["section_id"] for result in client.search(query, args.top_n)]
+                matches += expected == merged
+            return matches / len(sample), (time.perf_counter() - started) / len(sample)
+
+        rate, seconds = agreement(queries)
+        print(f"{args.shards} shard(s) x {args.replicas} replica(s): top-{args.top_n} identical to the full index "
+              f"for {rate:.1%} of {len(queries)} queries, {seconds * 1000:.1f} ms per scatter-gather search")
+        if args.replicas > 1:
+            for shard in range(args.shards):
+                processes[shard * args.replicas].terminate()
+            rate, seconds = agreement(queries[:20])
+            print(f"With one replica per shard stopped: {rate:.1%} identical, {client.stats()['replica_failovers']} failover(s)")
+    finally:
+        client.close()
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+
+# --- CLI ---
+def build_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="VedCool retrieval service")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    serve = sub.add_parser("serve", help="Serve one shard of the section index")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8101)
+    serve.add_argument("--shard", type=int, default=0)
+    serve.add_argument("--shards", type=int, default=1)
+    serve.add_argument("--cache-file", help="Embeddings cache (defaults to chatbot.EMBEDDINGS_CACHE_FILE)")
+    serve.add_argument("--fake", action="store_true", help="Use the fake Gemini provider (local testing)")
+
+    check = sub.add_parser("check", help="Start a local cluster and compare it with a full-index search")
+    check.add_argument("--shards", type=int, default=2)
+    check.add_argument("--replicas", type=int, default=2)
+    check.add_argument("--base-port", type=int, default=8101)
+    check.add_argument("--top-n", type=int, default=3)
+    check.add_argument("--random-queries", type=int, default=50)
+    return parser
+
+
+if __name__ == "__main__":
+    args = build_arg_parser().parse_args()
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    if args.command == "serve":
+        if not 0 <= args.shard < args.shards:
+            raise SystemExit("--shard must be between 0 and --shards - 1")
+        if args.fake:
+            install_fake_provider()
+        import chatbot
+        import uvicorn
+
+        load_shard(args.shard, args.shards, args.cache_file or chatbot.EMBEDDINGS_CACHE_FILE)
+        uvicorn.run(app, host=args.host, port=args.port)
+    else:
+        check_cluster(args)
@@ -0,0 +1,156 @@
+"""
+Section hierarchy recovered from the manual's table of contents.
+
+The TOC is flat text, but its casing carries the structure: a role heading
+("BRANCH ADMIN") contains everything after it, other all-caps headings
+("ADMISSION", "SETTINGS") are modules, and title-case headings ("Create
+Admission") are the pages of the module above them. All-caps headings before the
+first role ("INTRODUCTION") are top-level chapters of their own.
+
+Each indexed section gets a path such as ("BRANCH ADMIN", "SETTINGS", "Role
+Permission"). `SectionTree` maps every path prefix to the rows beneath it, so a
+scope like "settings" or "Branch Admin > Settings" restricts search to a subtree,
+and keeps a centroid vector per internal node for coarse-to-fine search: the
+first level with more than a handful of nodes is scored first, and only the
+subtrees of the best nodes are searched section by section.
+"""
+import re
+
+import numpy as np
+
+_WORD_PATTERN = re.compile(r"[a-z0-9]+")
+_SCOPE_SEPARATOR = re.compile(r"\s*>\s*")
+
+
+def _normalize(text: str) -> str:
+    return " ".join(_WORD_PATTERN.findall(text.lower()))
+
+
+def _is_upper_heading(heading: str) -> bool:
+    letters = [c for c in heading if c.isalpha()]
+    return bool(letters) and all(c.isupper() for c in letters)
+
+
+def outline_levels(toc_headings: list, role_pattern: str) -> list:
+    """(heading, depth) for each TOC heading: 1 for roles and chapters, 2 for modules, one deeper for pages."""
+    role = re.compile(role_pattern)
+    outline, in_role, container_depth = [], False, 0
+    for heading in toc_headings:
+        if _is_upper_heading(heading):
+            if role.search(heading):
+                in_role, depth = True, 1
+            else:
+                depth = 2 if in_role else 1
+            container_depth = depth
+        else:
+            depth = container_depth + 1
+        outline.append((heading, depth))
+    return outline
+
+
+def section_paths(headings: list, outline: list) -> list:
+    """
+    The path of each section heading, found by walking the outline in order (sections
+    are parsed in TOC order). Headings missing from the outline get a one-element path.
+    """
+    paths, stack, position = [], [], 0
+    for heading in headings:
+        walked = list(stack)
+        for i in range(position, len(outline)):
+            entry, depth = outline[i]
+            del walked[depth - 1:]
+            walked.append(entry)
+            if entry == heading:
+                position, stack = i + 1, walked
+                paths.append(tuple(stack))
+                break
+        else:
+            paths.append((heading,))
+    return paths
+
+
+class SectionTree:
+    def __init__(self, paths: list, vectors: np.ndarray = None):
+        self.paths = [tuple(path) for path in paths]
+        self._rows = {(): list(range(len(self.paths)))}  # Path prefix -> rows in its subtree
+        for row, path in enumerate(self.paths):
+            for depth in range(1, len(path) + 1):
+                self._rows.setdefault(path[:depth], []).append(row)
+        self._rows = {prefix: np.array(rows, dtype=np.int64) for prefix, rows in self._rows.items()}
+        # Internal nodes (with sections beneath them besides their own) are the coarse search units
+        self._internal = {prefix for row_path in self.paths for prefix in
+                          (row_path[:depth] for depth in range(1, len(row_path)))}
+        self._names = {}  # Normalised node name -> prefixes ending with it
+        for prefix in self._rows:
+            if prefix:
+                self._names.setdefault(_normalize(prefix[-1]), []).append(prefix)
+        self._centroids = {}
+        if vectors is not None and len(vectors):
+            for prefix in self._internal:
+                centroid = np.asarray(vectors[self._rows[prefix]], dtype=np.float32).mean(axis=0)
+                norm = np.linalg.norm(centroid)
+                self._centroids[prefix] = centroid / norm if norm > 0 else centroid
+
+    def __len__(self):
+        return len(self.paths)
+
+    # --- Scopes ---
+    def find(self, scope: str):
+        """
+        The node a scope names, or None. Scopes are node names ("settings", "branch admin")
+        or paths ("Branch Admin > Settings"), matched case-insensitively; an ambiguous name
+        resolves to the shallowest node.
+        """
+        parts = [_normalize(part) for part in _SCOPE_SEPARATOR.split(scope.strip()) if _normalize(part)]
+        if not parts:
+            return None
+        matches = [
+            prefix for prefix in self._names.get(parts[-1], [])
+            if len(prefix) >= len(parts) and [_normalize(p) for p in prefix[-len(parts):]] == parts
+        ]
+        return min(matches, key=len) if matches else None
+
+    def rows(self, prefix: tuple) -> np.ndarray:
+        return self._rows.get(tuple(prefix), np.array([], dtype=np.int64))
+
+    def scopes(self, max_depth: int = 2) -> list:
+        """Names usable as a scope, down to `max_depth` (roles and modules by default)."""
+        return [" > ".join(prefix) for prefix in sorted(self._internal, key=lambda p: [self._rows[p][0], len(p)])
+                if len(prefix) <= max_depth]
+
+    # --- Coarse-to-fine search ---
+    def coarse_level(self, prefix: tuple, min_nodes: int) -> list:
+        """The shallowest internal nodes under `prefix` that number more than `min_nodes` (else [])."""
+        depth = len(prefix) + 1
+        while True:
+            nodes = [node for node in self._internal if len(node) == depth and node[:len(prefix)] == prefix]
+            if not nodes:
+                return []
+            if len(nodes) > min_nodes:
+                return sorted(nodes, key=lambda node: self._rows[node][0])
+            depth += 1
+
+    def coarse_rows(self, query: np.ndarray, prefix: tuple = (), top_nodes: int = 4) -> np.ndarray:
+        """
+        Rows to search for a (unit-length, full-dimension) query: the subtrees of the
+        `top_nodes` nodes whose centroids score best, plus the sections under `prefix`
+        that sit above that level. All rows under `prefix` if there is no level to prune.
+        """
+        nodes = self.coarse_level(tuple(prefix), top_nodes)
+        scope_rows = self.rows(prefix)
+        if not nodes or not self._centroids:
+            return scope_rows
+        scores = np.vstack([self._centroids[node] for node in nodes]) @ query
+        kept = [nodes[i] for i in np.argsort(-scores, kind="stable")[:top_nodes]]
+        covered = np.concatenate([self._rows[node] for node in nodes])
+        above_level = np.setdiff1d(scope_rows, covered, assume_unique=True)
+        return np.unique(np.concatenate([above_level] + [self._rows[node] for node in kept]))
+
+    def describe(self) -> dict:
+        return {
+            "sections": len(self.paths),
+            "nodes": len(self._rows) - 1,
+            "internal_nodes": len(self._internal),
+            "max_depth": max((len(path) for path in self.paths), default=0),
+            "scopes": self.scopes(),
+        }
@@ -0,0 +1,141 @@
+"""
+Non-blocking, structured logging for the request path.
+
+`install_queue_logging` puts a bounded queue in front of the root logger's
+handlers: request threads only enqueue the record and a listener thread does
+the formatting and the (blocking) handler I/O. When the queue is full, records
+are dropped and counted instead of stalling a request.
+
+`log_event` logs a message plus key=value fields. Nothing is formatted when
+the level is disabled, and formatting of enabled records happens on the
+listener thread; field values may be callables, evaluated only then. Lines
+marked `detail=True` (similarities, chosen sections, ...) are only emitted for
+the share of requests picked by `begin_request`'s sample rate, so they can stay
+on in production without costing every request.
+"""
+import atexit
+import contextvars
+import itertools
+import json
+import logging
+import logging.handlers
+import queue
+import random
+
+_request_context = contextvars.ContextVar("request_log_context", default=None)
+_request_ids = itertools.count(1)
+_queue_handler = None
+
+
+def _field_value(value):
+    return value() if callable(value) else value
+
+
+class StructuredMessage:
+    """A log message whose text is only built when a handler formats the record."""
+
+    __slots__ = ("template", "args", "fields")
+
+    def __init__(self, template: str, args: tuple, fields: dict):
+        self.template = template
+        self.args = args
+        self.fields = fields
+
+    def text(self) -> str:
+        return self.template % self.args if self.args else self.template
+
+    def field_values(self) -> dict:
+        return {key: _field_value(value) for key, value in self.fields.items()}
+
+    def __str__(self):
+        text = self.text()
+        if self.fields:
+            pairs = " ".join(
+                f"{key}={json.dumps(value, default=str, ensure_ascii=False)}"
+                for key, value in self.field_values().items()
+            )
+            text = f"{text} | {pairs}"
+        return text
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, message and the structured fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {"time": self.formatTime(record), "level": record.levelname}
+        if isinstance(record.msg, StructuredMessage):
+            entry["message"] = record.msg.text()
+            entry.update(record.msg.field_values())
+        else:
+            entry["message"] = record.getMessage()
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The queue never leaves the process, so the record can be handed over as is;
+        # formatting (the expensive part) is left to the listener thread.
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def install_queue_logging(max_queue_size: int = 10000, json_format: bool = False):
+    """Moves the root logger's current handlers behind a queue. Safe to call more than once."""
+    global _queue_handler
+    root = logging.getLogger()
+    if _queue_handler is not None and _queue_handler in root.handlers:
+        return _queue_handler
+    handlers = list(root.handlers) or [logging.StreamHandler()]
+    if json_format:
+        for handler in handlers:
+            handler.setFormatter(JsonFormatter())
+
+    log_queue = queue.Queue(max_queue_size)
+    _queue_handler = NonBlockingQueueHandler(log_queue)
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    root.handlers = [_queue_handler]
+    listener.start()
+    atexit.register(listener.stop)  # Flushes whatever is still queued
+    return _queue_handler
+
+
+def begin_request(detail_sample_rate: float = 1.0) -> int:
+    """Starts the log context of one request: a request id and whether its detail lines are kept."""
+    request_id = next(_request_ids)
+    _request_context.set((request_id, random.random() < detail_sample_rate))
+    return request_id
+
+
+def log_event(level: int, template: str, *args, detail: bool = False, logger: logging.Logger = None, **fields):
+    """
+    Logs `template % args` with `fields` appended, tagged with the current request id.
+    Detail lines are skipped unless the current request was sampled; outside a request
+    (CLI, warm-up) they are always kept.
+    """
+    logger = logger or logging.getLogger()
+    if not logger.isEnabledFor(level):
+        return
+    context = _request_context.get()
+    if context is not None:
+        request_id, sampled = context
+        if detail and not sampled:
+            return
+        fields["request_id"] = request_id
+    logger.log(level, StructuredMessage(template, args, fields))
+
+
+def stats() -> dict:
+    if _queue_handler is None:
+        return {"queue": False}
+    return {"queue": True, "queued": _queue_handler.queue.qsize(), "dropped": _queue_handler.dropped}
@@ -0,0 +1,157 @@
+"""
+Typeahead suggestions for the chat box.
+
+Suggestions come from two sources: the TOC headings of the manual and popular
+past questions. Both live in one sorted array of (word-suffix, entry id) keys,
+so a prefix lookup is a binary search plus a short scan and "change pass" finds
+"Update Profile & Change Password". Nothing remote is called.
+
+Questions arrive incrementally. `record_question` counts every asked question
+in a bounded table. A question becomes a suggestion once it has been asked
+`min_count` times, and the suggestions are capped at `max_questions`, evicting
+the least asked one. Inserting or removing an entry only touches that entry's
+keys in the sorted array.
+"""
+import bisect
+import heapq
+import re
+import sys
+import threading
+import time
+
+_WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(_WORD_PATTERN.findall(text.lower()))
+
+
+class SuggestIndex:
+    def __init__(self, max_questions: int = 2000, min_count: int = 2, max_tracked: int = 20000,
+                 heading_weight: float = 3.0, min_query_chars: int = 2, max_scan: int = 1000):
+        if max_tracked <= max_questions:
+            # Suggestions are never forgotten, so room is only ever made among the other tracked questions
+            raise ValueError(f"max_tracked ({max_tracked}) must be larger than max_questions ({max_questions}).")
+        self.max_questions = max_questions
+        self.min_count = min_count
+        self.max_tracked = max_tracked
+        self.heading_weight = heading_weight
+        self.min_query_chars = min_query_chars
+        self.max_scan = max_scan
+        self._lock = threading.Lock()
+        self._keys = []  # Sorted (word-suffix, entry id)
+        self._entries = {}  # entry id -> (text, kind, normalised text)
+        self._ids_by_text = {}  # normalised text -> entry id
+        self._next_id = 0
+        self._counts = {}  # normalised question -> [count, first spelling]
+        self._question_ids = set()
+        self._stats = {"lookups": 0, "lookup_seconds": 0.0, "max_lookup_seconds": 0.0, "evicted_questions": 0}
+
+    # --- Updates ---
+    def _add(self, text: str, kind: str, key: str) -> int:
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entries[entry_id] = (text, kind, key)
+        self._ids_by_text[key] = entry_id
+        words = key.split()
+        for i in range(len(words)):
+            bisect.insort(self._keys, (" ".join(words[i:]), entry_id))
+        return entry_id
+
+    def _remove(self, entry_id: int):
+        _, _, key = self._entries.pop(entry_id)
+        del self._ids_by_text[key]
+        words = key.split()
+        for i in range(len(words)):
+            position = bisect.bisect_left(self._keys, (" ".join(words[i:]), entry_id))
+            del self._keys[position]
+
+    def add_headings(self, headings: list):
+        with self._lock:
+            for heading in headings:
+                key = normalize_text(heading)
+                if key and key not in self._ids_by_text:
+                    self._add(heading, "heading", key)
+
+    def record_question(self, question: str, count: int = 1):
+        """Counts `count` askings of `question`; promotes it to a suggestion once it is popular enough."""
+        key = normalize_text(question)
+        if not key:
+            return
+        with self._lock:
+            entry = self._counts.get(key)
+            if entry is None:
+                while len(self._counts) >= self.max_tracked:
+                    self._forget_rare_questions()
+                entry = self._counts[key] = [0, question.strip()]
+            entry[0] += count
+            if entry[0] >= self.min_count and key not in self._ids_by_text:
+                self._promote(key, entry)
+
+    def _promote(self, key: str, entry: list):
+        if len(self._question_ids) >= self.max_questions:
+            least_id = min(self._question_ids, key=lambda i: self._counts[self._entries[i][2]][0])
+            if self._counts[self._entries[least_id][2]][0] >= entry[0]:
+                return
+            self._question_ids.discard(least_id)
+            self._remove(least_id)
+            self._stats["evicted_questions"] += 1
+        self._question_ids.add(self._add(entry[1], "question", key))
+
+    def _forget_rare_questions(self):
+        """Halves the tracked counts and drops those falling to zero (unless they are suggestions)."""
+        for key in list(self._counts):
+            self._counts[key][0] //= 2
+            if self._counts[key][0] == 0 and self._ids_by_text.get(key) not in self._question_ids:
+                del self._counts[key]
+
+    # --- Lookup ---
+    def suggest(self, prefix: str, limit: int = 8) -> list:
+        """Up to `limit` suggestions for typed text: whole-text prefix matches first, then by popularity."""
+        started = time.perf_counter()
+        query = normalize_text(prefix)
+        results = []
+        if len(query) >= self.min_query_chars and limit > 0:
+            with self._lock:
+                start = bisect.bisect_left(self._keys, (query, -1))
+                entries, counts, matches = self._entries, self._counts, {}
+                for suffix, entry_id in self._keys[start:start + self.max_scan]:
+                    if not suffix.startswith(query):
+                        break
+                    _, kind, key = entries[entry_id]
+                    weight = self.heading_weight if kind == "heading" else counts[key][0]
+                    matches[entry_id] = (key.startswith(query), weight)
+                best = heapq.nlargest(limit, matches.items(), key=lambda item: item[1])
+                for entry_id, (_, weight) in best:
+                    text, kind, _ = self._entries[entry_id]
+                    results.append({"text": text, "kind": kind, "count": weight if kind == "question" else None})
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self._stats["lookups"] += 1
+            self._stats["lookup_seconds"] += elapsed
+            self._stats["max_lookup_seconds"] = max(self._stats["max_lookup_seconds"], elapsed)
+        return results
+
+    # --- Introspection ---
+    def nbytes(self) -> int:
+        """Approximate memory of the keys, entries and question counts, object overhead included."""
+        with self._lock:
+            key_bytes = sys.getsizeof(self._keys) + sum(sys.getsizeof(suffix) + 64 for suffix, _ in self._keys)
+            entry_bytes = sum(sys.getsizeof(text) + sys.getsizeof(key) + 64 for text, _, key in self._entries.values())
+            count_bytes = sum(sys.getsizeof(key) + sys.getsizeof(spelling) + 120
+                              for key, (_, spelling) in self._counts.items())
+        return key_bytes + entry_bytes + count_bytes
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update(
+                headings=len(self._entries) - len(self._question_ids),
+                questions=len(self._question_ids),
+                tracked_questions=len(self._counts),
+                keys=len(self._keys),
+            )
+        stats["mean_lookup_ms"] = 1000 * stats["lookup_seconds"] / stats["lookups"] if stats["lookups"] else 0.0
+        stats["max_lookup_ms"] = 1000 * stats.pop("max_lookup_seconds")
+        stats["bytes"] = self.nbytes()
+        return stats
@@ -0,0 +1,36 @@
+"""
+Shared fixtures. chatbot.py refuses to import without GEMINI_API_KEY and talks to
+Gemini through the module-level `genai`, so tests set a dummy key and route every
+call through fake_genai; nothing needs network access.
+"""
+import os
+
+import pytest
+
+os.environ.setdefault("GEMINI_API_KEY", "fake-key-for-tests")
+
+
+@pytest.fixture
+def fake_provider():
+    import fake_genai
+
+    return fake_genai.install()
+
+
+@pytest.fixture
+def fake_redis():
+    from cache_backends import FakeRedisServer
+
+    server = FakeRedisServer().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture(scope="session")
+def section_index(tmp_path_factory):
+    """The real manual, embedded with the fake provider (built once per test run)."""
+    import fake_genai
+    import chatbot
+
+    fake_genai.install()
+    return chatbot.load_section_index(str(tmp_path_factory.mktemp("index") / "embeddings.pkl"))
@@ -0,0 +1,54 @@
+import json
+
+import pytest
+
+from answer_rendering import (
+    NOT_FOUND_HTML, parse_structured_answer, render_sections_as_answer, render_structured_answer, select_steps,
+    split_section_content,
+)
+
+CONTENT = """Role permissions decide which modules a role can open.
+• Navigate to Settings > Role Permission.
+• Select the role.
+o Teachers and accountants are listed separately
+• Tick the modules and click Save.
+12
+"""
+
+
+def test_split_section_content():
+    intro, steps = split_section_content(CONTENT)
+    assert intro == ["Role permissions decide which modules a role can open."]
+    assert steps == [
+        "Navigate to Settings > Role Permission.",
+        "Select the role., Teachers and accountants are listed separately",
+        "Tick the modules and click Save.",
+    ]
+
+
+def test_long_procedures_keep_the_matching_window_and_navigation():
+    steps = ["Navigate to Fees > Reminders."] + [f"Step {i} about reports." for i in range(10)] + [
+        "Choose the reminder schedule.", "Save the schedule."]
+    kept = select_steps("how do I change the reminder schedule", steps, max_steps=3)
+    assert kept == ["Navigate to Fees > Reminders.", "Choose the reminder schedule.", "Save the schedule."]
+
+
+def test_render_sections_as_answer():
+    html = render_sections_as_answer([{"heading": "Role <Permission>", "content": CONTENT}], "role permission")
+    assert html.startswith("<div class='vedcool-answer'>")
+    assert "Role &lt;Permission&gt;" in html
+    assert html.count("<li>") == 3
+
+
+def test_structured_answer_renders_like_html_mode():
+    answer = {"not_found": False, "sections": [{"title": "Role Permission", "intro": "", "steps": ["Open it."]}]}
+    html = render_structured_answer("```json\n" + json.dumps(answer) + "\n```")
+    assert "Role Permission" in html and "<li>Open it.</li>" in html
+    assert render_structured_answer(json.dumps({"not_found": True, "sections": []})) == NOT_FOUND_HTML
+
+
+@pytest.mark.parametrize("text", ["not json", "[]", json.dumps({"sections": [{"title": ""}]}),
+                                  json.dumps({"sections": [{"title": "t", "steps": [1]}]})])
+def test_invalid_structured_answers_are_rejected(text):
+    with pytest.raises(ValueError):
+        parse_structured_answer(text)
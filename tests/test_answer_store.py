@@ -0,0 +1,50 @@
+import pytest
+
+from answer_store import AnswerStore, normalize_question
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = AnswerStore(str(tmp_path / "answers.sqlite3"))
+    yield store
+    store.close()
+
+
+def test_normalize_question():
+    assert normalize_question("  How do I   log in?! ") == "how do i log in"
+
+
+def test_answer_served_while_sources_unchanged(store):
+    store.put("How do I log in?", "<div>login</div>", [("Login", "h1")], "v1")
+    assert store.get("how do i log in", {"Login": "h1", "Other": "h2"}) == "<div>login</div>"
+    assert store.has_valid("How do I log in?", {"Login": "h1"})
+
+
+def test_edited_section_invalidates_only_its_answers(store):
+    store.put("login", "<div>a</div>", [("Login", "h1")])
+    store.put("fees", "<div>b</div>", [("Fees", "h2"), ("Reports", "h3")])
+    store.put("reports", "<div>c</div>", [("Reports", "h3")])
+
+    current = {"Login": "h1", "Fees": "h2", "Reports": "h3-edited"}
+    assert store.invalidate_changed(current) == 2
+    assert store.count() == 1
+    assert store.get("login", current) == "<div>a</div>"
+    assert store.get("fees", current) is None
+
+
+def test_stale_answer_is_dropped_on_read(store):
+    store.put("login", "<div>a</div>", [("Login", "h1")])
+    assert not store.has_valid("login", {})  # Section removed from the manual
+    assert store.count() == 1  # has_valid never deletes
+    assert store.get("login", {}) is None
+    assert store.count() == 0
+
+
+def test_store_survives_reopening(tmp_path):
+    path = str(tmp_path / "answers.sqlite3")
+    first = AnswerStore(path)
+    first.put("login", "<div>a</div>", [("Login", "h1")])
+    first.close()
+    second = AnswerStore(path)  # A restarted worker
+    assert second.get("login", {"Login": "h1"}) == "<div>a</div>"
+    second.close()
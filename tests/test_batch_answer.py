@@ -0,0 +1,57 @@
+import json
+from collections import Counter
+
+from batch_answer import compact_output, run_batch_job
+
+
+def read_records(path) -> list:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_compact_output_keeps_one_answer_per_id(tmp_path):
+    output = tmp_path / "answers.jsonl"
+    output.write_text(
+        json.dumps({"id": "1", "error": "quota"}) + "\n"
+        + json.dumps({"id": "1", "answer": "first"}) + "\n"
+        + json.dumps({"id": "2", "answer": "a"}) + "\n"
+        + json.dumps({"id": "2", "answer": "again"}) + "\n"
+        + json.dumps({"id": "3", "error": "timeout"}) + "\n"
+        + '{"id": "4", "ans',  # Cut off by a crash
+        encoding="utf-8",
+    )
+    assert compact_output(str(output)) == {"1", "2"}
+    assert read_records(output) == [{"id": "1", "answer": "first"}, {"id": "2", "answer": "a"}]
+
+
+def test_compact_output_leaves_a_clean_file_alone(tmp_path):
+    output = tmp_path / "answers.jsonl"
+    output.write_text(json.dumps({"id": "1", "answer": "a"}) + "\n", encoding="utf-8")
+    modified = output.stat().st_mtime_ns
+    assert compact_output(str(output)) == {"1"}
+    assert output.stat().st_mtime_ns == modified
+    assert compact_output(str(tmp_path / "missing.jsonl")) == set()
+
+
+def test_resumed_job_ends_with_one_record_per_id(tmp_path, section_index, fake_provider):
+    questions = tmp_path / "questions.jsonl"
+    questions.write_text("".join(
+        json.dumps({"id": str(i), "question": question}) + "\n"
+        for i, question in enumerate(["How do I add a new student?", "How do I mark attendance?",
+                                      "How do I collect fees?", "How do I log in?"])
+    ), encoding="utf-8")
+    output = tmp_path / "answers.jsonl"
+
+    fake_provider.error_rate = 1.0  # Every call fails: the first run writes only error records
+    first = run_batch_job(str(questions), str(output), section_index, batch_size=2, concurrency=2)
+    assert first["failed"] == 4
+
+    fake_provider.error_rate = 0.0
+    second = run_batch_job(str(questions), str(output), section_index, batch_size=2, concurrency=2)
+    assert (second["skipped_done"], second["answered"], second["failed"]) == (0, 4, 0)
+    third = run_batch_job(str(questions), str(output), section_index, batch_size=2, concurrency=2)
+    assert third["skipped_done"] == 4
+
+    records = read_records(output)
+    assert Counter(record["id"] for record in records) == {str(i): 1 for i in range(4)}
+    assert all("answer" in record for record in records)
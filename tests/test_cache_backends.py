@@ -0,0 +1,81 @@
+import time
+
+import numpy as np
+
+from cache_backends import DiskCache, FakeRedisServer, InProcessCache, RedisCache, RespClient, TieredCache
+
+
+def redis_tier(url: str) -> RedisCache:
+    return RedisCache(RespClient.from_url(url, timeout=0.5))
+
+
+def tier_stats(cache: TieredCache, name: str) -> dict:
+    return next(stats for stats in cache.stats()["tiers"] if stats["tier"] == name)
+
+
+def test_memory_miss_is_filled_from_disk(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    writer = TieredCache([InProcessCache(), DiskCache(path)])
+    writer.set("answer", "v1", "how do i log in", "<div>answer</div>")
+
+    reader = TieredCache([InProcessCache(), DiskCache(path)])  # Another worker on the same host
+    assert reader.get("answer", "v1", "how do i log in") == "<div>answer</div>"
+    assert tier_stats(reader, "memory")["misses"] == 1
+    assert tier_stats(reader, "disk")["hits"] == 1
+
+    assert reader.get("answer", "v1", "how do i log in") == "<div>answer</div>"
+    assert tier_stats(reader, "memory")["hits"] == 1  # Back-filled by the first lookup
+    assert tier_stats(reader, "disk")["hits"] == 1
+
+
+def test_memory_miss_is_filled_from_redis(fake_redis):
+    writer = TieredCache([InProcessCache(), redis_tier(fake_redis.url)])
+    embedding = np.arange(8, dtype=np.float32)
+    writer.set("question_embedding", "model", "how do i log in", embedding)
+
+    reader = TieredCache([InProcessCache(), redis_tier(fake_redis.url)])  # Another replica
+    found = reader.get("question_embedding", "model", "how do i log in")
+    np.testing.assert_array_equal(found, embedding)
+    assert tier_stats(reader, "redis")["hits"] == 1
+
+    reader.get("question_embedding", "model", "how do i log in")
+    assert tier_stats(reader, "memory")["hits"] == 1
+    assert tier_stats(reader, "redis")["hits"] == 1
+
+
+def test_entries_expire_after_ttl(tmp_path, fake_redis):
+    cache = TieredCache(
+        [InProcessCache(), DiskCache(str(tmp_path / "cache.sqlite3")), redis_tier(fake_redis.url)], ttl_seconds=0.1,
+    )
+    cache.set("answer", "v1", "q", "a")
+    assert cache.get("answer", "v1", "q") == "a"
+    time.sleep(0.2)
+    assert cache.get("answer", "v1", "q") is None
+    assert [stats["misses"] for stats in cache.stats()["tiers"]] == [1, 1, 1]
+
+
+def test_redis_error_is_a_miss():
+    server = FakeRedisServer().start()
+    url = server.url
+    server.stop()  # Nothing listens on the port any more
+
+    cache = TieredCache([InProcessCache(), redis_tier(url)])
+    cache.set("answer", "v1", "q", "a")  # The memory tier still takes it
+    assert cache.get("answer", "v1", "q") == "a"
+    assert cache.get("answer", "v1", "other") is None
+    redis_stats = tier_stats(cache, "redis")
+    assert redis_stats["errors"] == 2  # The failed set and the failed get
+    assert redis_stats["hits"] == 0
+
+
+def test_answer_keys_are_separated_by_mode_and_format(fake_redis):
+    import chatbot
+
+    cache = TieredCache([InProcessCache(), redis_tier(fake_redis.url)])
+    cache.set("answer", "v1", chatbot.answer_cache_key("llm", "how do i log in", "html"), "<div>html</div>")
+    cache.set("answer", "v1", chatbot.answer_cache_key("llm", "how do i log in", "json"), "<div>json</div>")
+
+    assert cache.get("answer", "v1", chatbot.answer_cache_key("llm", "how do i log in", "html")) == "<div>html</div>"
+    assert cache.get("answer", "v1", chatbot.answer_cache_key("llm", "how do i log in", "json")) == "<div>json</div>"
+    assert cache.get("answer", "v1", chatbot.answer_cache_key("auto", "how do i log in", "html")) is None
+    assert cache.get("answer", "v2", chatbot.answer_cache_key("llm", "how do i log in", "html")) is None
@@ -0,0 +1,48 @@
+import time
+
+from chat_sessions import SessionStore
+
+
+def test_unknown_id_gets_a_server_issued_session():
+    store = SessionStore()
+    session = store.get_or_create("client-chosen-id")
+    assert session.session_id != "client-chosen-id"
+    assert store.get_or_create(session.session_id) is session
+
+
+def test_idle_sessions_expire():
+    store = SessionStore(ttl_seconds=0.05)
+    session = store.get_or_create()
+    time.sleep(0.1)
+    assert len(store) == 0
+    renewed = store.get_or_create(session.session_id)
+    assert renewed is not session
+    assert renewed.session_id != session.session_id
+
+
+def test_least_recently_used_session_is_evicted():
+    store = SessionStore(max_sessions=2)
+    first, second = store.get_or_create(), store.get_or_create()
+    store.get_or_create(first.session_id)  # first is now the most recently used
+    store.get_or_create()
+    assert len(store) == 2
+    assert store.get_or_create(first.session_id) is first
+    assert store.get_or_create(second.session_id) is not second
+
+
+def test_turn_history_is_bounded():
+    session = SessionStore(max_turns=2).get_or_create()
+    for turn in range(3):
+        session.add_turn(f"q{turn}", f"prompt {turn}", f"answer {turn}", rows=[turn], new_section_ids=[f"s{turn}"])
+    assert [turn["question"] for turn in session.turns] == ["q1", "q2"]
+    assert session.retrieved_rows() == [2, 1]
+    assert session.sent_section_ids() == {"s1", "s2"}
+    assert session.history_contents()[0] == {"role": "user", "parts": ["prompt 1"]}
+    assert session.last_question() == "q2"
+
+
+def test_delete():
+    store = SessionStore()
+    session = store.get_or_create()
+    assert store.delete(session.session_id)
+    assert not store.delete(session.session_id)
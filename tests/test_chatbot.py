@@ -0,0 +1,62 @@
+"""answer_question end to end, against the real manual embedded by the fake provider."""
+import pytest
+
+import chatbot
+from deadline import Deadline
+
+NOT_IN_MANUAL = "What is the weather on Mars tomorrow?"
+
+
+@pytest.fixture(autouse=True)
+def no_answer_cache(monkeypatch):
+    monkeypatch.setattr(chatbot, "CACHE_ANSWERS", False)
+
+
+def test_found_and_not_found_outcomes(section_index):
+    outcome = {}
+    answer = chatbot.answer_question("How do I mark attendance?", section_index, outcome=outcome)
+    assert outcome == {"found": True}
+    assert "vedcool-answer" in answer
+
+    chatbot.answer_question(NOT_IN_MANUAL, section_index, outcome=outcome)
+    assert outcome == {"found": False}
+
+
+def test_generated_answers_are_cached_per_mode(section_index, fake_provider, monkeypatch):
+    monkeypatch.setattr(chatbot, "CACHE_ANSWERS", True)
+    question = "How do I configure the fee reminder schedule?"
+    first = chatbot.answer_question(question, section_index, mode="llm")
+    calls = fake_provider.generate_calls
+    assert chatbot.answer_question(question, section_index, mode="llm") == first
+    assert fake_provider.generate_calls == calls
+    assert chatbot.answer_is_cached(section_index, question, "llm")
+    assert not chatbot.answer_is_cached(section_index, question, "auto")
+
+
+def test_extractive_mode_makes_no_generation_call(section_index, fake_provider):
+    calls = fake_provider.generate_calls
+    answer = chatbot.answer_question("How do I mark attendance?", section_index, mode="extractive")
+    assert "vedcool-answer" in answer
+    assert fake_provider.generate_calls == calls
+
+
+def test_exhausted_deadline_gives_a_clear_reply(section_index):
+    answer = chatbot.answer_question("How can I set up the transport routes?", section_index, deadline=Deadline(0.1))
+    assert "took too long" in answer
+
+
+def test_every_chat_turn_is_recorded(section_index):
+    session = chatbot.chat_sessions.get_or_create()
+    chatbot.answer_question(NOT_IN_MANUAL, section_index, session=session)
+    chatbot.answer_question("How do I mark attendance?", section_index, session=session)
+    heading = section_index.headings[5]
+    # A follow-up naming a heading still gets a degraded answer from that section when out of time
+    answer = chatbot.answer_question(heading, section_index, session=session, deadline=Deadline(0.1))
+    assert "took too long" not in answer
+    assert [turn["question"] for turn in session.turns] == [NOT_IN_MANUAL, "How do I mark attendance?", heading]
+
+
+def test_partial_heading_goes_through_the_threshold(section_index):
+    assert chatbot.heading_candidates(section_index, "change password", 3) == []
+    exact = chatbot.heading_candidates(section_index, section_index.headings[5], 3)
+    assert exact[0]["heading_match"] == "exact" and exact[0]["similarity"] is None
@@ -0,0 +1,27 @@
+from context_selection import select_context_sections
+
+
+def candidates(*scores):
+    return [{"similarity": score, "heading": f"s{i}", "content": "word " * 100} for i, score in enumerate(scores)]
+
+
+def select(items, **kwargs):
+    kwargs = {"threshold": 0.4, "token_budget": 1000, "count_tokens": lambda text: len(text.split()), **kwargs}
+    return [item["heading"] for item in select_context_sections(items, **kwargs)]
+
+
+def test_keeps_close_scores_above_threshold():
+    assert select(candidates(0.80, 0.78, 0.77, 0.35)) == ["s0", "s1", "s2"]
+
+
+def test_cuts_at_a_sharp_drop():
+    assert select(candidates(0.80, 0.79, 0.60, 0.59)) == ["s0", "s1"]
+
+
+def test_respects_the_token_budget_but_keeps_the_best():
+    assert select(candidates(0.80, 0.79, 0.78), token_budget=250) == ["s0", "s1"]
+    assert select(candidates(0.80, 0.79), token_budget=10) == ["s0"]
+
+
+def test_nothing_above_threshold():
+    assert select(candidates(0.30, 0.29)) == []
@@ -0,0 +1,40 @@
+from dedup import CompactTexts, dedup_report, jaccard, near_duplicate_groups, shingles
+
+STEPS = (
+    "Log in as an administrator. Navigate to Settings > Role Permission. Select the role you want to change, "
+    "tick the modules the role may open and click Save to apply the new permissions to every user of that role."
+)
+
+
+def test_near_duplicates_share_a_group():
+    texts = [
+        STEPS,
+        "An unrelated section about collecting fees from parents, printing receipts and exporting reports.",
+        STEPS.replace("click Save", "press Save"),
+        STEPS + " Changes apply at the next login.",
+    ]
+    assert near_duplicate_groups(texts, threshold=0.8) == [0, 1, 0, 0]
+
+
+def test_dissimilar_texts_stay_apart():
+    texts = [STEPS, STEPS.replace("Role Permission", "Fee Reminders").replace("role", "reminder")]
+    assert jaccard(shingles(texts[0]), shingles(texts[1])) < 0.8
+    assert near_duplicate_groups(texts, threshold=0.8) == [0, 1]
+
+
+def test_compact_texts_rebuild_the_exact_originals():
+    texts = ["Navigate to Settings.\nClick Save.", "", "Navigate to Settings.\nClick Cancel.\n", "Click Save."]
+    compact = CompactTexts(texts)
+    assert list(compact) == texts
+    assert compact[-1] == texts[-1]
+    assert compact[1:3] == texts[1:3]
+    assert compact.unique_lines < compact.total_lines
+
+
+def test_dedup_report_counts_repetition():
+    texts = [STEPS, STEPS, "Something else entirely."]
+    groups = near_duplicate_groups(texts)
+    report = dedup_report(["a", "b", "c"], texts, groups, CompactTexts(texts))
+    assert report["near_duplicate_groups"] == 1
+    assert report["groups"] == [["a", "b"]]
+    assert report["most_repeated_lines"][0]["count"] == 2
@@ -0,0 +1,85 @@
+import threading
+import time
+
+import pytest
+
+from deadline import Deadline, DeadlineExceeded
+from embedding_batcher import EmbeddingBatcher
+
+
+class Recorder:
+    def __init__(self, error: Exception = None):
+        self.calls = []
+        self.error = error
+
+    def __call__(self, texts, deadline):
+        self.calls.append((list(texts), deadline))
+        if self.error is not None:
+            raise self.error
+        return [text.upper() for text in texts]
+
+
+def embed_concurrently(batcher, requests: list) -> dict:
+    """Runs batcher.embed for each (text, deadline) on its own thread; returns text -> vector or exception type."""
+    results = {}
+
+    def run(name, text, deadline):
+        try:
+            results[name] = batcher.embed(text, deadline)
+        except Exception as e:
+            results[name] = type(e)
+
+    threads = [threading.Thread(target=run, args=(i, text, deadline)) for i, (text, deadline) in enumerate(requests)]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.002)  # Arrive in order, all within the window
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_concurrent_questions_share_one_call():
+    embed = Recorder()
+    batcher = EmbeddingBatcher(embed, window_seconds=0.1, max_batch=8)
+    results = embed_concurrently(batcher, [("a", None), ("b", None), ("a", None)])
+    assert results == {0: "A", 1: "B", 2: "A"}
+    assert embed.calls == [(["a", "b"], None)]
+    stats = batcher.stats()
+    assert stats["batches"] == 1
+    assert stats["deduplicated"] == 1
+    assert stats["requests_per_question"] == pytest.approx(1 / 3)
+
+
+def test_full_batch_is_sent_without_waiting_out_the_window():
+    embed = Recorder()
+    batcher = EmbeddingBatcher(embed, window_seconds=5.0, max_batch=2)
+    started = time.monotonic()
+    embed_concurrently(batcher, [("a", None), ("b", None)])
+    assert time.monotonic() - started < 1.0
+    assert batcher.stats()["full_batches"] == 1
+
+
+def test_expired_member_fails_alone():
+    embed = Recorder()
+    batcher = EmbeddingBatcher(embed, window_seconds=0.1, max_batch=8, min_seconds=0.5)
+    results = embed_concurrently(batcher, [("late", Deadline(0.2)), ("b", Deadline(5.0)), ("c", Deadline(10.0))])
+    assert results == {0: DeadlineExceeded, 1: "B", 2: "C"}
+    texts, deadline = embed.calls[0]
+    assert texts == ["b", "c"]
+    assert deadline.seconds == 10.0  # The loosest remaining deadline
+    assert batcher.stats()["expired"] == 1
+
+
+def test_failed_call_fails_every_sent_member():
+    batcher = EmbeddingBatcher(Recorder(error=RuntimeError("quota")), window_seconds=0.05)
+    assert embed_concurrently(batcher, [("a", None), ("b", None)]) == {0: RuntimeError, 1: RuntimeError}
+    assert batcher.stats()["errors"] == 1
+
+
+def test_deadline():
+    deadline = Deadline(10.0, started_at=time.monotonic() - 9.8)  # Request arrived 9.8s ago
+    assert deadline.remaining() <= 0.2
+    assert deadline.cap(5.0) <= 0.2
+    with pytest.raises(DeadlineExceeded):
+        deadline.check(0.5, "generation")
+    assert Deadline(0.0).expired()
@@ -0,0 +1,45 @@
+import pytest
+
+from heading_index import HeadingIndex, title_query
+
+HEADINGS = ["Update Profile & Change Password", "Module Permission", "System Update", "Fee Reminders", "Login"]
+
+
+@pytest.fixture
+def index():
+    return HeadingIndex(HEADINGS)
+
+
+def test_title_query_strips_question_phrasing():
+    assert title_query("How do I change password in VedCool?") == "change password"
+
+
+@pytest.mark.parametrize("question, kind, row", [
+    ("Module permission", "exact", 1),
+    ("what is system update?", "exact", 2),
+    ("update profile change passwor", "prefix", 0),
+    ("modul permision", "fuzzy", 1),
+])
+def test_near_exact_matches(index, question, kind, row):
+    found_kind, score, rows = index.match(question)
+    assert (found_kind, rows) == (kind, [row])
+    assert 0.88 <= score <= 1.0
+
+
+@pytest.mark.parametrize("question", [
+    "change password",  # Names only part of a heading: may be about something else
+    "update",  # Prefix of several headings
+    "how do I export the attendance register for last month",  # Too long to be a title
+    "log",  # Too short
+])
+def test_no_confident_match(index, question):
+    assert index.match(question) is None
+
+
+def test_stats_count_lookups(index):
+    index.match("Module permission")
+    index.match("Module permission")
+    index.match("change password")
+    stats = index.stats()
+    assert (stats["lookups"], stats["exact"], stats["misses"]) == (3, 2, 1)
+    assert stats["hit_rate"] == pytest.approx(2 / 3)
@@ -0,0 +1,57 @@
+import threading
+import time
+
+from hedging import HedgeBudget, HedgedCaller, LatencyTracker
+
+
+def test_latency_percentile():
+    tracker = LatencyTracker()
+    assert tracker.percentile(95) is None
+    for ms in range(1, 101):
+        tracker.record(ms / 1000.0)
+    assert tracker.percentile(95) == 0.095
+    assert tracker.percentile(50, min_samples=200) is None
+
+
+def test_budget_limits_hedges():
+    budget = HedgeBudget(ratio=0.5, burst=1.0)
+    budget.earn()
+    assert not budget.try_spend()
+    budget.earn()
+    budget.earn()  # Capped at the burst
+    assert budget.try_spend()
+    assert not budget.try_spend()
+
+
+def slow_first_call(slow_seconds: float):
+    calls = []
+    lock = threading.Lock()
+
+    def fn():
+        with lock:
+            calls.append(1)
+            first = len(calls) == 1
+        time.sleep(slow_seconds if first else 0.0)
+        return "slow" if first else "fast"
+
+    return fn, calls
+
+
+def test_slow_call_is_hedged_and_the_hedge_wins():
+    caller = HedgedCaller(min_samples=1, min_delay_seconds=0.01, max_hedge_ratio=1.0)
+    caller.call(lambda: "warm-up")  # Gives the tracker a latency and the budget one hedge
+    fn, calls = slow_first_call(0.5)
+    started = time.monotonic()
+    assert caller.call(fn) == "fast"
+    assert time.monotonic() - started < 0.4
+    stats = caller.stats()
+    assert (stats["hedges_sent"], stats["hedge_wins"], len(calls)) == (1, 1, 2)
+
+
+def test_hedge_can_be_vetoed():
+    caller = HedgedCaller(min_samples=1, min_delay_seconds=0.01, max_hedge_ratio=1.0)
+    caller.call(lambda: "warm-up")
+    fn, calls = slow_first_call(0.1)
+    assert caller.call(fn, before_hedge=lambda: False) == "slow"
+    assert caller.stats()["budget_denied"] == 1
+    assert len(calls) == 1
@@ -0,0 +1,66 @@
+import pytest
+
+from cache_backends import FakeRedisServer, RespClient
+from rate_limiter import FakeRedis, FileBackend, InProcessBackend, QuotaWaitTooLong, RateScheduler, RedisBackend
+
+
+@pytest.fixture(params=["memory", "file", "fake-redis", "resp"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        yield InProcessBackend()
+    elif request.param == "file":
+        yield FileBackend(str(tmp_path / "buckets.json"))
+    elif request.param == "fake-redis":
+        yield RedisBackend(FakeRedis())
+    else:
+        server = FakeRedisServer().start()
+        yield RedisBackend(RespClient.from_url(server.url))
+        server.stop()
+
+
+def test_backend_admits_burst_then_asks_to_wait(backend):
+    # 1 token per second, room for 3
+    assert [backend.reserve("k", 1, 1.0, 3.0) for _ in range(3)] == [0.0, 0.0, 0.0]
+    wait = backend.reserve("k", 1, 1.0, 3.0)
+    assert 0.9 < wait <= 1.0
+
+
+def test_backend_refusal_leaves_bucket_untouched(backend):
+    backend.reserve("k", 3, 1.0, 3.0)
+    assert backend.reserve("k", 1, 1.0, 3.0, max_wait=0.1) is None
+    # Still one second to wait for the next token: the refused reservation took nothing
+    assert backend.reserve("k", 1, 1.0, 3.0) <= 1.0
+
+
+def test_file_backend_is_shared_between_instances(tmp_path):
+    path = str(tmp_path / "buckets.json")
+    first, second = FileBackend(path), FileBackend(path)  # Two worker processes on one host
+    assert first.reserve("k", 2, 1.0, 2.0) == 0.0
+    assert second.reserve("k", 1, 1.0, 2.0) > 0.9
+
+
+def test_refused_tokens_reservation_refunds_the_request():
+    # Requests: 1/s, burst of 5; tokens: 10/s, burst of 50
+    scheduler = RateScheduler(
+        InProcessBackend(), {"generate": {"requests_per_minute": 60, "tokens_per_minute": 600}}, burst_seconds=5.0,
+    )
+    scheduler.acquire("generate", tokens=50, max_wait=0.0)  # Empties the tokens bucket, 4 requests left
+    with pytest.raises(QuotaWaitTooLong):
+        scheduler.acquire("generate", tokens=50, max_wait=0.1)
+    for _ in range(4):  # Only 3 would be left had the refused call kept its request
+        scheduler.acquire("generate", tokens=0, max_wait=0.0)
+    with pytest.raises(QuotaWaitTooLong):
+        scheduler.acquire("generate", tokens=0, max_wait=0.0)
+    assert scheduler.stats["generate"]["calls"] == 5
+
+
+def test_acquire_waits_its_turn():
+    scheduler = RateScheduler(InProcessBackend(), {"embed": {"requests_per_minute": 600}}, burst_seconds=0.1)
+    scheduler.acquire("embed")
+    assert 0.05 < scheduler.acquire("embed") <= 0.1  # 10 requests per second
+    assert scheduler.stats["embed"]["waited"] == 1
+
+
+def test_unlimited_kind_never_waits():
+    scheduler = RateScheduler(InProcessBackend(), {"embed": {"requests_per_minute": 0}})
+    assert all(scheduler.acquire("embed", max_wait=0.0) == 0.0 for _ in range(100))
@@ -0,0 +1,50 @@
+import numpy as np
+
+from section_tree import SectionTree, outline_levels, section_paths
+
+ROLES = r"^(?:SUPER |BRANCH )?ADMIN$|^TEACHER$"
+TOC = ["INTRODUCTION", "Login", "BRANCH ADMIN", "SETTINGS", "Role Permission", "System Update",
+       "ADMISSION", "Create Admission", "TEACHER", "ATTENDANCE", "Mark Attendance"]
+
+
+def test_outline_levels_follow_toc_casing():
+    assert outline_levels(TOC, ROLES) == [
+        ("INTRODUCTION", 1), ("Login", 2), ("BRANCH ADMIN", 1), ("SETTINGS", 2), ("Role Permission", 3),
+        ("System Update", 3), ("ADMISSION", 2), ("Create Admission", 3), ("TEACHER", 1), ("ATTENDANCE", 2),
+        ("Mark Attendance", 3),
+    ]
+
+
+def test_section_paths():
+    outline = outline_levels(TOC, ROLES)
+    paths = section_paths(["Login", "Role Permission", "Create Admission", "Mark Attendance", "Unknown"], outline)
+    assert paths == [
+        ("INTRODUCTION", "Login"),
+        ("BRANCH ADMIN", "SETTINGS", "Role Permission"),
+        ("BRANCH ADMIN", "ADMISSION", "Create Admission"),
+        ("TEACHER", "ATTENDANCE", "Mark Attendance"),
+        ("Unknown",),
+    ]
+
+
+def build_tree(vectors=None) -> SectionTree:
+    headings = ["Login", "Role Permission", "System Update", "Create Admission", "Mark Attendance"]
+    return SectionTree(section_paths(headings, outline_levels(TOC, ROLES)), vectors)
+
+
+def test_scopes_resolve_names_and_paths():
+    tree = build_tree()
+    assert tree.find("settings") == ("BRANCH ADMIN", "SETTINGS")
+    assert tree.find("Branch Admin > Settings") == ("BRANCH ADMIN", "SETTINGS")
+    assert tree.find("Teacher > Settings") is None
+    assert tree.rows(("BRANCH ADMIN",)).tolist() == [1, 2, 3]
+    assert "BRANCH ADMIN > SETTINGS" in tree.scopes()
+
+
+def test_coarse_rows_keep_the_best_subtree():
+    vectors = np.eye(5, dtype=np.float32)
+    tree = build_tree(vectors)
+    # Three modules under the roles level; keep the one whose centroid is closest to the query
+    rows = tree.coarse_rows(vectors[4], top_nodes=1)
+    assert 4 in rows.tolist()
+    assert 1 not in rows.tolist()
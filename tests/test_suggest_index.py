@@ -0,0 +1,49 @@
+import pytest
+
+from suggest_index import SuggestIndex
+
+
+def test_headings_match_any_word_prefix():
+    index = SuggestIndex()
+    index.add_headings(["Update Profile & Change Password", "Fee Reminders"])
+    assert [s["text"] for s in index.suggest("change pass")] == ["Update Profile & Change Password"]
+    assert index.suggest("f")[:1] == []  # Shorter than min_query_chars
+
+
+def test_question_is_suggested_once_popular():
+    index = SuggestIndex(min_count=2)
+    index.record_question("How do I add a student?")
+    assert index.suggest("how do i add") == []
+    index.record_question("how do I add a student")
+    assert index.suggest("how do i add") == [{"text": "How do I add a student?", "kind": "question", "count": 2}]
+
+
+def test_whole_text_prefix_matches_rank_first():
+    index = SuggestIndex(min_count=1)
+    index.add_headings(["Student Fees"])
+    index.record_question("fees for a new student", count=5)
+    assert [s["text"] for s in index.suggest("student")] == ["Student Fees", "fees for a new student"]
+
+
+def test_least_asked_suggestion_is_evicted():
+    index = SuggestIndex(max_questions=2, min_count=1, max_tracked=10)
+    index.record_question("alpha question", count=3)
+    index.record_question("beta question", count=1)
+    index.record_question("gamma question", count=2)
+    assert [s["text"] for s in index.suggest("question", limit=5)] == ["alpha question", "gamma question"]
+    assert index.suggest("beta") == []
+    assert index.stats()["evicted_questions"] == 1
+
+
+def test_tracked_questions_stay_bounded():
+    index = SuggestIndex(max_questions=2, min_count=1, max_tracked=3)
+    for i in range(50):
+        index.record_question(f"question number {i}")
+    stats = index.stats()
+    assert stats["tracked_questions"] <= 3
+    assert stats["questions"] == 2
+
+
+def test_max_tracked_must_exceed_max_questions():
+    with pytest.raises(ValueError):
+        SuggestIndex(max_questions=5, max_tracked=5)
@@ -0,0 +1,52 @@
+from token_counting import TokenCounter, token_counts_path_for
+
+TEXTS = ["Navigate to Settings > Role Permission and click Save.", "Log in as an administrator.", "Fee reminders."]
+
+
+def test_calibration_fits_the_scale():
+    counter = TokenCounter(scale=1.0)
+    exact = counter.calibrate(TEXTS, lambda text: 2 * len(text.split()))
+    assert counter.calibrated
+    assert exact == {text: 2 * len(text.split()) for text in TEXTS}
+    assert counter.estimate(TEXTS[0]) > TokenCounter(scale=1.0).estimate(TEXTS[0])
+
+
+def test_exact_counts_win_and_are_not_overwritten():
+    counter = TokenCounter()
+    counter.cache_texts(TEXTS, {TEXTS[0]: 99})
+    counter.cache_texts(TEXTS)  # A later pass with estimates only
+    assert counter.count(TEXTS[0]) == 99
+    assert counter.count(TEXTS[1]) == counter.estimate(TEXTS[1])
+
+
+def test_counts_survive_a_restart(tmp_path):
+    path = token_counts_path_for(str(tmp_path / "embeddings.pkl"))
+    assert path.endswith("embeddings.token_counts.json")
+    counter = TokenCounter()
+    counter.calibrate(TEXTS[:2], lambda text: 7)
+    counter.cache_texts(TEXTS, {TEXTS[0]: 7, TEXTS[1]: 7})
+    counter.save(path)
+
+    restarted = TokenCounter()
+    assert restarted.load(path, TEXTS) == 2
+    assert restarted.scale == counter.scale and restarted.calibrated
+    assert restarted.count(TEXTS[0]) == 7
+    assert TokenCounter().load(path, ["A section of another manual."]) == 0
+    assert TokenCounter().load(str(tmp_path / "missing.json"), TEXTS) == 0
+
+
+def test_truncate_fits_the_budget():
+    counter = TokenCounter()
+    text = " ".join(["word"] * 200)
+    truncated = counter.truncate(text, 50)
+    assert counter.estimate(truncated) <= 50
+    assert text.startswith(truncated) and not truncated.endswith(" ")
+
+
+def test_record_totals():
+    counter = TokenCounter()
+    counter.record("prompt", 100, exact=True)
+    counter.record("prompt", 50)
+    totals = counter.stats()["totals"]["prompt"]
+    assert (totals["count"], totals["tokens"], totals["max_tokens"], totals["exact"]) == (2, 150, 100, 1)
+    assert totals["mean_tokens"] == 75.0
@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+
+from vector_index import SectionIndex, full_precision_path_for, make_section_ids, projection_recall_report
+
+
+@pytest.fixture(scope="module")
+def vectors():
+    """Clustered unit vectors, like sections of one manual."""
+    rng = np.random.default_rng(0)
+    centres = rng.normal(size=(40, 96))
+    vectors = centres[rng.integers(0, 40, size=2000)] + rng.normal(scale=0.3, size=(2000, 96))
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+@pytest.fixture(scope="module")
+def queries(vectors):
+    rng = np.random.default_rng(1)
+    return vectors[rng.integers(0, len(vectors), size=50)] + rng.normal(scale=0.05, size=(50, vectors.shape[1]))
+
+
+def build(vectors, **kwargs) -> SectionIndex:
+    return SectionIndex([f"s{i}" for i in range(len(vectors))], [""] * len(vectors), vectors, **kwargs)
+
+
+def recall(index: SectionIndex, vectors, queries, k: int = 3) -> float:
+    hits = 0
+    for query in queries:
+        expected = set(np.argsort(-(vectors @ query))[:k])
+        hits += len(expected & {row for _, row in index.search_rows(query, top_n=k)})
+    return hits / (k * len(queries))
+
+
+def test_float32_search_is_exact(vectors, queries):
+    assert recall(build(vectors), vectors, queries) == 1.0
+
+
+@pytest.mark.parametrize("dtype", ["float16", "int8"])
+def test_quantised_index_with_rescoring_keeps_recall(vectors, queries, dtype):
+    index = build(vectors, dtype=dtype, rescore_candidates=20)
+    assert recall(index, vectors, queries) == 1.0
+    assert index.nbytes()["scan_vectors"] < vectors.astype(np.float32).nbytes
+    score, row = index.search_rows(queries[0], top_n=1)[0]
+    assert score == pytest.approx(float(vectors[row] @ queries[0] / np.linalg.norm(queries[0])), abs=1e-5)
+
+
+def test_int8_scan_alone_is_close(vectors, queries):
+    assert recall(build(vectors, dtype="int8", rescore_candidates=0), vectors, queries) >= 0.9
+
+
+@pytest.mark.parametrize("projection", ["truncate", "pca"])
+def test_projected_index_rescoring_keeps_recall(vectors, queries, projection):
+    index = build(vectors, projection=projection, projection_dim=48, rescore_candidates=30)
+    assert index.scan_dimension == 48
+    assert recall(index, vectors, queries) >= 0.95
+
+
+def test_projection_recall_report(vectors):
+    report = projection_recall_report(vectors, "pca", [8, 48, 96], k=3, max_rows=500)
+    assert [entry["dim"] for entry in report] == [8, 48, 96]
+    assert report[-1]["recall_at_k"] == 1.0
+    assert report[0]["recall_at_k"] <= report[-1]["recall_at_k"]
+
+
+@pytest.mark.parametrize("dtype", ["float32", "float16", "int8"])
+def test_batch_and_subset_search_agree_with_single_search(vectors, queries, dtype):
+    index = build(vectors, dtype=dtype, rescore_candidates=0)
+    batch = index.search_rows_batch(list(queries[:5]), top_n=3)
+    for query, found in zip(queries[:5], batch):
+        single = index.search_rows(query, top_n=3)
+        assert [row for _, row in found] == [row for _, row in single]
+        np.testing.assert_allclose([s for s, _ in found], [s for s, _ in single], atol=1e-5)
+    subset = index.search_rows(queries[0], top_n=3, rows=range(0, len(vectors), 2))
+    assert all(row % 2 == 0 for _, row in subset)
+
+
+def test_rescore_vectors_can_be_memory_mapped(vectors, queries, tmp_path):
+    path = full_precision_path_for(str(tmp_path / "cache.pkl"))
+    index = build(vectors, dtype="int8", full_precision_path=path)
+    assert index.nbytes()["rescore_vectors_mapped"] > 0
+    assert recall(index, vectors, queries) == 1.0
+
+
+def test_repeated_headings_get_distinct_ids():
+    assert make_section_ids(["Login", "Fees", "Login"]) == ["Login", "Fees", "Login#2"]
+
+
+def test_from_section_data_skips_invalid_embeddings():
+    data = [("a", "x", np.ones(4)), ("b", "y", np.array([])), ("c", "z", np.ones(3))]
+    index = SectionIndex.from_section_data(data)
+    assert index.headings == ["a"]
+    assert [heading for heading, _ in index.skipped_sections] == ["b", "c"]
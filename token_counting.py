@@ -0,0 +1,177 @@
+"""
+Token counting for budgets, truncation and cost accounting.
+
+Counting every text through the provider's count-tokens API would add a remote
+call per use, so counts come from a local estimator instead. It counts word and
+punctuation pieces, lets long words contribute extra pieces the way subword
+tokenizers split them, and multiplies by a scale factor. `calibrate` fits that
+factor against exact provider counts for a sample of manual sections at build
+time. Section texts are counted once and cached by content hash; the exact
+counts and the fitted scale are saved next to the embeddings cache, so other
+processes and restarts skip the count-tokens calls. `record` keeps running
+totals per kind of text (embedding inputs, prompts, responses), preferring the
+provider's own usage figures when a response has them.
+"""
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import threading
+
+_PIECE_PATTERN = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
+
+def raw_pieces(text: str, chars_per_subword: int = 6) -> int:
+    """Word/punctuation pieces, with long words counted as several subwords."""
+    pieces = 0
+    for piece in _PIECE_PATTERN.findall(text):
+        pieces += max(1, math.ceil(len(piece) / chars_per_subword))
+    return pieces
+
+
+class TokenCounter:
+    def __init__(self, scale: float = 1.1, max_cached: int = 50000):
+        self.scale = scale
+        self.calibrated = False
+        self.max_cached = max_cached
+        self._cache = {}  # sha1(text) -> tokens, for section texts
+        self._exact = set()  # Keys of _cache holding the provider's own count
+        self._lock = threading.Lock()
+        self._totals = {}
+
+    # --- Counting ---
+    def estimate(self, text: str) -> int:
+        if not text:
+            return 0
+        return max(1, round(raw_pieces(text) * self.scale))
+
+    def count(self, text: str) -> int:
+        """Cached count for texts seen at build time (section contents), else the estimate."""
+        if not text:
+            return 0
+        with self._lock:
+            cached = self._cache.get(_text_key(text))
+        return cached if cached is not None else self.estimate(text)
+
+    def cache_texts(self, texts: list, exact_counts: dict = None):
+        """
+        Counts `texts` once and keeps the results. `exact_counts` (text -> tokens) take precedence;
+        texts that already have a count keep it.
+        """
+        exact_counts = exact_counts or {}
+        with self._lock:
+            for text in texts:
+                key = _text_key(text)
+                tokens = exact_counts.get(text)
+                if tokens is not None:
+                    self._cache[key] = tokens
+                    self._exact.add(key)
+                elif key not in self._cache and len(self._cache) < self.max_cached:
+                    self._cache[key] = self.estimate(text)
+
+    def calibrate(self, texts: list, count_exact) -> dict:
+        """
+        Fits the scale factor so the estimate matches `count_exact(text) -> int` (the provider's
+        count-tokens call) over `texts`. Returns the exact counts, to be cached alongside estimates.
+        """
+        exact_counts, pieces = {}, 0
+        for text in texts:
+            exact_counts[text] = int(count_exact(text))
+            pieces += raw_pieces(text)
+        total = sum(exact_counts.values())
+        if pieces and total:
+            previous = self.scale
+            self.scale = total / pieces
+            self.calibrated = True
+            errors = [
+                abs(self.estimate(text) - tokens) / tokens for text, tokens in exact_counts.items() if tokens
+            ]
+            logging.info(
+                f"Token estimator calibrated on {len(exact_counts)} texts: "
+                f"scale {previous:.3f} -> {self.scale:.3f}, "
+                f"mean absolute error {sum(errors) / max(1, len(errors)):.1%}"
+            )
+        return exact_counts
+
+    # --- Persistence ---
+    def save(self, path: str):
+        """Writes the scale and the exact counts (not the estimates) to `path`."""
+        with self._lock:
+            state = {
+                "scale": self.scale,
+                "calibrated": self.calibrated,
+                "exact": {key: self._cache[key] for key in self._exact},
+            }
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, path)
+
+    def load(self, path: str, texts: list) -> int:
+        """
+        Restores what `save` wrote if it holds an exact count for any of `texts` (counts of
+        other manual versions are useless). Returns how many of `texts` have an exact count.
+        """
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            exact = {key: int(tokens) for key, tokens in state["exact"].items()}
+            scale = float(state["scale"])
+        except FileNotFoundError:
+            return 0
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            logging.warning(f"Ignoring unreadable token counts file '{path}': {e}")
+            return 0
+        matched = sum(1 for text in texts if _text_key(text) in exact)
+        if matched:
+            with self._lock:
+                self.scale = scale
+                self.calibrated = bool(state.get("calibrated"))
+                self._cache.update(exact)
+                self._exact.update(exact)
+        return matched
+
+    # --- Truncation ---
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Longest prefix of `text`, cut at a word boundary, whose estimate fits `max_tokens`."""
+        if self.estimate(text) <= max_tokens:
+            return text
+        low, high = 0, len(text)
+        while low < high:  # Largest prefix length that fits
+            mid = (low + high + 1) // 2
+            if self.estimate(text[:mid]) <= max_tokens:
+                low = mid
+            else:
+                high = mid - 1
+        cut = text.rfind(" ", 0, low + 1)
+        return text[:cut if cut > low // 2 else low].rstrip()
+
+    # --- Accounting ---
+    def record(self, kind: str, tokens: int, exact: bool = False):
+        """Adds one `kind` ("embedding_input", "prompt", "response", ...) text of `tokens` tokens."""
+        with self._lock:
+            totals = self._totals.setdefault(kind, {"count": 0, "tokens": 0, "max_tokens": 0, "exact": 0})
+            totals["count"] += 1
+            totals["tokens"] += tokens
+            totals["max_tokens"] = max(totals["max_tokens"], tokens)
+            totals["exact"] += 1 if exact else 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            totals = {kind: dict(values) for kind, values in self._totals.items()}
+            cached = len(self._cache)
+        for values in totals.values():
+            values["mean_tokens"] = values["tokens"] / values["count"] if values["count"] else 0.0
+        return {"scale": self.scale, "calibrated": self.calibrated, "cached_texts": cached, "totals": totals}
+
+
+def token_counts_path_for(cache_file: str) -> str:
+    """Sidecar JSON file (next to the embeddings cache) holding the calibration and exact counts."""
+    root, _ = os.path.splitext(cache_file)
+    return f"{root}.token_counts.json"
+
+
+def _text_key(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
@@ -0,0 +1,394 @@
+"""
+In-memory vector index over the embedded manual sections.
+
+Vectors are L2-normalised once at build time so a search is a single matrix
+product instead of one scipy `cosine` call per section. The scan matrix can be
+stored as float32, float16 or int8 (symmetric per-vector scalar quantisation;
+the recommended compact dtype, as float16 scans much slower than both others);
+for the quantised variants the top candidates are re-scored against float32
+vectors, which may live in a memory-mapped .npy file so that only the few rows
+being re-scored are ever paged in.
+
+The scan vectors can also be reduced in dimension, either by truncating and
+renormalising (Matryoshka-style) or with a PCA projection fitted at build
+time; queries go through the same projection and, as with quantisation, the
+candidates are re-scored at full dimension.
+"""
+import hashlib
+import logging
+import os
+
+import numpy as np
+
+from dedup import CompactTexts, text_bytes
+
+STORAGE_DTYPES = ("float32", "float16", "int8")
+PROJECTIONS = (None, "truncate", "pca")
+SCAN_BLOCK_ROWS = 4096  # Rows cast to float32 per block while scanning
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def fit_projection(vectors: np.ndarray, projection: str, dim: int):
+    """
+    Returns (mean, components) for `apply_projection`. Truncation needs no matrix
+    (components is just the kept width); "pca" is fitted uncentred (a truncated
+    SVD) so that inner products between indexed vectors survive the projection.
+    """
+    dim = min(dim, vectors.shape[1])
+    if projection == "truncate":
+        return None, dim
+    if projection == "pca":
+        _, _, vt = np.linalg.svd(vectors, full_matrices=False)
+        return None, vt[:dim].astype(np.float32)
+    raise ValueError(f"Unsupported projection '{projection}'. Expected one of {PROJECTIONS}.")
+
+
+def projected_dim(components) -> int:
+    return components if isinstance(components, int) else components.shape[0]
+
+
+def apply_projection(vectors: np.ndarray, mean, components) -> np.ndarray:
+    """Projects (and renormalises) one vector or a matrix of row vectors."""
+    if mean is not None:
+        vectors = vectors - mean
+    if isinstance(components, int):
+        projected = vectors[..., :components]
+    else:
+        projected = vectors @ components.T
+    if projected.ndim == 1:
+        norm = np.linalg.norm(projected)
+        return projected / norm if norm > 0 else projected
+    return _normalize_rows(projected)
+
+
+def projection_recall_report(vectors: np.ndarray, projection: str, dims: list, k: int = 3,
+                             max_rows: int = 2000) -> list:
+    """
+    Recall@k of reduced-dimension search against full-dimension search, using every
+    indexed vector as a query (its own row excluded). Used to pick a dimension.
+    Large indexes are sampled down to `max_rows` to keep the n x n scoring bounded.
+    """
+    normalized = _normalize_rows(np.asarray(vectors, dtype=np.float32))
+    if len(normalized) > max_rows:
+        rows = np.random.default_rng(0).choice(len(normalized), size=max_rows, replace=False)
+        normalized = normalized[rows]
+    n = len(normalized)
+    k = min(k, n - 1)
+    if k <= 0:
+        return []
+
+    def top_k(matrix):
+        scores = matrix @ matrix.T
+        np.fill_diagonal(scores, -np.inf)
+        return np.argpartition(-scores, k - 1, axis=1)[:, :k]
+
+    truth = top_k(normalized)
+    report = []
+    for dim in sorted(set(dims)):
+        mean, components = fit_projection(normalized, projection, dim)
+        if report and projected_dim(components) == report[-1]["dim"]:
+            continue  # PCA cannot exceed the number of vectors
+        found = top_k(apply_projection(normalized, mean, components))
+        hits = sum(len(set(found[i]) & set(truth[i])) for i in range(n))
+        report.append({"dim": projected_dim(components), "recall_at_k": hits / (k * n), "k": k})
+    return report
+
+
+def content_hash(heading: str, content: str) -> str:
+    return hashlib.sha256(f"{heading}\n{content}".encode("utf-8")).hexdigest()[:16]
+
+
+def make_section_ids(headings: list) -> list:
+    """Stable ids from headings; repeated headings ("Login Deactivate") get a #n suffix."""
+    seen = {}
+    ids = []
+    for heading in headings:
+        seen[heading] = seen.get(heading, 0) + 1
+        ids.append(heading if seen[heading] == 1 else f"{heading}#{seen[heading]}")
+    return ids
+
+
+def _is_valid_embedding(embedding) -> bool:
+    return isinstance(embedding, np.ndarray) and embedding.ndim == 1 and embedding.size > 0
+
+
+class SectionIndex:
+    """
+    Behaves like the legacy `section_data` list of (heading, content, embedding)
+    tuples (len(), iteration, indexing) so existing callers keep working, but
+    embeddings handed out are reconstructed on demand rather than held as float64.
+    """
+
+    def __init__(self, headings: list, contents: list, vectors: np.ndarray,
+                 dtype: str = "float32", rescore_candidates: int = 20,
+                 full_precision_path: str = None, projection: str = None,
+                 projection_dim: int = None, section_ids: list = None):
+        if dtype not in STORAGE_DTYPES:
+            raise ValueError(f"Unsupported index dtype '{dtype}'. Expected one of {STORAGE_DTYPES}.")
+        if projection not in PROJECTIONS:
+            raise ValueError(f"Unsupported projection '{projection}'. Expected one of {PROJECTIONS}.")
+        if len(headings) != len(contents) or len(headings) != len(vectors):
+            raise ValueError("Headings, contents and vectors must have the same length.")
+
+        self.headings = list(headings)
+        self.contents = list(contents)
+        # Callers holding one shard of a manual pass the ids the sections have in the whole manual
+        self.section_ids = list(section_ids) if section_ids is not None else make_section_ids(self.headings)
+        if len(self.section_ids) != len(self.headings):
+            raise ValueError("Section ids and headings must have the same length.")
+        self._rows_by_id = {section_id: row for row, section_id in enumerate(self.section_ids)}
+        self.content_hashes = [content_hash(h, c) for h, c in zip(self.headings, self.contents)]
+        self.manual_version = hashlib.sha256("".join(self.content_hashes).encode("utf-8")).hexdigest()[:16]
+        self._section_hashes = dict(zip(self.section_ids, self.content_hashes))
+        self.dtype = dtype
+        self.rescore_candidates = rescore_candidates
+        self.skipped_sections = []
+        self.duplicate_groups = list(range(len(self.headings)))  # Row -> first row of its near-duplicate group
+
+        normalized = _normalize_rows(np.asarray(vectors, dtype=np.float32)).astype(np.float32)
+        self.dimension = normalized.shape[1] if normalized.ndim == 2 else 0
+        self.projection = projection if len(normalized) else None
+        self._projection_mean = None
+        self._projection_components = None
+        self._scales = None
+        self._full = None
+
+        scan = normalized
+        if self.projection:
+            self._projection_mean, self._projection_components = fit_projection(
+                normalized, self.projection, projection_dim or self.dimension
+            )
+            scan = apply_projection(normalized, self._projection_mean, self._projection_components).astype(np.float32)
+        self.scan_dimension = scan.shape[1] if scan.ndim == 2 else 0
+
+        if dtype == "float32":
+            self._matrix = scan
+        elif dtype == "float16":
+            self._matrix = scan.astype(np.float16)
+        else:
+            max_abs = np.abs(scan).max(axis=1)
+            max_abs[max_abs == 0] = 1.0
+            self._scales = (max_abs / 127.0).astype(np.float32)
+            self._matrix = np.round(scan / self._scales[:, None]).astype(np.int8)
+
+        if (dtype != "float32" or self.projection) and rescore_candidates > 0:
+            if full_precision_path:
+                # Write-then-rename so workers already mapping the old file are unaffected
+                tmp_path = f"{full_precision_path}.{os.getpid()}.tmp.npy"
+                np.save(tmp_path, normalized)
+                os.replace(tmp_path, full_precision_path)
+                self._full = np.load(full_precision_path, mmap_mode="r")
+            else:
+                self._full = normalized
+
+    @classmethod
+    def from_section_data(cls, section_data: list, section_ids: list = None, **kwargs) -> "SectionIndex":
+        """Builds an index from (heading, content, embedding) tuples, skipping invalid embeddings."""
+        headings, contents, vectors, skipped, kept_ids = [], [], [], [], []
+        dimension = None
+        for i, (heading, content, embedding) in enumerate(section_data):
+            if not _is_valid_embedding(embedding):
+                logging.warning(f"Skipping section '{heading}' due to invalid or empty embedding.")
+                skipped.append((heading, "invalid embedding"))
+                continue
+            if dimension is None:
+                dimension = embedding.size
+            elif embedding.size != dimension:
+                logging.warning(f"Skipping section '{heading}': embedding dimension {embedding.size} != {dimension}.")
+                skipped.append((heading, "dimension mismatch"))
+                continue
+            headings.append(heading)
+            contents.append(content)
+            vectors.append(embedding)
+            if section_ids is not None:
+                kept_ids.append(section_ids[i])
+        matrix = np.vstack(vectors) if vectors else np.zeros((0, 0), dtype=np.float32)
+        index = cls(headings, contents, matrix, section_ids=kept_ids if section_ids is not None else None, **kwargs)
+        index.skipped_sections = skipped
+        return index
+
+    # --- Sequence protocol (legacy section_data compatibility) ---
+    def __len__(self):
+        return len(self.headings)
+
+    def __getitem__(self, i):
+        return self.headings[i], self.contents[i], self.vector(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def vector(self, i: int) -> np.ndarray:
+        """
+        Returns the (unit-length) float32 vector of row `i`: full dimension when
+        re-scoring vectors are kept, otherwise the stored scan vector.
+        """
+        if self._full is not None:
+            return np.asarray(self._full[i], dtype=np.float32)
+        return self._dequantize(i, i + 1)[0]
+
+    def _dequantize(self, start: int, stop: int) -> np.ndarray:
+        block = self._matrix[start:stop].astype(np.float32)
+        if self._scales is not None:
+            block *= self._scales[start:stop, None]
+        return block
+
+    # --- Search ---
+    def _approximate_scores(self, query: np.ndarray, rows: np.ndarray = None) -> np.ndarray:
+        """
+        Scan scores for one query vector, or for a (scan dimension x queries) matrix of them.
+        Quantised blocks are cast into one reused float32 buffer and the int8 scales are applied
+        to the scores, not to every element. The cast itself remains: int8 scans about 2-3x slower
+        than float32, and float16 (numpy has no fast half-precision cast) about 10x slower, so
+        float16 only trades speed for memory and int8 is the compact dtype to use.
+        """
+        if rows is not None:
+            return self._scale_scores(self._matrix[rows].astype(np.float32) @ query, rows)
+        if self.dtype == "float32":
+            return self._matrix @ query
+        scores = np.empty((len(self),) + query.shape[1:], dtype=np.float32)
+        buffer = np.empty((min(SCAN_BLOCK_ROWS, len(self)), self._matrix.shape[1]), dtype=np.float32)
+        for start in range(0, len(self), SCAN_BLOCK_ROWS):
+            stop = min(start + SCAN_BLOCK_ROWS, len(self))
+            block = buffer[:stop - start]
+            np.copyto(block, self._matrix[start:stop], casting="unsafe")
+            np.matmul(block, query, out=scores[start:stop])
+        return self._scale_scores(scores)
+
+    def _scale_scores(self, scores: np.ndarray, rows: np.ndarray = None) -> np.ndarray:
+        """Applies the per-vector int8 scales to raw scan scores (a row scale factors out of the product)."""
+        if self._scales is None:
+            return scores
+        scales = self._scales if rows is None else self._scales[rows]
+        scores *= scales[:, None] if scores.ndim == 2 else scales
+        return scores
+
+    def prepare_query(self, query_embedding) -> np.ndarray:
+        query = np.asarray(query_embedding, dtype=np.float32).ravel()
+        if query.size != self.dimension:
+            raise ValueError(f"Query embedding dimension {query.size} does not match index dimension {self.dimension}.")
+        norm = np.linalg.norm(query)
+        return query / norm if norm > 0 else query
+
+    def project_query(self, query: np.ndarray) -> np.ndarray:
+        """Maps a prepared (full-dimension) query into the scan space."""
+        if not self.projection:
+            return query
+        return apply_projection(query, self._projection_mean, self._projection_components).astype(np.float32)
+
+    def search(self, query_embedding, top_n: int = 3) -> list:
+        """Returns up to `top_n` (similarity, heading, content) tuples, most similar first."""
+        return [
+            (score, self.headings[row], self.contents[row])
+            for score, row in self.search_rows(query_embedding, top_n)
+        ]
+
+    def search_rows(self, query_embedding, top_n: int = 3, rows=None) -> list:
+        """Like `search`, but returns (similarity, row) pairs; `rows` restricts the scan to a subset."""
+        if rows is not None:
+            rows = np.unique(np.asarray(rows, dtype=np.int64))
+            rows = rows[(rows >= 0) & (rows < len(self))]
+        scanned = len(self) if rows is None else len(rows)
+        if scanned == 0 or top_n <= 0:
+            return []
+        query = self.prepare_query(query_embedding)
+        scores = self._approximate_scores(self.project_query(query), rows)
+
+        n_candidates = min(scanned, top_n if self._full is None else max(top_n, self.rescore_candidates))
+        candidates = np.argpartition(-scores, n_candidates - 1)[:n_candidates]
+        candidate_scores = scores[candidates]
+        if rows is not None:
+            candidates = rows[candidates]
+        if self._full is not None:
+            candidates = np.sort(candidates)  # Sequential reads from the memory map
+            candidate_scores = np.asarray(self._full[candidates], dtype=np.float32) @ query
+
+        order = np.argsort(-candidate_scores, kind="stable")[:top_n]
+        return [(float(candidate_scores[j]), int(candidates[j])) for j in order]
+
+    def search_rows_batch(self, query_embeddings: list, top_n: int = 3) -> list:
+        """`search_rows` for many queries: the scan is one matrix product for the whole batch."""
+        if len(self) == 0 or top_n <= 0 or not len(query_embeddings):
+            return [[] for _ in query_embeddings]
+        queries = np.vstack([self.prepare_query(query) for query in query_embeddings])
+        scan_queries = queries
+        if self.projection:
+            scan_queries = apply_projection(queries, self._projection_mean, self._projection_components).astype(np.float32)
+        scores = self._approximate_scores(np.ascontiguousarray(scan_queries.T))  # (rows, queries)
+
+        n_candidates = min(len(self), top_n if self._full is None else max(top_n, self.rescore_candidates))
+        candidate_rows = np.argpartition(-scores, n_candidates - 1, axis=0)[:n_candidates].T
+        results = []
+        for j, candidates in enumerate(candidate_rows):
+            if self._full is not None:
+                candidates = np.sort(candidates)  # Sequential reads from the memory map
+                candidate_scores = np.asarray(self._full[candidates], dtype=np.float32) @ queries[j]
+            else:
+                candidate_scores = scores[candidates, j]
+            order = np.argsort(-candidate_scores, kind="stable")[:top_n]
+            results.append([(float(candidate_scores[k]), int(candidates[k])) for k in order])
+        return results
+
+    def score_rows(self, query_embedding, rows: list) -> list:
+        """Scores only the given rows (e.g. a previous turn's results); (similarity, row) pairs, best first."""
+        rows = sorted({int(row) for row in rows if 0 <= int(row) < len(self)})
+        return self.search_rows(query_embedding, top_n=len(rows), rows=rows) if rows else []
+
+    def row_of(self, section_id: str):
+        """Row holding `section_id`, or None if this index doesn't have it."""
+        return self._rows_by_id.get(section_id)
+
+    def section_hashes(self) -> dict:
+        """Maps section id -> content hash for the currently loaded manual."""
+        return self._section_hashes
+
+    @property
+    def duplicate_groups(self) -> list:
+        return self._duplicate_groups
+
+    @duplicate_groups.setter
+    def duplicate_groups(self, groups: list):
+        self._duplicate_groups = list(groups)
+        self.has_near_duplicates = any(group != row for row, group in enumerate(self._duplicate_groups))
+
+    def compact_contents(self) -> bool:
+        """Stores repeated lines of section text once; kept only if that is actually smaller."""
+        compact = CompactTexts(self.contents)
+        if compact.nbytes() >= text_bytes(self.contents):
+            return False
+        self.contents = compact
+        return True
+
+    # --- Introspection ---
+    def text_nbytes(self) -> int:
+        """Memory held by headings and section text, Python object overhead included."""
+        heading_bytes = text_bytes(self.headings)
+        if isinstance(self.contents, CompactTexts):
+            return heading_bytes + self.contents.nbytes()
+        return heading_bytes + text_bytes(self.contents)
+
+    def nbytes(self) -> dict:
+        full_in_memory = self._full is not None and not isinstance(self._full, np.memmap)
+        projection_bytes = sum(
+            a.nbytes for a in (self._projection_mean, self._projection_components) if isinstance(a, np.ndarray)
+        )
+        return {
+            "scan_vectors": int(self._matrix.nbytes + (self._scales.nbytes if self._scales is not None else 0)),
+            "rescore_vectors_in_memory": int(self._full.nbytes) if full_in_memory else 0,
+            "rescore_vectors_mapped": int(self._full.nbytes) if isinstance(self._full, np.memmap) else 0,
+            "projection": int(projection_bytes),
+            "text": self.text_nbytes(),
+        }
+
+
+def full_precision_path_for(cache_file: str, shard: tuple = None) -> str:
+    """Sidecar .npy file (next to the embeddings cache) holding float32 vectors for re-scoring."""
+    root, _ = os.path.splitext(cache_file)
+    if shard is not None:
+        root = f"{root}.shard{shard[0]}of{shard[1]}"
+    return f"{root}.rescore.f32.npy"
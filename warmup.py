@@ -0,0 +1,154 @@
+"""
+Cache warm-up from historical question logs.
+
+Ranks logged questions by frequency and runs the most popular ones through
+`answer_question`, which fills the question-embedding cache and keeps the
+generated answers in the answer cache and store, so the first users after a
+deploy or a manual update don't pay full generation latency. Calls are paced by
+a simple rate limit so warm-up never competes with live traffic for quota.
+
+Cached answers are keyed by answer mode, so questions are asked in /ask's
+default mode, and the report counts how many warmed answers /ask can actually
+serve ("reachable"); not-found and extractive replies are never kept.
+
+Question logs may be plain text (one question per line), JSONL with a
+"question" field, or the API's own log output ("Processing question: ..."),
+in text or JSON log format.
+
+    python warmup.py questions.log --limit 200 --rate 1.0
+"""
+import argparse
+import json
+import logging
+import re
+import threading
+import time
+from collections import Counter
+
+from answer_store import normalize_question
+
+_LOG_LINE_PATTERN = re.compile(r"Processing question: (.+?)(?: \| \w+=.*)?$")  # Drops structured log fields
+
+
+def load_question_counts(path: str) -> Counter:
+    """Counts questions in a log, keyed by normalised question; keeps the first spelling seen."""
+    counts = Counter()
+    spellings = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("{"):
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                question = entry.get("question", "")
+                if not question:  # JSON-formatted API log line
+                    match = _LOG_LINE_PATTERN.search(str(entry.get("message", "")))
+                    question = match.group(1) if match else ""
+            else:
+                match = _LOG_LINE_PATTERN.search(line)
+                question = match.group(1) if match else line
+            question = question.strip()
+            if not question or len(question) > 500:
+                continue
+            key = normalize_question(question)
+            counts[key] += 1
+            spellings.setdefault(key, question)
+    return Counter({spellings[key]: count for key, count in counts.items()})
+
+
+def rank_questions(counts: Counter, limit: int, min_count: int = 1) -> list:
+    return [question for question, count in counts.most_common(limit) if count >= min_count]
+
+
+def warm_up(questions: list, section_data, answer_store=None, rate_per_second: float = 1.0,
+            threshold: float = 0.40, top_n: int = 3, stop_event: threading.Event = None, mode: str = None) -> dict:
+    """
+    Answers each question in order, at most `rate_per_second` remote-hitting questions per
+    second, in `mode` (default: DEFAULT_ANSWER_MODE, as /ask). Questions already answered
+    in the store are skipped without waiting.
+    """
+    from chatbot import DEFAULT_ANSWER_MODE, answer_is_cached, answer_question
+
+    mode = mode or DEFAULT_ANSWER_MODE
+    stats = {"questions": len(questions), "warmed": 0, "reachable": 0, "already_warm": 0, "failed": 0}
+    interval = 1.0 / rate_per_second if rate_per_second > 0 else 0.0
+    section_hashes = section_data.section_hashes() if hasattr(section_data, "section_hashes") else {}
+    next_slot = time.monotonic()
+    started = time.monotonic()
+
+    for question in questions:
+        if stop_event is not None and stop_event.is_set():
+            logging.info("Warm-up stopped early.")
+            break
+        if answer_store is not None and answer_store.has_valid(question, section_hashes):
+            stats["already_warm"] += 1
+            continue
+
+        delay = next_slot - time.monotonic()
+        if delay > 0:
+            if stop_event is not None:
+                if stop_event.wait(delay):
+                    break
+            else:
+                time.sleep(delay)
+        next_slot = max(next_slot, time.monotonic()) + interval
+
+        try:
+            answer_question(question, section_data, threshold=threshold, top_n=top_n, answer_store=answer_store,
+                            mode=mode)
+            stats["warmed"] += 1
+            if answer_is_cached(section_data, question, mode) or (
+                answer_store is not None and answer_store.has_valid(question, section_hashes)
+            ):
+                stats["reachable"] += 1
+        except Exception as e:
+            logging.warning(f"Warm-up failed for question '{question}': {e}")
+            stats["failed"] += 1
+
+    stats["elapsed_s"] = time.monotonic() - started
+    logging.info(
+        f"Warm-up finished: {stats['warmed']} warmed ({stats['reachable']} reachable by /ask), "
+        f"{stats['already_warm']} already warm, "
+        f"{stats['failed']} failed in {stats['elapsed_s']:.1f}s"
+    )
+    return stats
+
+
+def start_background_warm_up(log_path: str, limit: int, section_data, answer_store=None,
+                             rate_per_second: float = 1.0) -> threading.Event:
+    """Runs the warm-up on a daemon thread. Set the returned event to stop it early."""
+    stop_event = threading.Event()
+
+    def run():
+        try:
+            questions = rank_questions(load_question_counts(log_path), limit)
+        except OSError as e:
+            logging.warning(f"Cannot read warm-up question log '{log_path}': {e}")
+            return
+        logging.info(f"Warming up {len(questions)} popular questions from '{log_path}'")
+        warm_up(questions, section_data, answer_store, rate_per_second, stop_event=stop_event)
+
+    threading.Thread(target=run, name="answer-warmup", daemon=True).start()
+    return stop_event
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute answers for popular logged questions")
+    parser.add_argument("log", help="Question log (.txt, .jsonl or API log output)")
+    parser.add_argument("--limit", type=int, default=200, help="Number of most frequent questions to warm")
+    parser.add_argument("--min-count", type=int, default=2, help="Ignore questions asked fewer times")
+    parser.add_argument("--rate", type=float, default=1.0, help="Max questions per second sent to Gemini")
+    args = parser.parse_args()
+
+    from answer_store import AnswerStore
+    from chatbot import ANSWER_STORE_FILE, load_section_index
+
+    section_index = load_section_index()
+    store = AnswerStore(ANSWER_STORE_FILE)
+    store.invalidate_changed(section_index.section_hashes())
+    ranked = rank_questions(load_question_counts(args.log), args.limit, args.min_count)
+    print(json.dumps(warm_up(ranked, section_index, store, args.rate), indent=2))